@@ -0,0 +1,231 @@
+# aggregates.py
+from __future__ import annotations
+import datetime as dt
+import hashlib, json, os, zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from dates import date_ordinal, window_bounds
+from phase2_fetch import Review
+from phase2b_summarize import THEME_KEYWORDS, THEME_MATCHER, FactsAccumulator, sentiment_bucket
+from quotes import MIN_CHARS, quote_score
+from tracing import traced
+
+VERSION = 1
+_BUCKETS = ("positive", "neutral", "negative")
+
+def _key(r: Review) -> str:
+    return r.review_id or "h:" + hashlib.sha1(f"{r.date}|{r.text}".encode("utf-8")).hexdigest()[:16]
+
+def _fingerprint(r: Review) -> int:
+    # everything a review contributes: counts, themes and (as a quote) its text/author
+    return zlib.crc32(f"{r.rating}|{r.date}|{r.author}|{r.text}".encode("utf-8"))
+
+def add_cell(cell: List[Any], other: List[Any]) -> None:
+    # cell += other, for [count, rating_sum, pos, neu, neg, {theme: [pos, neu, neg]}]
+    for i in range(5):
+        cell[i] += other[i]
+    for t, c in other[5].items():
+        acc = cell[5].setdefault(t, [0, 0, 0])
+        for i in range(3):
+            acc[i] += c[i]
+
+class PubAggregate:
+    """
+    Mergeable aggregate state for one pub, persisted as JSON next to its facts:
+
+    - days: ordinal -> [count, rating_sum, pos, neu, neg, {theme: [pos, neu, neg]}]
+      (ordinal 0 holds undated reviews)
+    - reviews: key -> [fingerprint, ordinal, rating, sentiment index, [themes]],
+      the contribution of each review, so an edit or removal can be subtracted
+    - quotes: "YYYY-MM" -> bounded pool of quote candidates for that month
+
+    sync()/apply() fold in only new, edited or removed reviews (unchanged ones
+    cost a checksum and a dict lookup), and facts() rebuilds any window from
+    the day buckets, so a refresh costs O(days + changed reviews), not
+    O(history). Counts, themes and trends match build_facts exactly; quotes
+    come from the month pools (the best few per sentiment/theme by
+    quality, before recency), which gives the same picks in practice.
+    """
+
+    def __init__(self, key: str, *, k_quotes: int = 3, k_theme: int = 1, pool_factor: int = 4):
+        self.key = key
+        self.k_quotes = k_quotes
+        self.k_theme = k_theme
+        self.pool_factor = pool_factor
+        self.days: Dict[int, List[Any]] = {}
+        self.reviews: Dict[str, List[Any]] = {}
+        self.quotes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.updated_at: Optional[str] = None
+
+    # -- persistence --
+    @staticmethod
+    def _signature() -> Dict[str, Any]:
+        # state built under other themes/thresholds can't be patched; it is rebuilt
+        return {"v": VERSION, "themes": sorted(THEME_KEYWORDS)}
+
+    @classmethod
+    def load(cls, path: Path, key: Optional[str], **kwargs: Any) -> "PubAggregate":
+        """
+        Saved state for `key`, or an empty aggregate if missing, stale or for
+        another pub. `key=None` accepts whichever pub the file holds.
+        """
+        agg = cls(key or "", **kwargs)
+        try:
+            doc = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return agg
+        if doc.get("signature") != cls._signature() or (key is not None and doc.get("key") != key):
+            return agg
+        agg.key = doc.get("key") or agg.key
+        agg.days = {int(d): v for d, v in doc["days"].items()}
+        agg.reviews = doc["reviews"]
+        agg.quotes = doc.get("quotes") or {}
+        agg.updated_at = doc.get("updated_at")
+        return agg
+
+    def save(self, path: Path) -> None:
+        self.updated_at = dt.datetime.utcnow().isoformat() + "Z"
+        doc = {"signature": self._signature(), "key": self.key, "updated_at": self.updated_at,
+               "days": {str(d): v for d, v in sorted(self.days.items())},
+               "reviews": self.reviews, "quotes": self.quotes}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(doc, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+
+    # -- deltas --
+    def _bump(self, day: int, rating: float, b: int, themes: List[str], sign: int) -> None:
+        cell = self.days.get(day)
+        if cell is None:
+            cell = self.days[day] = [0, 0.0, 0, 0, 0, {}]
+        cell[0] += sign
+        cell[1] += sign * rating
+        cell[2 + b] += sign
+        for t in themes:
+            c = cell[5].setdefault(t, [0, 0, 0])
+            c[b] += sign
+            if not any(c):
+                del cell[5][t]
+        if cell[0] == 0:
+            del self.days[day]
+
+    def _remove(self, key: str) -> None:
+        fp, day, rating, b, themes = self.reviews.pop(key)
+        self._bump(day, rating, b, themes, -1)
+        for pool in self.quotes.values():
+            if pool.pop(key, None) is not None:
+                break
+
+    def _add(self, key: str, r: Review, fp: int) -> None:
+        day = date_ordinal(r.date)
+        bucket = sentiment_bucket(r.rating)
+        b = _BUCKETS.index(bucket)
+        themes = sorted(THEME_MATCHER.match(r.text))
+        self.reviews[key] = [fp, day, r.rating, b, themes]
+        self._bump(day, r.rating, b, themes, 1)
+        if len(r.text) >= MIN_CHARS:
+            month = r.date[:7] if day else ""
+            pool = self.quotes.setdefault(month, {})
+            pool[key] = {"id": r.review_id, "rating": r.rating, "date": r.date, "text": r.text,
+                         "author": r.author, "b": bucket, "themes": themes,
+                         "s": round(quote_score(r.text, len(themes), None), 6)}
+            if len(pool) > 2 * self._pool_cap():
+                self._prune(pool)
+
+    def _pool_cap(self) -> int:
+        return self.pool_factor * (2 * self.k_quotes + len(THEME_KEYWORDS) * self.k_theme)
+
+    def _prune(self, pool: Dict[str, Dict[str, Any]]) -> None:
+        """Keep the candidates that are top-ranked for their sentiment or for any of their themes."""
+        ranked = sorted(pool.items(), key=lambda kv: (kv[1]["s"], kv[1]["id"]), reverse=True)
+        keep, seen = set(), {}
+        for k, c in ranked:
+            slots = [(c["b"], self.k_quotes)] if c["b"] != "neutral" else []
+            slots += [(("t", t), self.k_theme) for t in c["themes"]]
+            for slot, k_slot in slots:
+                n = seen.get(slot, 0)
+                if n < k_slot * self.pool_factor:
+                    seen[slot] = n + 1
+                    keep.add(k)
+        for k in [k for k in pool if k not in keep]:
+            del pool[k]
+
+    @traced("aggregate.sync")
+    def apply(self, reviews: Iterable[Review], *,
+              complete: Union[bool, Callable[[], bool]] = False) -> Dict[str, int]:
+        """
+        Fold reviews in as deltas. With `complete=True`, `reviews` is the
+        pub's whole history and anything not in it is removed. `complete`
+        may be a callable, asked once `reviews` is consumed (for a stream
+        that only knows at the end whether it stopped early).
+        Returns {"added", "updated", "removed", "unchanged"}.
+        """
+        out = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+        for r in reviews:
+            key = _key(r)
+            seen.add(key)
+            fp = _fingerprint(r)
+            prev = self.reviews.get(key)
+            if prev is not None:
+                if prev[0] == fp:
+                    out["unchanged"] += 1
+                    continue
+                self._remove(key)
+                out["updated"] += 1
+            else:
+                out["added"] += 1
+            self._add(key, r, fp)
+        if complete() if callable(complete) else complete:
+            for key in [k for k in self.reviews if k not in seen]:
+                self._remove(key)
+                out["removed"] += 1
+        for pool in self.quotes.values():
+            if len(pool) > self._pool_cap():
+                self._prune(pool)
+        return out
+
+    def sync(self, reviews: Iterable[Review]) -> Dict[str, int]:
+        """apply() with the full review history (removals included)."""
+        return self.apply(reviews, complete=True)
+
+    def merge(self, other: "PubAggregate") -> None:
+        """Add another aggregate's day buckets and quote pools (e.g. for a group of pubs)."""
+        for day, cell in other.days.items():
+            add_cell(self.days.setdefault(day, [0, 0.0, 0, 0, 0, {}]), cell)
+        for month, pool in other.quotes.items():
+            self.quotes.setdefault(month, {}).update({f"{other.key}|{k}": c for k, c in pool.items()})
+
+    # -- reads --
+    @traced("aggregate.facts")
+    def facts(self, window: str, *, today: Optional[dt.date] = None, trends: bool = False) -> Dict[str, Any]:
+        """Same facts dict as build_facts(reviews, window, trends=...), from the stored state."""
+        acc = FactsAccumulator(window, today=today, quotes_n=2 * self.k_quotes,
+                               theme_quotes=self.k_theme, trends=trends)
+        for day in sorted(self.days):
+            count, rating_sum, pos, neu, neg, themes = self.days[day]
+            acc.add_day(day, count, rating_sum, pos, neu, neg, themes)
+        win = window_bounds(window, today)
+        for month in sorted(self.quotes):
+            for c in self.quotes[month].values():
+                d = date_ordinal(c["date"])
+                if win is None or (d and win[0] <= d <= win[1]):
+                    acc.quotes.add(Review(c["id"], c["rating"], c["date"], "", c["text"], c["author"]),
+                                   c["b"], frozenset(c["themes"]))
+        return acc.facts()
+
+    def totals(self, bounds: Optional[Tuple[int, int]]) -> List[Any]:
+        """
+        [count, rating_sum, pos, neu, neg, {theme: [pos, neu, neg]}] summed
+        over the days in `bounds` (from window_bounds; None = all, undated included).
+        """
+        out: List[Any] = [0, 0.0, 0, 0, 0, {}]
+        for day, cell in self.days.items():
+            if bounds is None or (day and bounds[0] <= day <= bounds[1]):
+                add_cell(out, cell)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {"reviews": len(self.reviews), "days": len(self.days),
+                "quote_candidates": sum(len(p) for p in self.quotes.values())}
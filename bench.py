@@ -0,0 +1,284 @@
+# bench.py
+from __future__ import annotations
+import gc, json, platform, random, statistics, subprocess, sys, time, tracemalloc
+import datetime as dt
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# ---------------- Synthetic corpus ----------------
+_OPENERS = ["Lovely pub", "Popped in for lunch", "Sunday roast with the family", "Quiz night with friends",
+            "Watched the match here", "Stopped by after work", "Birthday meal", "Quick pint"]
+_GOOD = ["the staff were friendly and attentive", "food was tasty and hot", "great value on the 2-for deal",
+         "cosy atmosphere and a clean garden", "the quiz host was brilliant", "service was quick",
+         "bar staff remembered our order", "steak cooked perfectly", "kids loved the play area",
+         "live music on Saturday was great"]
+_BAD = ["waited 45 minutes for food", "chicken was undercooked", "the lasagne came out cold",
+        "staff seemed rude and slow", "tables were dirty", "too expensive for what it is",
+        "it felt like the meal was microwaved", "the noise from the tv was too much",
+        "nobody came to take our order", "portion was tiny"]
+_FILLER = ["to be honest", "overall", "I think", "again", "as usual", "this time", "sadly", "really"]
+_NAMES = ["Stacey", "Dave", "Priya", "Tom", "Aisha", "Gareth", "Megan", "Luis", "Hannah", "Raj"]
+_RELATIVE = ["a day ago", "a week ago", "2 weeks ago", "a month ago", "3 months ago", "a year ago"]
+_RATING_WEIGHTS = [(5, 55), (4, 20), (3, 8), (2, 6), (1, 11)]
+
+def synthetic_reviews(n: int, *, seed: int = 0, today: Optional[dt.date] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Deterministic SerpAPI-shaped review dicts. Field variants follow what
+    normalize_review accepts: iso_date / iso_date_of_last_edit / epoch `time` /
+    "... UTC" `date` / undated, snippet / text / content, user.name /
+    author_name / author, and the odd rating sent as a string.
+    """
+    rng = random.Random(seed)
+    # dates are relative to today, so lastN windows select the same share of rows on any day
+    today = today or dt.date.today()
+    ratings, weights = zip(*_RATING_WEIGHTS)
+    for i in range(n):
+        rating = rng.choices(ratings, weights)[0]
+        day = today - dt.timedelta(days=int(rng.expovariate(1 / 400)))   # recent-heavy, long tail
+        pool = _GOOD if rating >= 4 else _BAD if rating <= 2 else _GOOD + _BAD
+        parts = [rng.choice(_OPENERS)] + [rng.choice(pool) for _ in range(rng.randint(1, 4))]
+        parts += rng.sample(_FILLER, rng.randint(0, 3))
+        text = ", ".join(parts) + "."
+        r: Dict[str, Any] = {"review_id": f"syn{seed}_{i}", "rating": rating,
+                             "relative_time_description": rng.choice(_RELATIVE)}
+        v = rng.random()
+        if v < 0.70:
+            r["iso_date"] = f"{day.isoformat()}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z"
+        elif v < 0.80:
+            r["iso_date_of_last_edit"] = f"{day.isoformat()}T12:00:00Z"
+        elif v < 0.88:
+            r["time"] = int(dt.datetime(day.year, day.month, day.day, 12).timestamp())
+        elif v < 0.95:
+            r["date"] = f"{day.isoformat()} 12:00:00 UTC"
+        # else undated: relative time only
+        v = rng.random()
+        key = "snippet" if v < 0.80 else "text" if v < 0.90 else "content" if v < 0.95 else None
+        if key:
+            r[key] = text
+        v = rng.random()
+        name = f"{rng.choice(_NAMES)} {chr(65 + i % 26)}."
+        if v < 0.70:
+            r["user"] = {"name": name, "link": f"https://maps.google.com/u/{i}", "reviews": rng.randint(1, 300)}
+        elif v < 0.85:
+            r["author_name"] = name
+        elif v < 0.95:
+            r["author"] = name
+        if rng.random() < 0.02:
+            r["rating"] = f"{rating}.0"
+        yield r
+
+def synthetic_payload(n: int, *, seed: int = 0) -> Dict[str, Any]:
+    """Envelope in the shape fetch_all_reviews returns."""
+    return {"data_id": f"0xsynthetic{seed}", "count": n, "meta": {"synthetic": True, "seed": seed},
+            "reviews": list(synthetic_reviews(n, seed=seed))}
+
+# ---------------- Stages ----------------
+Stage = Tuple[str, Callable[[Dict[str, Any]], Any]]
+
+def _stages() -> List[Stage]:
+    import phase2b_summarize as p2b
+
+    return [
+        ("normalize_reviews", lambda c: p2b.normalize_reviews(c["payload"])),
+        ("theme_breakdown", lambda c: p2b.theme_breakdown(c["reviews"])),
+        ("basic_metrics", lambda c: p2b.basic_metrics(c["reviews"])),
+        ("filter_window_last90", lambda c: p2b.filter_window(c["reviews"], "last90")),
+        ("sample_quotes", lambda c: p2b.sample_quotes(c["reviews"])),
+        ("build_facts", lambda c: p2b.build_facts(c["reviews"], "last90")),
+        ("build_facts_trends", lambda c: p2b.build_facts(c["reviews"], "last90", trends=True)),
+    ]
+
+def _context(n: int, seed: int) -> Dict[str, Any]:
+    import phase2b_summarize as p2b
+
+    ctx: Dict[str, Any] = {"payload": synthetic_payload(n, seed=seed)}
+    ctx["reviews"] = p2b.normalize_reviews(ctx["payload"])
+    return ctx
+
+def _time(fn: Callable[[], Any], repeat: int, min_time: float) -> List[float]:
+    """
+    At least `repeat` runs, and more while the total is under `min_time` (tiny
+    stages are noisy). GC is off while timing, as in timeit.
+    """
+    times: List[float] = []
+    start = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - start < min_time and len(times) < 1000):
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        finally:
+            gc.enable()
+    return times
+
+def _peak_kb(fn: Callable[[], Any]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+def run_suite(sizes: List[int], *, seed: int = 0, repeat: int = 5, min_time: float = 0.2,
+              only: Optional[List[str]] = None, memory: bool = True) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for n in sizes:
+        t0 = time.perf_counter()
+        ctx = _context(n, seed)
+        print(f"[info] {n:,} synthetic reviews ready in {time.perf_counter() - t0:.2f}s")
+        row: Dict[str, Any] = {}
+        for name, stage in _stages():
+            if only and name not in only:
+                continue
+            fn = lambda: stage(ctx)
+            times = _time(fn, repeat, min_time)
+            best, med = min(times), statistics.median(times)
+            row[name] = {
+                "best_s": round(best, 6),
+                "median_s": round(med, 6),
+                "runs": len(times),
+                "per_review_us": round(1e6 * best / n, 3),
+                # traced separately: tracemalloc slows the run it watches
+                "peak_kb": _peak_kb(fn) if memory else None,
+            }
+            print(f"  {name:<22} best {1000 * best:9.2f} ms   median {1000 * med:9.2f} ms"
+                  + (f"   peak {row[name]['peak_kb']:>10,.0f} KB" if memory else ""))
+        results[str(n)] = row
+        del ctx
+    return {"meta": _meta(seed, repeat), "results": results}
+
+def _meta(seed: int, repeat: int) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "created_at": dt.datetime.utcnow().isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "commit": commit,
+        "seed": seed,
+        "repeat": repeat,
+    }
+
+# ---------------- Import budget ----------------
+IMPORT_MODULES = ("phase2b_summarize", "phase2_fetch", "resolver", "portfolio")
+# SDKs that must only load on the code path that needs them
+LAZY_MODULES = ("openai", "httpx", "requests", "serpapi", "numpy", "asyncio", "tiktoken")
+
+def import_check(modules: Tuple[str, ...] = IMPORT_MODULES, *, budget_ms: float = 100.0,
+                 runs: int = 5) -> Dict[str, Any]:
+    """
+    Cold-import each entry module in a fresh interpreter (best of `runs`) and
+    list any LAZY_MODULES it pulled in. Fails on either an eager SDK import
+    or a cold import slower than `budget_ms`.
+    """
+    probe = ("import sys, time, json; t = time.perf_counter(); import {m}; ms = 1000 * (time.perf_counter() - t); "
+             "print(json.dumps({{'ms': ms, 'eager': [x for x in {lazy!r} if x in sys.modules]}}))")
+    out: Dict[str, Any] = {"budget_ms": budget_ms, "modules": {}, "failures": []}
+    for m in modules:
+        best, eager = float("inf"), []
+        for _ in range(runs):
+            res = subprocess.run([sys.executable, "-c", probe.format(m=m, lazy=LAZY_MODULES)], capture_output=True,
+                                 text=True, cwd=Path(__file__).parent, timeout=60)
+            if res.returncode != 0:
+                raise RuntimeError(f"Importing {m} failed: {res.stderr.strip().splitlines()[-1:]}")
+            rec = json.loads(res.stdout.strip().splitlines()[-1])
+            best, eager = min(best, rec["ms"]), rec["eager"]
+        out["modules"][m] = {"cold_import_ms": round(best, 1), "eager_imports": eager}
+        if eager:
+            out["failures"].append(f"{m} imports {', '.join(eager)} at load")
+        if best > budget_ms:
+            out["failures"].append(f"{m} cold import {best:.0f} ms > budget {budget_ms:g} ms")
+        print(f"  import {m:<20} {best:7.1f} ms" + (f"   eager: {', '.join(eager)}" if eager else ""))
+    return out
+
+# ---------------- Baseline comparison ----------------
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], *, time_threshold: float = 0.15,
+            mem_threshold: float = 0.25, noise_floor_s: float = 0.001) -> List[Dict[str, Any]]:
+    """
+    Stage-by-stage deltas vs the baseline (best time, peak memory). A stage
+    regresses when it is more than `time_threshold` (fraction) slower, or uses
+    `mem_threshold` more peak memory; times under `noise_floor_s` are not judged.
+    """
+    rows: List[Dict[str, Any]] = []
+    for size, stages in current["results"].items():
+        base_stages = baseline.get("results", {}).get(size, {})
+        for name, cur in stages.items():
+            base = base_stages.get(name)
+            if not base:
+                continue
+            row: Dict[str, Any] = {"size": int(size), "stage": name, "regression": []}
+            if base["best_s"] > 0:
+                row["time_delta"] = round(cur["best_s"] / base["best_s"] - 1, 3)
+                if max(cur["best_s"], base["best_s"]) >= noise_floor_s and row["time_delta"] > time_threshold:
+                    row["regression"].append("time")
+            if cur.get("peak_kb") and base.get("peak_kb"):
+                row["mem_delta"] = round(cur["peak_kb"] / base["peak_kb"] - 1, 3)
+                if row["mem_delta"] > mem_threshold:
+                    row["regression"].append("memory")
+            rows.append(row)
+    return rows
+
+def _print_comparison(rows: List[Dict[str, Any]]) -> None:
+    for r in rows:
+        flag = " <-- REGRESSION (" + ", ".join(r["regression"]) + ")" if r["regression"] else ""
+        td = f"{100 * r['time_delta']:+7.1f}%" if "time_delta" in r else "      -"
+        md = f"{100 * r['mem_delta']:+7.1f}%" if "mem_delta" in r else "      -"
+        print(f"  {r['size']:>9,}  {r['stage']:<22} time {td}   mem {md}{flag}")
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Offline benchmark of the analytics hot paths on a synthetic corpus.")
+    ap.add_argument("--sizes", default="1000,10000,100000",
+                    help="Comma-separated corpus sizes, e.g. 1000,10000,100000,1000000 (default: 1k,10k,100k).")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=5, help="Minimum timed runs per stage (best is reported).")
+    ap.add_argument("--min-time", type=float, default=0.2, help="Keep repeating a stage until this many seconds.")
+    ap.add_argument("--stages", help="Comma-separated subset of stages to run.")
+    ap.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory pass.")
+    ap.add_argument("--out", default="bench_results.json", help="Where to write this run's results.")
+    ap.add_argument("--baseline", default="bench_baseline.json", help="Baseline results to compare against.")
+    ap.add_argument("--save-baseline", action="store_true", help="Also write this run as the new baseline.")
+    ap.add_argument("--time-threshold", type=float, default=0.15, help="Allowed slowdown vs baseline (0.15 = 15%%).")
+    ap.add_argument("--mem-threshold", type=float, default=0.25, help="Allowed peak-memory growth vs baseline.")
+    ap.add_argument("--import-budget-ms", type=float, default=100.0,
+                    help="Max cold-import time per entry module (SDKs must also stay lazy).")
+    ap.add_argument("--no-import-check", action="store_true", help="Skip the import-time check.")
+    args = ap.parse_args()
+
+    sizes = [int(float(s)) for s in args.sizes.split(",") if s.strip()]
+    only = [s.strip() for s in args.stages.split(",")] if args.stages else None
+    report = run_suite(sizes, seed=args.seed, repeat=args.repeat, min_time=args.min_time, only=only,
+                       memory=not args.no_memory)
+
+    regressions = 0
+    if not args.no_import_check:
+        print("[info] Import budget:")
+        report["imports"] = import_check(budget_ms=args.import_budget_ms)
+        for f in report["imports"]["failures"]:
+            print(f"[warn] {f}")
+        regressions += len(report["imports"]["failures"])
+
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.save_baseline:
+        rows = compare(report, json.loads(baseline_path.read_text(encoding="utf-8")),
+                       time_threshold=args.time_threshold, mem_threshold=args.mem_threshold)
+        report["comparison"] = {"baseline": str(baseline_path), "rows": rows}
+        regressions += sum(1 for r in rows if r["regression"])
+        print(f"[info] Compared with {baseline_path}:")
+        _print_comparison(rows)
+
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"[info] Saved baseline: {baseline_path}")
+    if regressions:
+        print(f"[warn] {regressions} check(s) failed (regression or import budget) — results: {args.out}")
+        sys.exit(1)
+    print(f"[done] Wrote: {args.out}")
@@ -0,0 +1,61 @@
+# dates.py
+from __future__ import annotations
+import calendar
+import datetime as dt
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+
+MAX_ORDINAL = dt.date.max.toordinal()
+
+@lru_cache(maxsize=8192)
+def date_ordinal(iso: str) -> int:
+    """
+    ISO date -> proleptic Gregorian ordinal; 0 for missing/unparseable.
+    Cached: review dates repeat heavily, so each distinct string is parsed once.
+    """
+    if not iso:
+        return 0
+    try:
+        return dt.date.fromisoformat(iso[:10]).toordinal()
+    except ValueError:
+        return 0
+
+_LAST_N = re.compile(r"^last(\d+)$")
+_MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+_RANGE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.\.(\d{4}-\d{2}-\d{2})$")
+
+def window_bounds(window: str, today: Optional[dt.date] = None) -> Optional[Tuple[int, int]]:
+    """
+    Parse a window spec into inclusive (lo, hi) date ordinals; None means "all".
+      all                      every review (including undated)
+      last<N>                  last N days, e.g. last90, last30, last365
+      YYYY-MM                  one calendar month
+      YYYY-MM-DD..YYYY-MM-DD   explicit inclusive range
+    Raises ValueError for anything else.
+    """
+    if window == "all":
+        return None
+    if m := _LAST_N.match(window):
+        today = today or dt.date.today()
+        return (today - dt.timedelta(days=int(m.group(1)))).toordinal(), MAX_ORDINAL
+    if m := _MONTH.match(window):
+        y, mo = int(m.group(1)), int(m.group(2))
+        if not 1 <= mo <= 12:
+            raise ValueError(f"Bad month in window: {window}")
+        return dt.date(y, mo, 1).toordinal(), dt.date(y, mo, calendar.monthrange(y, mo)[1]).toordinal()
+    if m := _RANGE.match(window):
+        lo, hi = (dt.date.fromisoformat(g).toordinal() for g in m.groups())
+        if lo > hi:
+            raise ValueError(f"Empty date range in window: {window}")
+        return lo, hi
+    raise ValueError(f"Unknown window '{window}' (use all, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD)")
+
+def window_arg(value: str) -> str:
+    """argparse `type=` validator for window specs."""
+    try:
+        window_bounds(value)
+    except ValueError as e:
+        import argparse
+        raise argparse.ArgumentTypeError(str(e))
+    return value
@@ -0,0 +1,260 @@
+# dedupe.py
+from __future__ import annotations
+import hashlib, json, sqlite3, threading, time
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from minhash import MinHasher, Signature, similarity, tokens
+from tracing import traced
+
+MODES = ("off", "flag", "collapse")
+MIN_WORDS = 8          # shorter reviews ("Great pub, lovely staff") repeat naturally; never flagged
+
+# ---------------- LSH ----------------
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures: `bands` x `rows` = num_perm. Two
+    texts land in a shared bucket in some band with probability
+    1 - (1 - s^rows)^bands for Jaccard s, so only those candidates are
+    compared and lookups stay sub-quadratic. 16x4 puts the 50% point near
+    s = 0.5, well below the default duplicate threshold.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise RuntimeError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: List[Dict[int, Set[str]]] = [{} for _ in range(bands)]
+        self.sigs: Dict[str, Signature] = {}
+
+    def _keys(self, sig: Signature) -> Iterator[Tuple[int, int]]:
+        r = self.rows
+        for b in range(self.bands):
+            yield b, hash(sig[b * r:(b + 1) * r])   # int tuples hash the same in every process
+
+    def add(self, key: str, sig: Signature) -> None:
+        self.remove(key)
+        self.sigs[key] = sig
+        for b, h in self._keys(sig):
+            self._buckets[b].setdefault(h, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        sig = self.sigs.pop(key, None)
+        if sig is None:
+            return
+        for b, h in self._keys(sig):
+            bucket = self._buckets[b].get(h)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[b][h]
+
+    def query(self, sig: Signature, threshold: float) -> List[Tuple[float, str]]:
+        """(estimated similarity, key) of indexed signatures at or above `threshold`, best first."""
+        cands: Set[str] = set()
+        for b, h in self._keys(sig):
+            cands |= self._buckets[b].get(h, set())
+        hits = [(similarity(sig, self.sigs[k]), k) for k in cands]
+        return sorted((h for h in hits if h[0] >= threshold), key=lambda h: (-h[0], h[1]))
+
+    def __len__(self) -> int:
+        return len(self.sigs)
+
+# ---------------- Persisted index ----------------
+def review_key(data_id: str, r: Any) -> str:
+    rid = r.review_id or hashlib.sha1(f"{r.date}|{r.text}".encode("utf-8")).hexdigest()[:16]
+    return f"{data_id}|{rid}"
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+@dataclass
+class DedupeReport:
+    mode: str
+    checked: int = 0
+    duplicates: int = 0          # reviews matching an earlier review's text
+    cross_pub: int = 0           # ... where that earlier review belongs to another pub
+    removed: int = 0             # dropped before metrics (collapse mode, same-pub duplicates only)
+    clusters: Dict[str, int] = field(default_factory=dict)   # canonical key -> duplicates seen this run
+
+    def as_dict(self, top: int = 5) -> Dict[str, Any]:
+        """`top=0` leaves out the cluster list (e.g. in the facts sent to the LLM)."""
+        out: Dict[str, Any] = {"mode": self.mode, "checked": self.checked, "duplicates": self.duplicates,
+                               "cross_pub": self.cross_pub, "removed": self.removed, "clusters": len(self.clusters)}
+        if top:
+            biggest = sorted(self.clusters.items(), key=lambda kv: (-kv[1], kv[0]))[:top]
+            out["largest_clusters"] = [{"canonical": k, "duplicates": n} for k, n in biggest]
+        return out
+
+class Deduper:
+    """
+    Near-duplicate review detection across every pub seen, backed by a
+    SQLite file of MinHash signatures so later runs only sign new or edited
+    reviews. Each review either starts its own cluster or joins the cluster
+    of the first indexed review it matches (estimated Jaccard >= threshold).
+    Only each cluster's canonical review sits in the LSH buckets, so a
+    spam template costs one candidate per lookup however often it repeats.
+
+    mode="flag" leaves the reviews alone and reports clusters; "collapse"
+    also drops duplicates of a review from the same pub before metrics.
+    Copies of another pub's review are only ever flagged.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: Optional[Path], *, mode: str = "flag", threshold: float = 0.8,
+                 num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if mode not in MODES:
+            raise RuntimeError(f"Unknown dedupe mode '{mode}' (use {', '.join(MODES)})")
+        self.mode = mode
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, seed=seed)
+        self.lsh = LSHIndex(num_perm, bands)
+        self._meta: Dict[str, Tuple[str, str]] = {}   # key -> (text hash, canonical key)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), timeout=30.0, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS signatures ("
+                " key TEXT PRIMARY KEY, data_id TEXT NOT NULL, text_hash TEXT NOT NULL,"
+                " canonical TEXT NOT NULL, sig BLOB, added_at REAL NOT NULL)")
+            self._check_params(num_perm, bands, seed)
+            self._load()
+
+    def _check_params(self, num_perm: int, bands: int, seed: int) -> None:
+        params = json.dumps({"num_perm": num_perm, "bands": bands, "seed": seed, "k": self.hasher.k})
+        row = self._db.execute("SELECT v FROM meta WHERE k = 'params'").fetchone()
+        if row is None:
+            self._db.execute("INSERT INTO meta VALUES ('params', ?)", (params,))
+        elif row[0] != params:
+            raise RuntimeError(f"Dedupe index was built with {row[0]}; open it with the same settings "
+                               f"or start a new index file")
+
+    def _load(self) -> None:
+        for key, text_hash, canonical, blob in self._db.execute(
+                "SELECT key, text_hash, canonical, sig FROM signatures ORDER BY added_at"):
+            self._meta[key] = (text_hash, canonical)
+            if blob is not None and canonical == key:
+                self.lsh.add(key, tuple(array("Q", blob)))
+
+    def _store(self, rows: List[Tuple[str, str, str, str, Optional[Signature]]]) -> None:
+        if self._db is None or not rows:
+            return
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.executemany(
+            "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?, ?)",
+            [(k, d, th, c, array("Q", s).tobytes() if s else None, now) for k, d, th, c, s in rows])
+        self._db.execute("COMMIT")
+
+    def _canonical(self, key: str, text: str, rows: List[Any], data_id: str) -> str:
+        """Look up (or index) one review; returns the key of its cluster's canonical review."""
+        th = _text_hash(text)
+        known = self._meta.get(key)
+        if known is not None and known[0] == th:
+            return known[1]
+        sig = self.hasher.signature(text) if len(tokens(text)) >= MIN_WORDS else None
+        canonical = key
+        if sig is not None:
+            for _, other in self.lsh.query(sig, self.threshold):
+                if other != key:
+                    canonical = self._meta[other][1]
+                    break
+        if sig is not None and canonical == key:
+            self.lsh.add(key, sig)
+        else:
+            self.lsh.remove(key)   # now a duplicate, or edited down below MIN_WORDS
+        self._meta[key] = (th, canonical)
+        rows.append((key, data_id, th, canonical, sig))
+        return canonical
+
+    @traced("dedupe")
+    def apply(self, data_id: str, reviews: Iterable[Any]) -> Tuple[List[Any], DedupeReport]:
+        """Check one pub's reviews. Returns (reviews for the metrics, report)."""
+        report = DedupeReport(self.mode)
+        out: List[Any] = []
+        rows: List[Any] = []
+        prefix = f"{data_id}|"
+        with self._lock:
+            for r in reviews:
+                key = review_key(data_id, r)
+                canonical = self._canonical(key, r.text, rows, data_id)
+                report.checked += 1
+                if canonical != key:
+                    report.duplicates += 1
+                    report.clusters[canonical] = report.clusters.get(canonical, 0) + 1
+                    if not canonical.startswith(prefix):
+                        report.cross_pub += 1
+                    elif self.mode == "collapse":
+                        report.removed += 1
+                        continue
+                out.append(r)
+            self._store(rows)
+        return out, report
+
+    def iter_apply(self, data_id: str, reviews: Iterable[Any], report: DedupeReport,
+                   chunk: int = 1000) -> Iterator[Any]:
+        """Streaming apply(): checks `chunk` reviews at a time, adding into `report`."""
+        buf: List[Any] = []
+        for r in reviews:
+            buf.append(r)
+            if len(buf) >= chunk:
+                yield from self._apply_into(data_id, buf, report)
+                buf = []
+        if buf:
+            yield from self._apply_into(data_id, buf, report)
+
+    def _apply_into(self, data_id: str, buf: List[Any], report: DedupeReport) -> List[Any]:
+        kept, part = self.apply(data_id, buf)
+        for f in ("checked", "duplicates", "cross_pub", "removed"):
+            setattr(report, f, getattr(report, f) + getattr(part, f))
+        for k, n in part.clusters.items():
+            report.clusters[k] = report.clusters.get(k, 0) + n
+        return kept
+
+    def clusters(self, min_size: int = 2) -> List[Tuple[str, List[str]]]:
+        """(canonical, member keys) for clusters of at least `min_size` reviews, largest first."""
+        with self._lock:
+            groups: Dict[str, List[str]] = {}
+            for key, (_, canonical) in self._meta.items():
+                groups.setdefault(canonical, []).append(key)
+        out = [(c, sorted(m)) for c, m in groups.items() if len(m) >= min_size]
+        return sorted(out, key=lambda cm: (-len(cm[1]), cm[0]))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            dups = sum(1 for k, (_, c) in self._meta.items() if c != k)
+            return {"mode": self.mode, "threshold": self.threshold, "reviews": len(self._meta),
+                    "canonical_indexed": len(self.lsh), "duplicates": dups}
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Inspect the near-duplicate review index.")
+    ap.add_argument("--index", default=str(Path(".cache") / "dedupe.sqlite"), help="Index file (default: .cache/dedupe.sqlite).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="Reviews indexed and duplicates found.")
+    cl = sub.add_parser("clusters", help="List duplicate clusters, largest first.")
+    cl.add_argument("--min-size", type=int, default=3, help="Smallest cluster to list (default: 3).")
+    cl.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    dd = Deduper(Path(args.index))
+    if args.cmd == "stats":
+        print(json.dumps(dd.stats(), indent=2))
+    else:
+        for canonical, members in dd.clusters(args.min_size)[:args.top]:
+            pubs = sorted({m.split("|", 1)[0] for m in members})
+            print(f"{len(members):5d}  {canonical}  pubs={len(pubs)}")
+    dd.close()
@@ -0,0 +1,33 @@
+# envfile.py
+from __future__ import annotations
+from pathlib import Path
+from typing import Optional
+
+_loaded = False
+
+def _find_env() -> Optional[Path]:
+    # same search as python-dotenv's find_dotenv(usecwd=True), then the repo dir
+    cwd = Path.cwd()
+    for d in (cwd, *cwd.parents, Path(__file__).resolve().parent):
+        p = d / ".env"
+        if p.is_file():
+            return p
+    return None
+
+def load_env() -> None:
+    """
+    load_dotenv() once per process, importing python-dotenv only when there
+    is a .env file to read (it's optional when keys come from the environment).
+    """
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    path = _find_env()
+    if path is None:
+        return
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        return
+    load_dotenv(path)
@@ -0,0 +1,365 @@
+# export.py
+from __future__ import annotations
+import csv, gzip, hashlib, io, json, os, re, threading, time
+import datetime as dt
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dates import date_ordinal
+from phase2_fetch import Review
+from phase2b_summarize import THEME_KEYWORDS, THEME_MATCHER, sentiment_bucket
+
+FORMATS = ("auto", "parquet", "csv")
+SCHEMA_VERSION = 1
+NO_MONTH = "none"        # partition for undated reviews
+
+_pa: Any = None
+
+def _pyarrow() -> Any:
+    """(pyarrow, pyarrow.parquet), imported on first use; None if not installed."""
+    global _pa
+    if _pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            _pa = (pyarrow, pyarrow.parquet)
+        except Exception:  # pragma: no cover - pyarrow is not a hard dependency
+            _pa = False
+    return _pa or None
+
+SENTIMENT_CODES = {"positive": 1, "neutral": 0, "negative": -1}
+
+def sentiment_code(rating: float) -> int:
+    return SENTIMENT_CODES[sentiment_bucket(rating)]
+
+def theme_column(theme: str) -> str:
+    """"Food Quality / Execution" -> "theme_food_quality_execution"."""
+    return "theme_" + re.sub(r"[^a-z0-9]+", "_", theme.lower()).strip("_")
+
+THEME_COLUMNS = {t: theme_column(t) for t in THEME_KEYWORDS}
+
+# Column name -> type ("str", "date", "float", "int", "bool"); order is the file's column order
+REVIEW_COLUMNS: List[Tuple[str, str]] = [
+    ("pub_key", "str"), ("data_id", "str"), ("review_id", "str"), ("date", "date"), ("month", "str"),
+    ("rating", "float"), ("sentiment_code", "int"), ("author", "str"), ("text", "str"),
+] + [(c, "bool") for c in THEME_COLUMNS.values()]
+DAILY_COLUMNS: List[Tuple[str, str]] = [
+    ("pub_key", "str"), ("date", "date"), ("month", "str"), ("reviews", "int"), ("rating_sum", "float"),
+    ("avg_rating", "float"), ("positive", "int"), ("neutral", "int"), ("negative", "int"),
+]
+DAILY_THEME_COLUMNS: List[Tuple[str, str]] = [
+    ("pub_key", "str"), ("date", "date"), ("month", "str"), ("theme", "str"),
+    ("positive", "int"), ("neutral", "int"), ("negative", "int"),
+]
+TABLES = {"reviews": REVIEW_COLUMNS, "daily": DAILY_COLUMNS, "daily_themes": DAILY_THEME_COLUMNS}
+
+def _safe(key: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", key) or "_"
+
+def _review_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One canonical form for review rows, fresh or read back: CSV can't tell
+    "" from null, so a missing author is always None and data_id/text are
+    always strings. Equal content then hashes equal either way.
+    """
+    row["author"] = row["author"] or None
+    row["data_id"] = row["data_id"] or ""
+    row["text"] = row["text"] or ""
+    return row
+
+def _rows_hash(rows: List[Dict[str, Any]]) -> str:
+    # sorts `rows` in place, so the file's row order is stable too
+    rows.sort(key=lambda r: (r["date"] or "", r["review_id"]))
+    return hashlib.sha1(json.dumps(rows, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# ---------------- Writers ----------------
+def _write_csv(path: Path, columns: List[Tuple[str, str]], rows: List[Dict[str, Any]]) -> None:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow([c for c, _ in columns])
+    for row in rows:
+        w.writerow([("true" if row[c] else "false") if kind == "bool" else ("" if row[c] is None else row[c])
+                    for c, kind in columns])
+    with path.open("wb") as f, gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:   # mtime=0: reproducible bytes
+        gz.write(buf.getvalue().encode("utf-8"))
+
+def _read_csv(path: Path, columns: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    conv = {"str": str, "date": lambda v: v or None, "float": float, "int": int,
+            "bool": lambda v: v == "true"}
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return [{c: conv[kind](row[c]) for c, kind in columns} for row in csv.DictReader(f)]
+
+def _write_parquet(pa: Any, path: Path, columns: List[Tuple[str, str]], rows: List[Dict[str, Any]]) -> None:
+    pyarrow, pq = pa
+    types = {"str": pyarrow.string(), "date": pyarrow.date32(), "float": pyarrow.float64(),
+             "int": pyarrow.int32(), "bool": pyarrow.bool_()}
+    schema = pyarrow.schema([(c, types[kind]) for c, kind in columns])
+    data = {c: ([dt.date.fromisoformat(r[c]) if r[c] else None for r in rows] if kind == "date"
+                else [r[c] for r in rows]) for c, kind in columns}
+    table = pyarrow.Table.from_pydict(data, schema=schema)
+    pq.write_table(table, str(path), compression="snappy")
+
+# ---------------- Export ----------------
+class PubExport:
+    """
+    Collects one pub's normalized reviews (write()/close(), like NdjsonSink)
+    and on close writes the month partitions whose content changed.
+    """
+
+    def __init__(self, exporter: "Exporter", key: str, data_id: Optional[str] = None, *, complete: bool = False):
+        self.exporter = exporter
+        self.key = key
+        self.data_id = data_id or ""
+        self.complete = complete
+        self._months: Dict[str, List[Dict[str, Any]]] = {}
+        self.result: Optional[Dict[str, Any]] = None
+
+    def write(self, r: Review) -> None:
+        day = date_ordinal(r.date)
+        month = r.date[:7] if day else NO_MONTH
+        hits = THEME_MATCHER.match(r.text)
+        rid = r.review_id or "h:" + hashlib.sha1(f"{r.date}|{r.text}".encode("utf-8")).hexdigest()[:16]
+        row = {"pub_key": self.key, "data_id": self.data_id, "review_id": rid,
+               "date": r.date[:10] if day else None, "month": month, "rating": float(r.rating),
+               "sentiment_code": sentiment_code(r.rating), "author": r.author, "text": r.text}
+        for t, col in THEME_COLUMNS.items():
+            row[col] = t in hits
+        self._months.setdefault(month, []).append(_review_row(row))
+
+    def close(self) -> Dict[str, Any]:
+        if self.result is None:
+            self.result = self.exporter._flush(self.key, self._months, self.complete)
+        return self.result
+
+    def __enter__(self) -> "PubExport":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if exc[0] is None:
+            self.close()
+
+class Exporter:
+    """
+    Power BI friendly export, Hive-partitioned by pub and month:
+
+      root/reviews/pub=<key>/month=<YYYY-MM>/part.parquet   one row per review:
+            pub/review keys, date, rating, sentiment_code (1/0/-1), text and
+            one boolean column per theme
+      root/daily/...          per pub and day: reviews, rating sum/avg, sentiment counts
+      root/daily_themes/...   per pub, day and theme: sentiment counts
+      root/pubs.parquet       one row per pub (name, location, data_id, tags)
+
+    Parquet (snappy) when pyarrow is installed, else gzipped CSV (part.csv.gz).
+    Each pub's partition hashes live in root/_state/<key>.json; a partition
+    is rewritten only when its reviews changed, months that disappeared from
+    a complete history are deleted, and every write or delete is appended to root/_changes.jsonl so
+    a refresh can pick up just those folders. Pubs export independently, so
+    one Exporter can be shared between threads.
+    """
+
+    def __init__(self, root: Path, fmt: str = "auto"):
+        if fmt not in FORMATS:
+            raise RuntimeError(f"Unknown export format '{fmt}' (use {', '.join(FORMATS)})")
+        pa = _pyarrow() if fmt != "csv" else None
+        if fmt == "parquet" and pa is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), or use --export-format csv")
+        self.root = root
+        self._pa = pa
+        self.fmt = "parquet" if pa else "csv"
+        self.ext = ".parquet" if pa else ".csv.gz"
+        self._lock = threading.Lock()
+        self.totals = {"pubs": 0, "written": 0, "unchanged": 0, "removed": 0, "rows": 0}
+
+    def pub(self, key: str, data_id: Optional[str] = None, *, complete: bool = False) -> PubExport:
+        return PubExport(self, key, data_id, complete=complete)
+
+    def export_pub(self, key: str, reviews: Iterable[Review], data_id: Optional[str] = None, *,
+                   complete: bool = False) -> Dict[str, Any]:
+        """
+        Export one pub's reviews. With `complete=True` they are its whole
+        history and months not among them are deleted; otherwise (e.g. the
+        newest --max reviews) older partitions are left alone.
+        Returns {"partitions", "written", "unchanged", "removed", "rows"}.
+        """
+        with self.pub(key, data_id, complete=complete) as w:
+            for r in reviews:
+                w.write(r)
+        return w.close()
+
+    def _write(self, table: str, key: str, month: str, rows: List[Dict[str, Any]]) -> str:
+        d = self.root / table / f"pub={_safe(key)}" / f"month={month}"
+        d.mkdir(parents=True, exist_ok=True)
+        path = d / f"part{self.ext}"
+        tmp = d / f".part{self.ext}.{threading.get_ident()}.tmp"
+        if self._pa is not None:
+            _write_parquet(self._pa, tmp, TABLES[table], rows)
+        else:
+            _write_csv(tmp, TABLES[table], rows)
+        os.replace(tmp, path)
+        return str(path.relative_to(self.root))
+
+    def _read_reviews(self, key: str, month: str) -> List[Dict[str, Any]]:
+        """Rows of an existing reviews partition, as write() builds them."""
+        path = self.root / "reviews" / f"pub={_safe(key)}" / f"month={month}" / f"part{self.ext}"
+        if not path.exists():
+            return []
+        if self._pa is not None:
+            rows = self._pa[1].read_table(str(path)).to_pylist()
+            for r in rows:
+                r["date"] = r["date"].isoformat() if r["date"] else None
+        else:
+            rows = _read_csv(path, REVIEW_COLUMNS)
+        return [_review_row(r) for r in rows]
+
+    def _remove_table(self, table: str, key: str, month: str) -> None:
+        d = self.root / table / f"pub={_safe(key)}" / f"month={month}"
+        for p in d.glob("part.*"):
+            p.unlink()
+        try:
+            d.rmdir()
+        except OSError:
+            pass
+
+    def _remove(self, key: str, month: str) -> None:
+        for table in TABLES:
+            self._remove_table(table, key, month)
+
+    @staticmethod
+    def _daily(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        days: Dict[Optional[str], List[Any]] = {}
+        for r in rows:
+            cell = days.setdefault(r["date"], [0, 0.0, [0, 0, 0], {}])
+            b = 1 - r["sentiment_code"]          # positive, neutral, negative
+            cell[0] += 1
+            cell[1] += r["rating"]
+            cell[2][b] += 1
+            for t, col in THEME_COLUMNS.items():
+                if r[col]:
+                    cell[3].setdefault(t, [0, 0, 0])[b] += 1
+        key, month = rows[0]["pub_key"], rows[0]["month"]
+        daily, themes = [], []
+        for day in sorted(days, key=lambda d: d or ""):
+            n, rating_sum, (pos, neu, neg), per_theme = days[day]
+            daily.append({"pub_key": key, "date": day, "month": month, "reviews": n,
+                          "rating_sum": rating_sum, "avg_rating": round(rating_sum / n, 4),
+                          "positive": pos, "neutral": neu, "negative": neg})
+            themes += [{"pub_key": key, "date": day, "month": month, "theme": t,
+                        "positive": c[0], "neutral": c[1], "negative": c[2]} for t, c in sorted(per_theme.items())]
+        return daily, themes
+
+    def _flush(self, key: str, months: Dict[str, List[Dict[str, Any]]], complete: bool) -> Dict[str, Any]:
+        state_path = self.root / "_state" / f"{_safe(key)}.json"
+        try:
+            prev = json.loads(state_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            prev = {}
+        if prev.get("schema") != [SCHEMA_VERSION, self.fmt, sorted(THEME_COLUMNS.values())]:
+            prev = {}   # new format or theme set: every partition is rewritten
+        old: Dict[str, str] = prev.get("partitions", {})
+        parts: Dict[str, str] = {}
+        out = {"partitions": len(months), "written": 0, "unchanged": 0, "removed": 0, "rows": 0}
+        changes: List[Dict[str, Any]] = []
+        for month, rows in sorted(months.items()):
+            h = _rows_hash(rows)
+            if old.get(month) != h and not complete and month in old:
+                # a partial fetch may cover only part of this month: keep the rows it doesn't mention
+                seen = {r["review_id"] for r in rows}
+                rows += [r for r in self._read_reviews(key, month) if r["review_id"] not in seen]
+                h = _rows_hash(rows)
+            parts[month] = h
+            if old.get(month) == h:
+                out["unchanged"] += 1
+                continue
+            daily, themes = self._daily(rows)
+            files = [self._write("reviews", key, month, rows), self._write("daily", key, month, daily)]
+            if themes:
+                files.append(self._write("daily_themes", key, month, themes))
+            else:
+                self._remove_table("daily_themes", key, month)
+            out["written"] += 1
+            out["rows"] += len(rows)
+            changes.append({"op": "write", "pub": key, "month": month, "files": files, "rows": len(rows)})
+        for month in sorted(set(old) - set(parts)):
+            if not complete:
+                parts[month] = old[month]
+                continue
+            self._remove(key, month)
+            out["removed"] += 1
+            changes.append({"op": "delete", "pub": key, "month": month})
+
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"schema": [SCHEMA_VERSION, self.fmt, sorted(THEME_COLUMNS.values())],
+                                   "partitions": parts}), encoding="utf-8")
+        os.replace(tmp, state_path)
+        now = time.time()
+        with self._lock:
+            if changes:
+                with (self.root / "_changes.jsonl").open("a", encoding="utf-8") as f:
+                    f.writelines(json.dumps({**c, "at": now}, ensure_ascii=False) + "\n" for c in changes)
+            self.totals["pubs"] += 1
+            for k in ("written", "unchanged", "removed", "rows"):
+                self.totals[k] += out[k]
+        return out
+
+    def export_pubs(self, pubs: Iterable[Dict[str, Any]]) -> Path:
+        """
+        Write the pub dimension table (rewritten whole; it is one row per pub).
+        Each item: {"pub_key", "name", "location", "data_id", "tags": {...}}.
+        """
+        items = list(pubs)
+        tag_cols = sorted({t for p in items for t in (p.get("tags") or {})} - {"pub_key", "name", "location", "data_id"})
+        columns = [("pub_key", "str"), ("name", "str"), ("location", "str"), ("data_id", "str")]
+        columns += [(t, "str") for t in tag_cols]
+        rows = [{"pub_key": p["pub_key"], "name": p.get("name"), "location": p.get("location"),
+                 "data_id": p.get("data_id"), **{t: (p.get("tags") or {}).get(t) for t in tag_cols}} for p in items]
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"pubs{self.ext}"
+        tmp = self.root / f".pubs{self.ext}.tmp"
+        if self._pa is not None:
+            _write_parquet(self._pa, tmp, columns, rows)
+        else:
+            _write_csv(tmp, columns, rows)
+        os.replace(tmp, path)
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"root": str(self.root), "format": self.fmt, **self.totals}
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    from phase2b_summarize import iter_normalized, iter_raw_file
+    ap = argparse.ArgumentParser(description="Export normalized reviews, theme flags and daily aggregates for Power BI.")
+    ap.add_argument("--out", default="powerbi", help="Export root (default: powerbi).")
+    ap.add_argument("--format", choices=FORMATS, default="auto",
+                    help="parquet (needs pyarrow), csv (gzipped) or auto (parquet when available).")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--store", help="Review store directory (as for portfolio.py --store): export every pub in it.")
+    src.add_argument("--from-json", nargs="+", help="Saved review files (JSON or NDJSON); one pub each.")
+    ap.add_argument("--key", help="Pub key for a single --from-json file (default: the file name stem).")
+    args = ap.parse_args()
+
+    ex = Exporter(Path(args.out), args.format)
+    pubs: List[Dict[str, Any]] = []
+    if args.store:
+        for p in sorted(Path(args.store).glob("*.json")):
+            doc = json.loads(p.read_text(encoding="utf-8"))
+            data_id = doc.get("data_id") or p.stem
+            res = ex.export_pub(p.stem, iter_normalized((doc.get("reviews") or {}).values()), data_id=data_id,
+                                complete=True)
+            pubs.append({"pub_key": p.stem, "data_id": data_id})
+            print(f"[info] {p.stem}: {res['written']} partitions written, {res['unchanged']} unchanged, {res['removed']} removed")
+    else:
+        if args.key and len(args.from_json) > 1:
+            raise RuntimeError("--key only applies to a single --from-json file")
+        for f in args.from_json:
+            key = args.key or Path(f).stem
+            res = ex.export_pub(key, iter_normalized(iter_raw_file(Path(f))))
+            pubs.append({"pub_key": key})
+            print(f"[info] {key}: {res['written']} partitions written, {res['unchanged']} unchanged, {res['removed']} removed")
+    ex.export_pubs(pubs)
+    s = ex.stats()
+    print(f"[done] {s['pubs']} pubs, {s['written']} partitions written ({s['rows']} rows), "
+          f"{s['unchanged']} unchanged, {s['removed']} removed — {s['format']} in {args.out}")
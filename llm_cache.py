@@ -0,0 +1,89 @@
+# llm_cache.py
+from __future__ import annotations
+import hashlib, json, os, threading, time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+def canonical_json(obj: Any) -> str:
+    """Key-sorted, whitespace-free JSON: equal data always gives equal bytes."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def content_key(**parts: Any) -> str:
+    """sha256 over the canonical JSON of everything that shapes the LLM output."""
+    return hashlib.sha256(canonical_json(parts).encode("utf-8")).hexdigest()
+
+class SummaryCache:
+    """
+    Content-addressed on-disk cache for LLM output, one file per key under
+    `root/<2-char shard>/<key>.md`. Reads refresh the file's mtime, and writes
+    evict least-recently-used entries once the total size passes `max_bytes`.
+    Safe to share between threads; hit/miss counters are kept per instance.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int = 64 * 1024 * 1024):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.writes = self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size, last_used); built once, then maintained in memory
+        self._index: Dict[str, list] = {}
+        for p in self.root.glob("*/*.md"):
+            st = p.stat()
+            self._index[p.stem] = [st.st_size, st.st_mtime]
+        self._total = sum(v[0] for v in self._index.values())
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.md"
+
+    def get(self, key: str) -> Optional[str]:
+        p = self._path(key)
+        try:
+            text = p.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(p, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key][1] = now
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, p)
+        size = p.stat().st_size
+        with self._lock:
+            self.writes += 1
+            prev = self._index.get(key)
+            self._total += size - (prev[0] if prev else 0)
+            self._index[key] = [size, time.time()]
+            self._evict()
+
+    def _evict(self) -> None:
+        if self._total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if self._total <= self.max_bytes:
+                break
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+            del self._index[key]
+            self._total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes,
+                    "evictions": self.evictions, "entries": len(self._index), "bytes": self._total}
@@ -0,0 +1,495 @@
+# llm_dispatch.py
+from __future__ import annotations
+import json, os, random, threading, time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from envfile import load_env
+import tracing
+from transport import get_transport
+
+if TYPE_CHECKING:
+    import asyncio   # annotations only; the runtime import is deferred (see _ensure_loop)
+
+load_env()
+
+Messages = List[Dict[str, str]]
+
+# -----------------------------
+# Token estimates
+# -----------------------------
+_tokenizer: Any = None
+
+def estimate_tokens(text: str) -> int:
+    """Token count via tiktoken when installed, else the ~4 chars/token rule of thumb."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    if _tokenizer:
+        return len(_tokenizer.encode(text))
+    return (len(text) + 3) // 4
+
+def estimate_prompt_tokens(messages: Messages) -> int:
+    # ~4 tokens of framing per message on top of the content
+    return sum(estimate_tokens(m.get("content") or "") + 4 for m in messages) + 2
+
+# -----------------------------
+# Rate limiting
+# -----------------------------
+class TokenBucket:
+    """
+    Refills at `per_minute / 60` units per second up to `capacity` (default:
+    10 seconds' worth, so a cold start can't dump a whole minute's quota at
+    once). `take(n)` returns how long to wait before `n` would be available,
+    consuming nothing in that case; a request larger than the bucket is
+    clamped so it can still go through.
+    """
+
+    def __init__(self, per_minute: float, *, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, per_minute / 6.0)
+        self.level = self.capacity
+        self._clock = clock
+        self._stamp = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_time(self, n: float) -> float:
+        self._refill()
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n: float) -> float:
+        wait = self.wait_time(n)
+        if wait == 0.0:
+            self.level -= min(n, self.capacity)
+        return wait
+
+    def adjust(self, delta: float) -> None:
+        """Correct an estimate after the fact (+ refunds, - charges; may go into debt)."""
+        self._refill()
+        self.level = min(self.capacity, self.level + delta)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets, taken together."""
+
+    def __init__(self, rpm: float, tpm: float, *, clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket(rpm, clock=clock)
+        self.tokens = TokenBucket(tpm, clock=clock)
+        import asyncio   # asyncio/openai load with the dispatcher's loop, not at import
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> float:
+        """Wait until one request and `tokens` tokens fit; returns seconds waited."""
+        import asyncio
+        t0 = time.monotonic()
+        # one waiter at a time keeps admission FIFO and stops a big request being starved
+        async with self._lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait == 0.0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return time.monotonic() - t0
+                await asyncio.sleep(wait)
+
+    def backoff(self, seconds: float) -> None:
+        """After a 429, drain the request bucket so nobody else fires straight into it."""
+        self.requests.adjust(-self.requests.rate * seconds)
+
+# -----------------------------
+# Dispatcher
+# -----------------------------
+def _status(exc: BaseException) -> Optional[int]:
+    return getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / (1000.0 if name.endswith("-ms") else 1.0)
+            except ValueError:
+                pass
+    return None
+
+def _retryable(exc: BaseException) -> bool:
+    import openai
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = _status(exc)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+class Dispatcher:
+    """
+    Async OpenAI chat dispatcher running on its own event-loop thread, so the
+    threaded callers (portfolio workers, map-reduce pools) all share one
+    limiter and one connection pool.
+
+    Every call first takes one request and its estimated tokens (prompt +
+    `completion_reserve`) from the RPM/TPM buckets; the estimate is squared
+    with `usage.total_tokens` once the response lands. 429s, timeouts and 5xx
+    are retried with full-jitter exponential backoff, honouring Retry-After.
+    With `call_log` set, each finished call appends one JSON line (model,
+    latency, attempts, estimated vs actual prompt/completion tokens, plus the
+    caller's `meta`).
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 *,
+                 rpm: float = 500,
+                 tpm: float = 200_000,
+                 concurrency: int = 16,
+                 max_attempts: int = 6,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 completion_reserve: int = 700,
+                 call_log: Optional[Path] = None):
+        self.api_key = api_key
+        self.rpm, self.tpm = rpm, tpm
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_reserve = completion_reserve
+        self.call_log = call_log
+        self._log_fh: Any = None
+        self._log_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._client: Any = None
+        self._limiter: Optional[RateLimiter] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed": 0,
+                       "throttle_wait_s": 0.0, "backoff_s": 0.0,
+                       "estimated_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                       "latency_s": 0.0}
+
+    # -- loop thread --
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        import asyncio
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run() -> None:
+                    asyncio.set_event_loop(loop)
+                    # limiter/semaphore/client must be created on the loop they serve
+                    self._limiter = RateLimiter(self.rpm, self.tpm)
+                    self._slots = asyncio.Semaphore(self.concurrency)
+                    self._client = get_transport().openai_async_client(self.api_key)
+                    ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="llm-dispatch", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    # -- async API --
+    async def achat(self, messages: Messages, model: str, temperature: float,
+                    max_tokens: Optional[int] = None, meta: Optional[Dict[str, Any]] = None) -> str:
+        """`meta` (stage, pub, prompt breakdown...) is copied into the call-log record."""
+        import asyncio
+        assert self._limiter is not None and self._slots is not None
+        prompt_estimate = estimate_prompt_tokens(messages)
+        estimate = prompt_estimate + (max_tokens or self.completion_reserve)
+        t0 = time.perf_counter()
+        kwargs: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        attempt = 0
+        while True:
+            attempt += 1
+            waited = await self._limiter.acquire(estimate)
+            self._stats["throttle_wait_s"] += waited
+            tracing.count("llm_throttle_wait_seconds", waited)
+            self._stats["estimated_tokens"] += estimate
+            try:
+                async with self._slots:
+                    self._stats["requests"] += 1
+                    resp = await self._client.chat.completions.create(**kwargs)
+            except Exception as e:
+                self._limiter.tokens.adjust(estimate)   # nothing was spent
+                if attempt >= self.max_attempts or not _retryable(e):
+                    self._stats["failed"] += 1
+                    self._log_call(model, meta, t0, attempt, prompt_estimate, None,
+                                   error=f"{type(e).__name__}: {e}")
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                hinted = _retry_after(e)
+                if _status(e) == 429:
+                    self._stats["rate_limited"] += 1
+                    self._limiter.backoff(hinted or delay)
+                delay = max(delay, hinted or 0.0)
+                self._stats["retries"] += 1
+                self._stats["backoff_s"] += delay
+                tracing.count("llm_retries", status=_status(e) or type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                self._stats["prompt_tokens"] += usage.prompt_tokens or 0
+                self._stats["completion_tokens"] += usage.completion_tokens or 0
+                self._limiter.tokens.adjust(estimate - (usage.total_tokens or estimate))
+            self._log_call(model, meta, t0, attempt, prompt_estimate, usage)
+            return resp.choices[0].message.content or ""
+
+    def _log_call(self, model: str, meta: Optional[Dict[str, Any]], t0: float, attempts: int,
+                  prompt_estimate: int, usage: Any, error: Optional[str] = None) -> None:
+        latency = time.perf_counter() - t0
+        self._stats["latency_s"] += latency
+        stage = (meta or {}).get("stage", "chat")
+        tracing.count("llm_calls", model=model, stage=stage, status="error" if error else "ok")
+        if usage is not None:
+            tracing.count("llm_prompt_tokens", usage.prompt_tokens or 0, model=model, stage=stage)
+            tracing.count("llm_completion_tokens", usage.completion_tokens or 0, model=model, stage=stage)
+        if self.call_log is None:
+            return
+        rec: Dict[str, Any] = {
+            "ts": round(time.time(), 3),
+            "model": model,
+            **(meta or {}),
+            "latency_s": round(latency, 3),
+            "attempts": attempts,
+            "estimated_prompt_tokens": prompt_estimate,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+        if error:
+            rec["error"] = error
+        with self._log_lock:
+            if self._log_fh is None:
+                self.call_log.parent.mkdir(parents=True, exist_ok=True)
+                self._log_fh = self.call_log.open("a", encoding="utf-8")
+            self._log_fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._log_fh.flush()
+
+    # -- thread-side API --
+    def submit(self, messages: Messages, model: str, temperature: float,
+               max_tokens: Optional[int] = None, meta: Optional[Dict[str, Any]] = None) -> "Future[str]":
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(self.achat(messages, model, temperature, max_tokens, meta),
+                                                self._ensure_loop())
+
+    def chat(self, messages: Messages, model: str, temperature: float, max_tokens: Optional[int] = None,
+             meta: Optional[Dict[str, Any]] = None) -> str:
+        """Blocking call from any thread; throttled against everything else in flight."""
+        return self.submit(messages, model, temperature, max_tokens, meta).result()
+
+    def chat_many(self, jobs: List[Tuple[Messages, str, float]]) -> List[str]:
+        """Dispatch (messages, model, temperature) jobs together; results in input order."""
+        futures = [self.submit(m, model, temp) for m, model, temp in jobs]
+        return [f.result() for f in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self._stats)
+        out["throttle_wait_s"] = round(out["throttle_wait_s"], 3)
+        out["backoff_s"] = round(out["backoff_s"], 3)
+        done = out["requests"] - out["retries"]
+        out["avg_latency_s"] = round(out.pop("latency_s") / done, 3) if done > 0 else None
+        out["call_log"] = str(self.call_log) if self.call_log else None
+        out.update(rpm=self.rpm, tpm=self.tpm, concurrency=self.concurrency)
+        return out
+
+    def close(self) -> None:
+        loop = self._loop
+        if loop is not None:
+            import asyncio
+            if self._client is not None:
+                asyncio.run_coroutine_threadsafe(self._client.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            if self._thread is not None:
+                self._thread.join()
+            loop.close()
+            self._loop = self._thread = None
+        with self._log_lock:
+            if self._log_fh is not None:
+                self._log_fh.close()
+                self._log_fh = None
+
+# -----------------------------
+# Process-wide default
+# -----------------------------
+_default: Optional[Dispatcher] = None
+_default_lock = threading.Lock()
+
+def _env_settings() -> Dict[str, Any]:
+    return {
+        "rpm": float(os.getenv("PUBPULSE_OPENAI_RPM", "500")),
+        "tpm": float(os.getenv("PUBPULSE_OPENAI_TPM", "200000")),
+        "concurrency": int(os.getenv("PUBPULSE_OPENAI_CONCURRENCY", "16")),
+        "call_log": Path(os.environ["PUBPULSE_LLM_LOG"]) if os.getenv("PUBPULSE_LLM_LOG") else None,
+    }
+
+def get_dispatcher() -> Dispatcher:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Dispatcher(os.getenv("OPENAI_API_KEY", "").strip(), **_env_settings())
+        return _default
+
+def configure(**overrides: Any) -> Dispatcher:
+    """Replace the process-wide dispatcher, e.g. configure(rpm=3000, tpm=1_000_000)."""
+    global _default
+    with _default_lock:
+        if _default is not None:
+            _default.close()
+        settings = {**_env_settings(), **overrides}
+        api_key = settings.pop("api_key", None) or os.getenv("OPENAI_API_KEY", "").strip()
+        _default = Dispatcher(api_key, **settings)
+        return _default
+
+# -----------------------------
+# Batch files
+# -----------------------------
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+class BatchWriter:
+    """
+    Collects chat requests into an OpenAI Batch API JSONL file instead of
+    calling the API. `custom_id` is the summary-cache key, so collected
+    results land straight in the cache and the next normal run picks them up.
+    Each request may name a target (slug, pulse path, title, window); the
+    targets go to a `.targets.json` sidecar so collect can write the pulses.
+    Thread-safe; duplicate ids are written once.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = path.with_suffix(path.suffix + ".tmp")
+        self._fh = self._tmp.open("w", encoding="utf-8")
+        self._ids: set = set()
+        self.targets: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, custom_id: str, messages: Messages, model: str, temperature: float,
+            target: Optional[Dict[str, Any]] = None) -> None:
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+                           "body": {"model": model, "messages": messages, "temperature": temperature}},
+                          ensure_ascii=False)
+        with self._lock:
+            if target is not None:
+                # two pubs can share a request (same facts); each still gets its pulse
+                self.targets.setdefault(custom_id, []).append(target)
+            if custom_id in self._ids:
+                return
+            self._ids.add(custom_id)
+            self._fh.write(line + "\n")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+                os.replace(self._tmp, self.path)
+                _targets_path(self.path).write_text(json.dumps(self.targets, indent=2, ensure_ascii=False),
+                                                    encoding="utf-8")
+
+def _state_path(path: Path) -> Path:
+    return path.with_suffix(".batch.json")
+
+def _targets_path(path: Path) -> Path:
+    return path.with_suffix(".targets.json")
+
+def submit_batch(path: Path, *, api_key: Optional[str] = None, completion_window: str = "24h") -> Dict[str, Any]:
+    """Upload a batch JSONL and start the batch; the state is saved next to the file."""
+    client = get_transport().openai_client(api_key or os.getenv("OPENAI_API_KEY", "").strip())
+    with path.open("rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                  completion_window=completion_window)
+    tp = _targets_path(path)
+    targets = json.loads(tp.read_text(encoding="utf-8")) if tp.exists() else {}
+    state = {"batch_id": batch.id, "input_file_id": uploaded.id, "status": batch.status,
+             "requests_file": str(path), "submitted_at": time.time(), "targets": targets}
+    _state_path(path).write_text(json.dumps(state, indent=2), encoding="utf-8")
+    return state
+
+def collect_batch(batch_id: str, cache: Any, *, targets: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                  api_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Poll a batch once. When it has finished, store every successful result in
+    `cache` (a SummaryCache) under its custom_id, write it to each of that
+    id's `targets` paths (the pulse markdown) and return the counts.
+    """
+    client = get_transport().openai_client(api_key or os.getenv("OPENAI_API_KEY", "").strip())
+    batch = client.batches.retrieve(batch_id)
+    out: Dict[str, Any] = {"batch_id": batch_id, "status": batch.status, "stored": 0, "failed": 0, "written": []}
+    if batch.status != "completed":
+        return out
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            body = ((row.get("response") or {}).get("body") or {})
+            choices = body.get("choices") or []
+            text = (choices[0].get("message") or {}).get("content") if choices else None
+            if row.get("error") or not text:
+                out["failed"] += 1
+                continue
+            cache.put(row["custom_id"], text)
+            out["stored"] += 1
+            for t in (targets or {}).get(row["custom_id"], []):
+                p = Path(t["path"])
+                p.parent.mkdir(parents=True, exist_ok=True)
+                p.write_text(text, encoding="utf-8")
+                out["written"].append(str(p))
+    if batch.error_file_id:
+        out["failed"] += sum(1 for l in client.files.content(batch.error_file_id).text.splitlines() if l.strip())
+    return out
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    from llm_cache import SummaryCache
+
+    ap = argparse.ArgumentParser(description="Submit / collect OpenAI batch files of Pub Pulse summaries.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("submit", help="Upload a batch JSONL written by portfolio.py --llm-batch.")
+    s.add_argument("path", help="Batch requests file (e.g. portfolio_out/llm_batch_requests.jsonl).")
+    c = sub.add_parser("collect", help="Fetch a finished batch into the summary cache.")
+    c.add_argument("batch", help="Batch id, or the .batch.json state file written by submit.")
+    c.add_argument("--llm-cache", default=str(Path(".cache") / "llm_summaries"))
+    c.add_argument("--wait", action="store_true", help="Poll until the batch finishes.")
+    c.add_argument("--poll-s", type=float, default=30.0)
+    args = ap.parse_args()
+
+    if not os.getenv("OPENAI_API_KEY", "").strip():
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    if args.cmd == "submit":
+        state = submit_batch(Path(args.path))
+        print(f"[done] Submitted batch {state['batch_id']} ({state['status']}) — state: {_state_path(Path(args.path))}")
+    else:
+        batch_id, targets = args.batch, None
+        if batch_id.endswith(".json"):
+            state = json.loads(Path(batch_id).read_text(encoding="utf-8"))
+            batch_id, targets = state["batch_id"], state.get("targets")
+        cache = SummaryCache(Path(args.llm_cache))
+        while True:
+            res = collect_batch(batch_id, cache, targets=targets)
+            if res["status"] in ("completed", "failed", "expired", "cancelled") or not args.wait:
+                break
+            print(f"[info] Batch {batch_id}: {res['status']}; polling again in {args.poll_s:g}s")
+            time.sleep(args.poll_s)
+        print(f"[done] Batch {batch_id}: {res['status']} — stored {res['stored']}, failed {res['failed']}, "
+              f"wrote {len(res['written'])} pulse files")
@@ -0,0 +1,75 @@
+# minhash.py
+from __future__ import annotations
+import operator, random, re, zlib
+from typing import Any, List, Optional, Sequence, Set, Tuple
+
+_P = 4294967311             # smallest prime above 2**32: a*x + b stays inside uint64
+_WORD = re.compile(r"[a-z0-9£']+")
+
+Signature = Tuple[int, ...]
+
+_np: Any = None
+
+def _numpy() -> Any:
+    """numpy for vectorized signatures, imported on first use; None if not installed."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except Exception:  # pragma: no cover - numpy is not a hard dependency
+            _np = False
+    return _np or None
+
+def tokens(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+def shingles(text: str, k: int = 3) -> Set[int]:
+    """
+    32-bit hashes of the k-word shingles of `text` (crc32, so stable across
+    processes and safe to persist). Texts shorter than k words give one shingle.
+    """
+    words = tokens(text)
+    if len(words) <= k:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + k]).encode("utf-8")) for i in range(len(words) - k + 1)}
+
+class MinHasher:
+    """
+    MinHash signatures: for each of `num_perm` random hash functions
+    h(x) = (a*x + b) mod p, the minimum over a text's shingle hashes. The
+    fraction of equal positions in two signatures estimates their Jaccard
+    similarity. The same `seed` always gives the same functions.
+    """
+
+    def __init__(self, num_perm: int = 64, *, k: int = 3, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.k = k
+        self.seed = seed
+        self._a = [rng.randrange(1, 1 << 32) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, 1 << 32) for _ in range(num_perm)]
+        self._np_ab: Any = None
+
+    def signature(self, text: str) -> Optional[Signature]:
+        """None for texts with no words (nothing to compare)."""
+        hs = shingles(text, self.k)
+        if not hs:
+            return None
+        if len(hs) > 8 and (np := _numpy()) is not None:
+            return self._signature_np(np, hs)
+        return tuple(min((a * h + b) % _P for h in hs) for a, b in zip(self._a, self._b))
+
+    def _signature_np(self, np: Any, hs: Set[int]) -> Signature:
+        # identical values to the pure-Python path (persisted signatures must not depend on numpy)
+        if self._np_ab is None:
+            self._np_ab = (np.array(self._a, dtype=np.uint64)[:, None], np.array(self._b, dtype=np.uint64)[:, None])
+        a, b = self._np_ab
+        x = np.fromiter(hs, dtype=np.uint64, count=len(hs))[None, :]
+        return tuple(int(v) for v in ((a * x + b) % np.uint64(_P)).min(axis=1))
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    if not a or not b:
+        return 0.0
+    return sum(map(operator.eq, a, b)) / len(a)
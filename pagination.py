@@ -0,0 +1,300 @@
+# pagination.py
+from __future__ import annotations
+import hashlib, heapq, itertools, json, os, random, time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import tracing
+from transport import ReplayMiss, error_status, transient_status
+
+PageFn = Callable[..., Dict[str, Any]]   # (data_id, next_page_token, *, lang, sort_by) -> payload
+
+# ---------------- Models ----------------
+@dataclass
+class PageCursor:
+    """
+    Pagination state for one data_id.
+    `should_stop(reviews)` is called with each page's reviews; return True to stop early.
+    With `keep_reviews=False` pages are only counted, for streaming consumers.
+    With a `checkpoint`, pages already saved there are re-walked first (no API
+    calls) and fetching resumes from the last saved token.
+    """
+    data_id: str
+    lang: str = "en"
+    sort_by: str = "newest"
+    max_results: int = 500
+    should_stop: Optional[Callable[[List[Dict[str, Any]]], bool]] = None
+    keep_reviews: bool = True
+    token: Optional[str] = None
+    reviews: List[Dict[str, Any]] = field(default_factory=list)
+    count: int = 0
+    pages: int = 0
+    retries: int = 0
+    done: bool = False
+    error: Optional[str] = None
+    attempt: int = 0
+    checkpoint: Optional["PageCheckpoint"] = None
+    replay: List[Dict[str, Any]] = field(default_factory=list)   # saved pages still to re-walk
+    resumed: bool = False
+    fetched: int = 0                                              # pages fetched live this run
+
+    def __post_init__(self):
+        if self.checkpoint is not None:
+            self.replay = self.checkpoint.load()
+            self.resumed = bool(self.replay)
+
+@dataclass
+class PaginationStats:
+    pages: int = 0
+    retries: int = 0
+    errors: int = 0          # transient page errors retried (network, 5xx, 429)
+    replayed: int = 0        # pages re-walked from a checkpoint instead of fetched
+    fetch_s: float = 0.0     # time spent inside page calls
+    wait_s: float = 0.0      # time idle because no cursor was ready
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"pages": self.pages, "retries": self.retries, "errors": self.errors,
+                "replayed": self.replayed, "fetch_s": round(self.fetch_s, 3), "wait_s": round(self.wait_s, 3)}
+
+# ------------- Helpers -------------
+def next_token(payload: Dict[str, Any]) -> Optional[str]:
+    if token := payload.get("next_page_token"):
+        return token
+    pag = payload.get("serpapi_pagination") or {}
+    return pag.get("next_page_token") if isinstance(pag, dict) else None
+
+def page_reviews(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return payload.get("reviews") or payload.get("reviews_results") or []
+
+def token_not_ready(payload: Dict[str, Any]) -> bool:
+    """
+    A freshly issued next_page_token is rejected for a short while; SerpAPI
+    reports that as an `error` payload with no reviews.
+    """
+    return bool(payload.get("error")) and not page_reviews(payload)
+
+def transient_error(payload: Dict[str, Any]) -> bool:
+    """Error payloads worth retrying (server errors, throttling) rather than final ones."""
+    return transient_status(error_status(payload))
+
+# ------------- Checkpoints -------------
+class PageCheckpoint:
+    """
+    Append-only JSONL of the pages fetched so far for one (data_id, sort_by,
+    lang): a header line, then {"reviews": [...], "next_page_token": ...} per
+    page, each flushed and fsynced as it lands. A crash can at worst leave a
+    torn last line, which load() ignores. Cleared once the fetch completes;
+    older than `max_age_s`, the saved tokens have likely expired and the
+    file is ignored.
+    """
+
+    def __init__(self, path: Path, *, max_age_s: float = 6 * 3600):
+        self.path = path
+        self.max_age_s = max_age_s
+        self._fh: Any = None
+
+    @classmethod
+    def for_fetch(cls, root: Path, data_id: str, *, sort_by: str, lang: str, **kwargs: Any) -> "PageCheckpoint":
+        key = hashlib.sha1(f"{data_id}|{sort_by}|{lang}".encode("utf-8")).hexdigest()[:20]
+        return cls(root / f"{key}.jsonl", **kwargs)
+
+    def load(self) -> List[Dict[str, Any]]:
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            self.clear()
+            return []
+        if time.time() - header.get("started_at", 0) > self.max_age_s:
+            self.clear()
+            return []
+        pages: List[Dict[str, Any]] = []
+        for line in lines[1:]:
+            try:
+                pages.append(json.loads(line))
+            except json.JSONDecodeError:
+                break   # torn write at the tail
+        if len(pages) < len(lines) - 1:
+            # drop the torn tail so new pages append after the last good one
+            self.path.write_text("\n".join(lines[:len(pages) + 1]) + "\n", encoding="utf-8")
+        return pages
+
+    def append(self, reviews: List[Dict[str, Any]], token: Optional[str]) -> None:
+        if self._fh is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fresh = not self.path.exists()
+            self._fh = self.path.open("a", encoding="utf-8")
+            if fresh:
+                self._fh.write(json.dumps({"v": 1, "started_at": time.time()}) + "\n")
+        self._fh.write(json.dumps({"reviews": reviews, "next_page_token": token}, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def clear(self) -> None:
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+# ------------- Scheduler -------------
+class PaginationScheduler:
+    """
+    Drives many cursors from one thread. Instead of sleeping a fixed 2s after
+    every page, a cursor is retried as soon as its token might be valid, with
+    short growing backoff when SerpAPI says it is not ready yet. While one
+    cursor backs off, pages for other cursors are fetched, so the worker only
+    idles when every cursor is waiting.
+
+    Transient failures (exceptions from `page_fn`, 5xx/429 error payloads)
+    are retried per page with jittered exponential backoff, up to
+    `max_error_attempts`; after that the cursor ends with `error` set and
+    keeps what it has (and its checkpoint, for the next run).
+    """
+
+    def __init__(self,
+                 page_fn: PageFn,
+                 *,
+                 token_grace: float = 0.5,
+                 initial_backoff: float = 0.25,
+                 max_backoff: float = 4.0,
+                 max_attempts: int = 8,
+                 error_backoff: float = 1.0,
+                 max_error_attempts: int = 5,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.page_fn = page_fn
+        self.token_grace = token_grace
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.error_backoff = error_backoff
+        self.max_error_attempts = max_error_attempts
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = PaginationStats()
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+
+    def add(self, cursor: PageCursor) -> PageCursor:
+        heapq.heappush(self._heap, (self.clock(), next(self._seq), cursor))
+        return cursor
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, self.initial_backoff * (2 ** (attempt - 1)))
+
+    def _transient(self, cur: PageCursor, error: str) -> Optional[float]:
+        cur.attempt += 1
+        self.stats.errors += 1
+        tracing.count("pagination_page_errors")
+        if cur.attempt >= self.max_error_attempts:
+            cur.error = error
+            return None
+        delay = self.error_backoff * (2 ** (cur.attempt - 1))
+        return self.clock() + random.uniform(0.5 * delay, delay)
+
+    def _finish(self, cur: PageCursor) -> None:
+        if cur.checkpoint is not None:
+            if cur.error is None:
+                cur.checkpoint.clear()   # complete: nothing left to resume
+            else:
+                cur.checkpoint.close()
+
+    def _step(self, cur: PageCursor) -> Tuple[Optional[float], List[Dict[str, Any]]]:
+        """Fetch one page for `cur`. Returns (next ready time or None when finished, page reviews)."""
+        if cur.replay:
+            # re-walk a checkpointed page: same bookkeeping, no API call, no token wait
+            payload = cur.replay.pop(0)
+            self.stats.replayed += 1
+            nxt, reviews = self._accept(cur, payload)
+            return (self.clock() if nxt is not None else None), reviews
+
+        t0 = self.clock()
+        try:
+            payload = self.page_fn(cur.data_id, cur.token, lang=cur.lang, sort_by=cur.sort_by)
+        except ReplayMiss as e:
+            # not recorded: retrying can't help, and there is nothing to checkpoint
+            self.stats.fetch_s += self.clock() - t0
+            cur.error = str(e)
+            return None, []
+        except Exception as e:
+            self.stats.fetch_s += self.clock() - t0
+            return self._transient(cur, f"{type(e).__name__}: {e}"), []
+        self.stats.fetch_s += self.clock() - t0
+
+        if transient_error(payload) and not page_reviews(payload):
+            return self._transient(cur, str(payload.get("error"))), []
+        if cur.token and token_not_ready(payload):
+            cur.attempt += 1
+            cur.retries += 1
+            self.stats.retries += 1
+            tracing.count("pagination_token_retries")
+            if cur.attempt >= self.max_attempts:
+                cur.error = str(payload.get("error"))
+                if cur.resumed and not cur.fetched and cur.checkpoint is not None:
+                    # the saved token has expired: resuming can't work, start over next run
+                    cur.checkpoint.clear()
+                    cur.error += " (checkpoint token rejected; checkpoint discarded)"
+                return None, []
+            return self.clock() + self._backoff(cur.attempt), []
+        if not cur.token and error_status(payload) and not page_reviews(payload):
+            # first page refused (bad key, quota, bad request): a failure, not an empty pub
+            cur.error = str(payload.get("error"))
+            return None, []
+
+        cur.fetched += 1
+        if cur.checkpoint is not None:
+            cur.checkpoint.append(page_reviews(payload), next_token(payload))
+        return self._accept(cur, payload)
+
+    def _accept(self, cur: PageCursor, payload: Dict[str, Any]) -> Tuple[Optional[float], List[Dict[str, Any]]]:
+        cur.attempt = 0
+        cur.pages += 1
+        self.stats.pages += 1
+        reviews = page_reviews(payload)[:max(0, cur.max_results - cur.count)]
+        cur.count += len(reviews)
+        if cur.keep_reviews:
+            cur.reviews.extend(reviews)
+
+        if cur.should_stop and cur.should_stop(reviews):
+            return None, reviews
+        if cur.count >= cur.max_results:
+            return None, reviews
+        cur.token = next_token(payload)
+        if not cur.token:
+            return None, reviews
+        return self.clock() + self.token_grace, reviews
+
+    def iter_pages(self) -> Iterator[Tuple[PageCursor, List[Dict[str, Any]]]]:
+        """Yield (cursor, page reviews) as each page lands, in completion order."""
+        while self._heap:
+            ready_at, _, cur = heapq.heappop(self._heap)
+            delay = ready_at - self.clock()
+            if delay > 0:
+                # nothing else is ready (heap order), so this is true idle time
+                with tracing.span("pagination.wait"):
+                    self.sleep(delay)
+                self.stats.wait_s += delay
+                tracing.count("pagination_wait_seconds", delay)
+            nxt, reviews = self._step(cur)
+            if nxt is None:
+                cur.done = True
+                self._finish(cur)
+            else:
+                heapq.heappush(self._heap, (nxt, next(self._seq), cur))
+            if reviews:
+                yield cur, reviews
+
+    def run(self) -> PaginationStats:
+        for _ in self.iter_pages():
+            pass
+        return self.stats
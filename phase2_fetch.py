@@ -1,12 +1,18 @@
 from __future__ import annotations
-import os, time, json, datetime as dt
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+import os, json, datetime as dt
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
-from dotenv import load_dotenv
-from serpapi import GoogleSearch
+from dates import date_ordinal, window_arg, window_bounds
+from envfile import load_env
+from pagination import PageCheckpoint, PageCursor, PageFn, PaginationScheduler, PaginationStats
+from review_store import ReviewStore, edit_stamp, review_key
+from tracing import traced
+import transport
+from transport import get_transport
 
-load_dotenv()
+load_env()
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY", "").strip()
 
 # ---------------- Models ----------------
@@ -22,9 +28,10 @@ class Review:
 
 # ------------- Fetch core ---------------
 def _require_key():
-    if not SERPAPI_API_KEY:
+    if not SERPAPI_API_KEY and not transport.offline():
         raise RuntimeError("Missing SERPAPI_API_KEY")
 
+@traced("serpapi.page")
 def _page(
     data_id: str,
     next_page_token: Optional[str] = None,
@@ -41,52 +48,130 @@ def _page(
     }
     if next_page_token:
         params["next_page_token"] = next_page_token
-    return GoogleSearch(params).get_dict()
+    return get_transport().serpapi_get(params)
 
-def _next_token(payload: Dict[str, Any]) -> Optional[str]:
-    if token := payload.get("next_page_token"):
-        return token
-    pag = payload.get("serpapi_pagination") or {}
-    return pag.get("next_page_token") if isinstance(pag, dict) else None
+def _scheduler(page_fn: Optional[PageFn]) -> PaginationScheduler:
+    # replayed pages have no token to wait for
+    return PaginationScheduler(page_fn or _page, **({"token_grace": 0.0} if transport.offline() else {}))
+
+def _envelope(cur: PageCursor, stats: PaginationStats) -> Dict[str, Any]:
+    reviews = cur.reviews
+    return {
+        "source": "serpapi/google_maps_reviews",
+        "data_id": cur.data_id,
+        "count": len(reviews),
+        "reviews": reviews,
+        "meta": {
+            "fetched_at": dt.datetime.utcnow().isoformat() + "Z",
+            "sort_by": cur.sort_by,
+            "pages": cur.pages,
+            "token_retries": cur.retries,
+            "resumed": cur.resumed,
+            "pagination": stats.as_dict(),
+            **({"error": cur.error} if cur.error else {}),
+        },
+    }
+
+def _checkpoint(checkpoint_dir: Optional[Path], data_id: str, sort_by: str, lang: str) -> Optional[PageCheckpoint]:
+    if checkpoint_dir is None:
+        return None
+    return PageCheckpoint.for_fetch(Path(checkpoint_dir), data_id, sort_by=sort_by, lang=lang)
+
+def fetch_many_reviews(
+    data_ids: List[str],
+    *,
+    max_results: int = 500,
+    lang: str = "en",
+    sort_by: str = "newest",
+    page_fn: Optional[PageFn] = None,
+    checkpoint_dir: Optional[Path] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Paginate several data_ids on one worker, interleaving their pages so one
+    pub's not-yet-valid token never stalls the others. Returns {data_id: envelope}.
+    With `checkpoint_dir`, every page is saved as it lands and an interrupted
+    fetch resumes from its last good token on the next call.
+    """
+    _require_key()
+    sched = _scheduler(page_fn)
+    cursors = [sched.add(PageCursor(d, lang=lang, sort_by=sort_by, max_results=max_results,
+                                    checkpoint=_checkpoint(checkpoint_dir, d, sort_by, lang)))
+               for d in data_ids]
+    stats = sched.run()
+    return {c.data_id: _envelope(c, stats) for c in cursors}
 
 def fetch_all_reviews(
     data_id: str,
     *,
     max_results: int = 500,
     lang: str = "en",
-    sort_by: str = "newest"
+    sort_by: str = "newest",
+    page_fn: Optional[PageFn] = None,
+    checkpoint_dir: Optional[Path] = None
 ) -> Dict[str, Any]:
     """
-    Paginate reviews using SerpAPI (official client), honoring sort server-side.
+    Paginate reviews through the pooled SerpAPI transport session, honoring sort server-side.
     Returns a raw envelope with reviews and minimal metadata.
     """
-    _require_key()
-    all_reviews: List[Dict[str, Any]] = []
-    token: Optional[str] = None
+    return fetch_many_reviews([data_id], max_results=max_results, lang=lang, sort_by=sort_by,
+                              page_fn=page_fn, checkpoint_dir=checkpoint_dir)[data_id]
 
-    while True:
-        payload = _page(data_id, token, lang=lang, sort_by=sort_by)
-        reviews = payload.get("reviews") or payload.get("reviews_results") or []
-        all_reviews.extend(reviews)
+def fetch_new_reviews(
+    data_id: str,
+    store: ReviewStore,
+    *,
+    max_results: int = 500,
+    lang: str = "en",
+    page_fn: Optional[PageFn] = None
+) -> Dict[str, Any]:
+    """
+    Delta fetch: page newest-first and stop as soon as a page contains a review
+    already in the store with an unchanged edit stamp. New and edited reviews
+    are merged into the store; the envelope carries the full stored history.
+    `max_results` caps how many reviews are pulled on this run (first runs).
 
-        if len(all_reviews) >= max_results:
-            break
+    The store only moves forward on a walk that completes: if a page fails,
+    the fetched reviews are returned (on top of the stored history) but not
+    persisted, so the next run walks down to the old history again instead
+    of stopping at the first of them and leaving a gap behind it.
+    """
+    _require_key()
+    fetched: Dict[str, Dict[str, Any]] = {}
 
-        token = _next_token(payload)
-        if not token:
-            break
+    def caught_up(reviews: List[Dict[str, Any]]) -> bool:
+        for r in reviews:
+            fetched[review_key(r)] = r
+        # reached history we already hold -> nothing older can be new
+        return any(store.known(data_id, r) == edit_stamp(r) for r in reviews)
 
-        # allow next_page_token to become valid
-        time.sleep(2.0)
+    sched = _scheduler(page_fn)
+    cur = sched.add(PageCursor(data_id, lang=lang, sort_by="newest",
+                               max_results=max_results, should_stop=caught_up))
+    stats = sched.run()
 
+    if cur.error is None:
+        added = store.merge(data_id, list(fetched.values()))
+        store.save(data_id)
+        stored = store.reviews(data_id)
+    else:
+        stamps = [(store.known(data_id, r), edit_stamp(r)) for r in fetched.values()]
+        added = {"new": sum(old is None for old, _ in stamps),
+                 "updated": sum(old is not None and old != new for old, new in stamps)}
+        stored = store.reviews(data_id, pending=list(fetched.values()))
     return {
         "source": "serpapi/google_maps_reviews",
         "data_id": data_id,
-        "count": min(len(all_reviews), max_results),
-        "reviews": all_reviews[:max_results],
+        "count": len(stored),
+        "reviews": stored,
         "meta": {
             "fetched_at": dt.datetime.utcnow().isoformat() + "Z",
-            "sort_by": sort_by,
+            "sort_by": "newest",
+            "mode": "delta",
+            "pages": cur.pages,
+            "new": added["new"],
+            "updated": added["updated"],
+            "pagination": stats.as_dict(),
+            **({"error": cur.error} if cur.error else {}),
         },
     }
 
@@ -105,94 +190,187 @@ def _to_iso(d: Any) -> Optional[str]:
         return None
     return None
 
+def normalize_review(r: Dict[str, Any]) -> Review:
+    rid = str(r.get("review_id") or r.get("id") or "")
+    rating = float(r.get("rating") or 0)
+
+    # robust date handling
+    date_iso = (
+        _to_iso(r.get("iso_date"))
+        or _to_iso(r.get("iso_date_of_last_edit"))
+        or _to_iso(r.get("date"))
+        or _to_iso(r.get("time"))
+        or _to_iso(r.get("published_at"))
+        or ""
+    )
+
+    rel = r.get("relative_time_description") or r.get("relative_time") or ""
+    text = (r.get("snippet") or r.get("text") or r.get("content") or "").strip()
+    author = r.get("author_name") or r.get("author")
+    if not author:
+        prof = r.get("user") or r.get("profile") or {}
+        if isinstance(prof, dict):
+            author = prof.get("name")
+
+    return Review(rid, rating, date_iso, rel, text, author)
+
+@traced("normalize_reviews")
 def normalize_reviews(raw: Dict[str, Any]) -> List[Review]:
-    items = raw.get("reviews") or []
-    out: List[Review] = []
-    for r in items:
-        rid = str(r.get("review_id") or r.get("id") or "")
-        rating = float(r.get("rating") or 0)
-
-        # robust date handling
-        date_iso = (
-            _to_iso(r.get("iso_date"))
-            or _to_iso(r.get("iso_date_of_last_edit"))
-            or _to_iso(r.get("date"))
-            or _to_iso(r.get("time"))
-            or _to_iso(r.get("published_at"))
-            or ""
-        )
-
-        rel = r.get("relative_time_description") or r.get("relative_time") or ""
-        text = (r.get("snippet") or r.get("text") or r.get("content") or "").strip()
-        author = r.get("author_name") or r.get("author")
-        if not author:
-            prof = r.get("user") or r.get("profile") or {}
-            if isinstance(prof, dict):
-                author = prof.get("name")
-
-        out.append(Review(rid, rating, date_iso, rel, text, author))
-    return out
+    return [normalize_review(r) for r in raw.get("reviews") or []]
+
+# --------- Streaming ----------
+def iter_reviews(
+    data_id: str,
+    *,
+    max_results: int = 500,
+    lang: str = "en",
+    sort_by: str = "newest",
+    page_fn: Optional[PageFn] = None,
+    checkpoint_dir: Optional[Path] = None
+) -> Iterator[Review]:
+    """
+    Stream normalized reviews as pages arrive; nothing beyond the current page
+    is held in memory. A resumed fetch re-yields its checkpointed pages first.
+    """
+    _require_key()
+    sched = _scheduler(page_fn)
+    sched.add(PageCursor(data_id, lang=lang, sort_by=sort_by, max_results=max_results, keep_reviews=False,
+                         checkpoint=_checkpoint(checkpoint_dir, data_id, sort_by, lang)))
+    for _, page in sched.iter_pages():
+        for r in page:
+            yield normalize_review(r)
+
+class NdjsonSink:
+    """Append-only NDJSON writer: one normalized review per line, flushed per write."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.path.open("w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, review: Review) -> None:
+        self._f.write(json.dumps(asdict(review), ensure_ascii=False) + "\n")
+        self._f.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "NdjsonSink":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
 
 def filter_window(reviews: List[Review], window: str = "last90") -> List[Review]:
     """
-    Client-side time window: "all", "last90", or "last180".
+    Client-side time window: "all", "last90", "last180", any "lastN",
+    "YYYY-MM" or "YYYY-MM-DD..YYYY-MM-DD".
     """
-    if window == "all":
+    bounds = window_bounds(window)
+    if bounds is None:
         return reviews
-    today = dt.date.today()
-    cutoff = today - dt.timedelta(days=90 if window == "last90" else 180)
-    kept: List[Review] = []
-    for r in reviews:
-        if not r.date:
-            continue
-        try:
-            if dt.date.fromisoformat(r.date) >= cutoff:
-                kept.append(r)
-        except Exception:
-            pass
-    return kept
+    lo, hi = bounds
+    # undated reviews (ordinal 0) never fall inside a window
+    return [r for r in reviews if lo <= date_ordinal(r.date) <= hi]
 
 # --------------- CLI --------------------
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser(description="Phase 2: fetch & normalize Google reviews by data_id (SerpAPI client).")
+    import tracing
+    parser = argparse.ArgumentParser(description="Phase 2: fetch & normalize Google reviews by data_id (pooled SerpAPI session).")
     parser.add_argument("--data-id", required=True, help="Google Maps data_id (e.g., '0x...:0x...').")
     parser.add_argument("--max", type=int, default=400, help="Max reviews to fetch.")
     parser.add_argument("--lang", default="en", help="Language for results (hl).")
     parser.add_argument("--sort", default="newest", choices=["newest","rating","most_relevant"], help="Sort order.")
-    parser.add_argument("--window", choices=["all","last90","last180"], default="all",
-                        help="Client-side date window filter.")
+    parser.add_argument("--window", type=window_arg, default="all",
+                        help="Client-side date window: all, last90, last180, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD.")
     parser.add_argument("--preview", type=int, default=0,
                         help="If >0, print this many normalized reviews for quick inspection.")
+    parser.add_argument("--store", default=None,
+                        help="Review store directory (e.g. .cache/reviews). Enables --delta.")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only fetch reviews newer than the store (requires --store; forces --sort newest).")
+    parser.add_argument("--out-ndjson", default=None,
+                        help="Write normalized reviews as NDJSON (streamed page by page unless --store is used).")
+    parser.add_argument("--checkpoint-dir", default=".cache/checkpoints",
+                        help="Save each page as it lands so an interrupted fetch resumes where it stopped.")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Disable fetch checkpoints.")
+    transport.add_cli_args(parser)
+    tracing.add_cli_args(parser)
     args = parser.parse_args()
+    cache_overrides = transport.cache_overrides(args)
+    if cache_overrides:
+        transport.configure(**cache_overrides)
 
-    raw = fetch_all_reviews(
-        args.data_id,
-        max_results=args.max,
-        lang=args.lang,
-        sort_by=args.sort
-    )
-    norm = normalize_reviews(raw)
-    if args.window != "all":
-        norm = filter_window(norm, args.window)
-
-    summary = {
-        "data_id": raw["data_id"],
-        "fetched_count": raw["count"],
-        "normalized_count": len(norm),
-        "window": args.window,
-        "sort_by": raw["meta"]["sort_by"]
-    }
-    print(json.dumps(summary, indent=2, ensure_ascii=False))
-
-    if args.preview > 0:
-        sample = [{
-            "review_id": r.review_id,
-            "rating": r.rating,
-            "date": r.date,
-            "relative_time": r.relative_time,
-            "author": r.author,
-            "text": r.text[:200]  # trim for console
-        } for r in norm[:args.preview]]
-        print("\nPREVIEW:")
-        print(json.dumps(sample, indent=2, ensure_ascii=False))
+    if args.delta and not args.store:
+        parser.error("--delta requires --store")
+    tracing.start_from_args(args)
+    checkpoint_dir = None if args.no_checkpoint else Path(args.checkpoint_dir)
+
+    if args.out_ndjson and not args.store:
+        # streaming: each page is normalized and written as it lands
+        with NdjsonSink(Path(args.out_ndjson)) as sink:
+            for r in iter_reviews(args.data_id, max_results=args.max, lang=args.lang, sort_by=args.sort,
+                                  checkpoint_dir=checkpoint_dir):
+                if args.window == "all" or filter_window([r], args.window):
+                    sink.write(r)
+        print(json.dumps({
+            "data_id": args.data_id,
+            "normalized_count": sink.count,
+            "window": args.window,
+            "sort_by": args.sort,
+            "out_ndjson": str(sink.path),
+        }, indent=2, ensure_ascii=False))
+    else:
+        if args.delta:
+            raw = fetch_new_reviews(args.data_id, ReviewStore(Path(args.store)), max_results=args.max, lang=args.lang)
+        else:
+            raw = fetch_all_reviews(
+                args.data_id,
+                max_results=args.max,
+                lang=args.lang,
+                sort_by=args.sort,
+                checkpoint_dir=checkpoint_dir
+            )
+            if args.store:
+                store = ReviewStore(Path(args.store))
+                store.merge(raw["data_id"], raw["reviews"])
+                store.save(raw["data_id"])
+        norm = normalize_reviews(raw)
+        if args.window != "all":
+            norm = filter_window(norm, args.window)
+        if args.out_ndjson:
+            with NdjsonSink(Path(args.out_ndjson)) as sink:
+                for r in norm:
+                    sink.write(r)
+
+        summary = {
+            "data_id": raw["data_id"],
+            "fetched_count": raw["count"],
+            "normalized_count": len(norm),
+            "window": args.window,
+            "sort_by": raw["meta"]["sort_by"],
+            "pagination": raw["meta"]["pagination"],
+        }
+        if raw["meta"].get("resumed"):
+            summary["resumed"] = True
+        if raw["meta"].get("error"):
+            summary["error"] = raw["meta"]["error"]
+        if raw["meta"].get("mode") == "delta":
+            summary.update({k: raw["meta"][k] for k in ("pages", "new", "updated")})
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+        if args.preview > 0:
+            sample = [{
+                "review_id": r.review_id,
+                "rating": r.rating,
+                "date": r.date,
+                "relative_time": r.relative_time,
+                "author": r.author,
+                "text": r.text[:200]  # trim for console
+            } for r in norm[:args.preview]]
+            print("\nPREVIEW:")
+            print(json.dumps(sample, indent=2, ensure_ascii=False))
+    tracing.finish_from_args(args)
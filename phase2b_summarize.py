@@ -1,113 +1,93 @@
 # phase2b_summarize.py
 from __future__ import annotations
-import os, json
+import copy, os, json
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 import datetime as dt
-
-from dotenv import load_dotenv
-from serpapi import GoogleSearch
-from openai import OpenAI
-
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor
+
+from dedupe import MODES as DEDUPE_MODES, DedupeReport, Deduper
+from dates import date_ordinal, window_arg, window_bounds
+from envfile import load_env
+from llm_cache import SummaryCache, content_key
+from llm_dispatch import BatchWriter, estimate_tokens, get_dispatcher
+from pagination import PageCursor
+# fetch + normalize live once, in phase2_fetch; re-exported here for the CLI and callers
+from phase2_fetch import (NdjsonSink, Review, _checkpoint, _scheduler, fetch_all_reviews, normalize_review,
+                          normalize_reviews)
+from quotes import QuoteSelector, select_quotes
+from theme_matcher import ThemeMatcher
+import tracing
+from tracing import traced
+import transport
+from trends import TrendAccumulator
+
+load_env()
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY", "").strip()
 OPENAI_API_KEY  = os.getenv("OPENAI_API_KEY", "").strip()
 
-# ---------------- Models ----------------
-@dataclass
-class Review:
-    review_id: str
-    rating: float
-    date: str
-    relative_time: str
-    text: str
-    author: Optional[str]
-    source: str = "google_maps_reviews"
-
 # ------------- Fetch (SerpAPI) -------------
 def _require_keys(fetch_needed: bool = True):
-    if fetch_needed and not SERPAPI_API_KEY:
+    if fetch_needed and not SERPAPI_API_KEY and not transport.offline():
         raise RuntimeError("Missing SERPAPI_API_KEY")
     if not OPENAI_API_KEY:
         raise RuntimeError("Missing OPENAI_API_KEY")
 
-def _page(data_id: str, next_page_token: Optional[str] = None, *, lang="en", sort_by="newest") -> Dict[str, Any]:
-    params = {"engine":"google_maps_reviews","data_id":data_id,"hl":lang,"api_key":SERPAPI_API_KEY,"sort_by":sort_by}
-    if next_page_token:
-        params["next_page_token"] = next_page_token
-    return GoogleSearch(params).get_dict()
-
-def _next_token(payload: Dict[str, Any]) -> Optional[str]:
-    if payload.get("next_page_token"): return payload["next_page_token"]
-    pag = payload.get("serpapi_pagination") or {}
-    return pag.get("next_page_token") if isinstance(pag, dict) else None
-
-def fetch_all_reviews(data_id: str, *, max_results=500, lang="en", sort_by="newest") -> Dict[str, Any]:
-    all_reviews: List[Dict[str, Any]] = []
-    token: Optional[str] = None
-    while True:
-        payload = _page(data_id, token, lang=lang, sort_by=sort_by)
-        reviews = payload.get("reviews") or payload.get("reviews_results") or []
-        all_reviews.extend(reviews)
-        if len(all_reviews) >= max_results: break
-        token = _next_token(payload)
-        if not token: break
-    return {"data_id": data_id, "reviews": all_reviews}
+def iter_raw_reviews(data_id: str, *, max_results=500, lang="en", sort_by="newest",
+                     checkpoint_dir: Optional[Path] = None,
+                     meta: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream raw reviews page by page without holding the full list. When the
+    stream ends, `meta` (if given) gets "pages" and, for a fetch that stopped
+    early, "error".
+    """
+    cur = PageCursor(data_id, lang=lang, sort_by=sort_by, max_results=max_results, keep_reviews=False,
+                     checkpoint=_checkpoint(checkpoint_dir, data_id, sort_by, lang))
+    sched = _scheduler(None)
+    sched.add(cur)
+    for _, page in sched.iter_pages():
+        yield from page
+    if meta is not None:
+        meta["pages"] = cur.pages
+        if cur.error:
+            meta["error"] = cur.error
+    if cur.error:
+        print(f"[warn] Fetch stopped early after {cur.pages} pages: {cur.error}")
+
+def iter_raw_file(path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Reviews from a saved file. NDJSON (*.ndjson / *.jsonl) is streamed line by
+    line; JSON (envelope or list) has to be parsed whole.
+    """
+    if path.suffix.lower() in (".ndjson", ".jsonl"):
+        with path.open(encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise RuntimeError(f"Invalid NDJSON line {n} in {path}") from e
+        return
+    with path.open(encoding="utf-8") as f:
+        try:
+            parsed = json.load(f)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"Invalid JSON file: {path}") from e
+    yield from (parsed.get("reviews") or []) if isinstance(parsed, dict) else parsed
 
 # ------------- Normalize & window -------------
-def _to_iso(date_like: Any) -> Optional[str]:
-    try:
-        if isinstance(date_like, (int, float)):
-            return dt.datetime.utcfromtimestamp(date_like).date().isoformat()
-        if isinstance(date_like, str):
-            s = date_like.replace(" UTC","").replace("Z","")
-            try:
-                return dt.datetime.fromisoformat(s).date().isoformat()
-            except Exception:
-                return dt.datetime.strptime(s[:10], "%Y-%m-%d").date().isoformat()
-    except Exception:
-        return None
-    return None
-
-def normalize_reviews(raw: Dict[str, Any]) -> List[Review]:
-    items = raw.get("reviews") or []
-    out: List[Review] = []
+def iter_normalized(items: Iterable[Dict[str, Any]]) -> Iterator[Review]:
     for r in items:
-        rid = str(r.get("review_id") or r.get("id") or "")
-        rating = float(r.get("rating") or 0)
-        date_iso = (
-            _to_iso(r.get("iso_date")) or
-            _to_iso(r.get("iso_date_of_last_edit")) or
-            _to_iso(r.get("date")) or
-            _to_iso(r.get("time")) or
-            _to_iso(r.get("published_at")) or
-            ""
-        )
-        rel = r.get("relative_time_description") or r.get("relative_time") or ""
-        text = (r.get("snippet") or r.get("text") or r.get("content") or "").strip()
-        author = r.get("author_name") or r.get("author")
-        if not author:
-            prof = r.get("user") or r.get("profile") or {}
-            if isinstance(prof, dict):
-                author = prof.get("name")
-        out.append(Review(rid, rating, date_iso, rel, text, author))
-    return out
+        yield normalize_review(r)
 
 def filter_window(reviews: List[Review], window: str) -> List[Review]:
-    if window == "all": return reviews
-    days = 90 if window == "last90" else 180
-    cutoff = dt.date.today() - dt.timedelta(days=days)
-    kept: List[Review] = []
-    for r in reviews:
-        if not r.date: 
-            continue  # exclude undated from windowed views
-        try:
-            if dt.date.fromisoformat(r.date) >= cutoff:
-                kept.append(r)
-        except Exception:
-            pass
-    return kept
+    """Window spec: all, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD (see dates.window_bounds)."""
+    bounds = window_bounds(window)
+    if bounds is None: return reviews
+    lo, hi = bounds
+    # exclude undated from windowed views (ordinal 0 < lo)
+    return [r for r in reviews if lo <= date_ordinal(r.date) <= hi]
 
 # ------------- Light analytics -------------
 def sentiment_bucket(rating: float) -> str:
@@ -124,58 +104,280 @@ THEME_KEYWORDS = {
     "Events": ["quiz","karaoke","event","live","host"],
 }
 
-def _kw_hits(text: str, words: List[str]) -> bool:
-    t = text.lower()
-    return any(w in t for w in words)
+# compiled once: one lowercase + one scan per review for all themes
+THEME_MATCHER = ThemeMatcher(THEME_KEYWORDS)
 
-def theme_breakdown(reviews: List[Review]) -> Dict[str, Dict[str, int]]:
-    out: Dict[str, Dict[str,int]] = {}
-    for theme, words in THEME_KEYWORDS.items():
-        pos=neu=neg=0
-        for r in reviews:
-            if _kw_hits(r.text, words):
-                b = sentiment_bucket(r.rating)
-                if b == "positive": pos+=1
-                elif b == "negative": neg+=1
-                else: neu+=1
-        out[theme] = {"positive":pos,"neutral":neu,"negative":neg}
+@traced("theme_breakdown")
+def theme_breakdown(reviews: List[Review]) -> Dict[str, Dict[str,int]]:
+    out: Dict[str, Dict[str,int]] = {t: {"positive":0,"neutral":0,"negative":0} for t in THEME_KEYWORDS}
+    for r in reviews:
+        hits = THEME_MATCHER.match(r.text)
+        if hits:
+            b = sentiment_bucket(r.rating)
+            for theme in hits:
+                out[theme][b] += 1
     return out
 
-def basic_metrics(reviews: List[Review]) -> Dict[str, Any]:
-    if not reviews:
-        return {"count":0,"avg_rating":None,"pos":0,"neu":0,"neg":0}
-    ratings = [r.rating for r in reviews if isinstance(r.rating, (int,float))]
-    buckets = [sentiment_bucket(r.rating) for r in reviews]
-    return {
-        "count": len(reviews),
-        "avg_rating": round(sum(ratings)/len(ratings), 2) if ratings else None,
-        "pos": buckets.count("positive"),
-        "neu": buckets.count("neutral"),
-        "neg": buckets.count("negative"),
-    }
+def basic_metrics(reviews: Iterable[Review]) -> Dict[str, Any]:
+    """Count, mean rating and sentiment split in one pass."""
+    c = _Counts()
+    for r in reviews:
+        c.add(r.rating, sentiment_bucket(r.rating))
+    return c.as_metrics()
+
+def _quote(r: Review) -> Dict[str, Any]:
+    return {"text": r.text[:300], "author": r.author or "Guest", "rating": r.rating, "date": r.date}
 
 def sample_quotes(reviews: List[Review], n=6) -> List[Dict[str, Any]]:
-    pos = [r for r in reviews if sentiment_bucket(r.rating)=="positive"]
-    neg = [r for r in reviews if sentiment_bucket(r.rating)=="negative"]
-    mix = (pos[: n//2]) + (neg[: n - n//2])
-    return [{"text": r.text[:300], "author": r.author or "Guest", "rating": r.rating, "date": r.date} for r in mix]
+    """Best n//2 positive + rest negative quotes (see quotes.QuoteSelector), near-duplicates skipped."""
+    picked = select_quotes(reviews, sentiment_bucket, THEME_MATCHER.match,
+                           k_positive=n // 2, k_negative=n - n // 2, k_theme=0)
+    return [_quote(r) for r in picked["positive"] + picked["negative"]]
 
 def slice_last90(reviews: List[Review]) -> List[Review]:
-    cutoff = dt.date.today() - dt.timedelta(days=90)
-    out = []
+    return filter_window(reviews, "last90")
+
+def avg_rating(reviews: Iterable[Review]) -> Optional[float]:
+    n, total = 0, 0.0
     for r in reviews:
-        if not r.date:
-            continue
-        try:
-            if dt.date.fromisoformat(r.date) >= cutoff:
-                out.append(r)
-        except Exception:
-            pass
+        n += 1
+        total += r.rating
+    return round(total / n, 2) if n else None
+
+# ------------- Facts -------------
+class _Counts:
+    __slots__ = ("count", "rating_sum", "pos", "neu", "neg")
+
+    def __init__(self):
+        self.count = 0
+        self.rating_sum = 0.0
+        self.pos = self.neu = self.neg = 0
+
+    def add(self, rating: float, bucket: str) -> None:
+        self.count += 1
+        self.rating_sum += rating
+        if bucket == "positive": self.pos += 1
+        elif bucket == "negative": self.neg += 1
+        else: self.neu += 1
+
+    def add_counts(self, count: int, rating_sum: float, pos: int, neu: int, neg: int) -> None:
+        self.count += count
+        self.rating_sum += rating_sum
+        self.pos += pos
+        self.neu += neu
+        self.neg += neg
+
+    def as_metrics(self) -> Dict[str, Any]:
+        # same shape as basic_metrics()
+        return {
+            "count": self.count,
+            "avg_rating": round(self.rating_sum / self.count, 2) if self.count else None,
+            "pos": self.pos, "neu": self.neu, "neg": self.neg,
+        }
+
+class FactsAccumulator:
+    """
+    Streaming equivalent of build_facts: feed reviews one at a time with add()
+    and call facts() whenever a snapshot is wanted. Memory is bounded by the
+    number of themes and quote candidates, not by review count.
+    With `trends=True` the same pass also fills a TrendAccumulator (rolling
+    windows, monthly/weekly buckets, direction of travel) under facts["trends"].
+    """
+
+    def __init__(self, window: str, *, today: Optional[dt.date] = None, quotes_n: int = 6,
+                 theme_quotes: int = 1, trends: bool = False):
+        self.window = window
+        self.trends = TrendAccumulator(today=today) if trends else None
+        self._win = window_bounds(window, today)
+        self._cut90 = window_bounds("last90", today)[0]
+        self.all, self.win, self.last90 = _Counts(), _Counts(), _Counts()
+        self.themes = {t: {"positive": 0, "neutral": 0, "negative": 0} for t in THEME_KEYWORDS}
+        self.quotes = QuoteSelector(k_positive=quotes_n // 2, k_negative=quotes_n - quotes_n // 2,
+                                    k_theme=theme_quotes, today=today)
+
+    def add(self, r: Review) -> None:
+        b = sentiment_bucket(r.rating)
+        self.all.add(r.rating, b)
+        d = date_ordinal(r.date)
+        if d and d >= self._cut90:
+            self.last90.add(r.rating, b)
+        in_win = self._win is None or self._win[0] <= d <= self._win[1]
+        hits = THEME_MATCHER.match(r.text) if (in_win or self.trends) else frozenset()
+        if self.trends is not None:
+            self.trends.add(d, r.rating, b, hits)
+        if not in_win:
+            return  # exclude undated from windowed views (d == 0)
+        self.win.add(r.rating, b)
+        for theme in hits:
+            self.themes[theme][b] += 1
+        self.quotes.add(r, b, hits)
+
+    def add_day(self, day: int, count: int, rating_sum: float, pos: int, neu: int, neg: int,
+                themes: Dict[str, List[int]]) -> None:
+        """
+        Merge one pre-aggregated day (`themes`: theme -> [pos, neu, neg]
+        mentions), with the same effect on counts as add() for each of its
+        reviews. Quotes are not touched; offer candidates via self.quotes.
+        """
+        self.all.add_counts(count, rating_sum, pos, neu, neg)
+        if day and day >= self._cut90:
+            self.last90.add_counts(count, rating_sum, pos, neu, neg)
+        if self.trends is not None:
+            self.trends.add_day(day, count, rating_sum, pos, neu, neg,
+                                {t: (sum(c), c[2]) for t, c in themes.items()})
+        if self._win is not None and not (self._win[0] <= day <= self._win[1]):
+            return
+        self.win.add_counts(count, rating_sum, pos, neu, neg)
+        for t, (p, n, ng) in themes.items():
+            th = self.themes[t]
+            th["positive"] += p
+            th["neutral"] += n
+            th["negative"] += ng
+
+    def facts(self) -> Dict[str, Any]:
+        metrics_all = self.all.as_metrics()
+        metrics_win = self.win.as_metrics()
+        metrics_last90 = self.last90.as_metrics()
+        window = self.window
+        picked = self.quotes.select()
+        facts = {
+            "window": window,
+            "window_is_all": (window == "all"),
+            "total_reviews_all_time": metrics_all["count"],
+            "reviews_in_window": metrics_win["count"],
+            "avg_rating_in_window": metrics_win["avg_rating"],
+            "last90": {
+                "count": metrics_last90["count"],
+                "avg_rating": metrics_last90["avg_rating"],
+            },
+            "all_time": {
+                "count": metrics_all["count"],
+                "avg_rating": metrics_all["avg_rating"],
+            },
+            "sentiment_counts_window": {
+                "positive": metrics_win["pos"],
+                "neutral": metrics_win["neu"],
+                "negative": metrics_win["neg"],
+            },
+            "themes_window": {t: dict(c) for t, c in self.themes.items()},
+            "quotes": [_quote(r) for r in picked["positive"] + picked["negative"]],
+            "theme_quotes": {t: [_quote(r) for r in picked["themes"][t]]
+                             for t in THEME_KEYWORDS if t in picked["themes"]},
+            # narrative hints for the LLM
+            "narrative_hints": {
+                "suppress_volume_trend": (window == "all"),
+                "prefer_trend_statement": (metrics_last90["count"] > 0 and window != "last90"),
+            },
+        }
+        if self.trends is not None:
+            facts["trends"] = self.trends.result()
+            facts["narrative_hints"]["direction_of_travel"] = facts["trends"]["direction"]["signal"]
+        return facts
+
+@traced("build_facts")
+def build_facts(reviews: Iterable[Review], window: str, *, trends: bool = False) -> Dict[str, Any]:
+    """
+    Build the facts dict handed to the LLM (and written as *_facts.json)
+    in a single pass over `reviews` (a list or any iterator).
+    `trends=True` adds rolling windows, monthly/weekly series and a direction signal.
+    """
+    acc = FactsAccumulator(window, trends=trends)
+    for r in reviews:
+        acc.add(r)
+    return acc.facts()
+
+def _drop_zero_themes(themes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for t, counts in themes.items():
+        nz = {k: v for k, v in counts.items() if v}
+        if any(isinstance(v, (int, float)) and v for v in nz.values()):
+            out[t] = nz
     return out
 
-def avg_rating(reviews: List[Review]) -> Optional[float]:
-    vals = [r.rating for r in reviews if isinstance(r.rating, (int, float))]
-    return round(sum(vals)/len(vals), 2) if vals else None
+def _round_floats(obj: Any, ndigits: int) -> Any:
+    if isinstance(obj, float):
+        return round(obj, ndigits)
+    if isinstance(obj, dict):
+        return {k: _round_floats(v, ndigits) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_round_floats(v, ndigits) for v in obj]
+    return obj
+
+def _shorten(text: str, n: int) -> str:
+    if len(text) <= n:
+        return text
+    cut = text[:n].rsplit(" ", 1)[0] or text[:n]
+    return cut.rstrip(" ,.;:") + "…"
+
+def _compaction_steps() -> List[Tuple[str, Any]]:
+    """Ordered least-lossy first; each step mutates a facts copy in place."""
+    def zero_themes(f):
+        f["themes_window"] = _drop_zero_themes(f.get("themes_window", {}))
+        for series in ("monthly", "weekly"):
+            for b in (f.get("trends") or {}).get(series, []):
+                if not b.get("themes"):
+                    b.pop("themes", None)
+    def quotes_to(n):
+        def step(f):
+            for q in f.get("quotes", []) + [q for qs in f.get("theme_quotes", {}).values() for q in qs]:
+                q["text"] = _shorten(q["text"], n)
+        return step
+    def drop_theme_quotes(f):
+        f.pop("theme_quotes", None)
+    def drop_weekly(f):
+        (f.get("trends") or {}).pop("weekly", None)
+    def monthly_to(n):
+        def step(f):
+            if f.get("trends", {}).get("monthly"):
+                f["trends"]["monthly"] = f["trends"]["monthly"][-n:]
+        return step
+    def round_1(f):
+        f.update(_round_floats(f, 1))
+    def fewer_quotes(n):
+        def step(f):
+            qs = f.get("quotes", [])
+            if len(qs) > n:
+                # keep the positive/negative balance
+                pos = [q for q in qs if q.get("rating", 0) >= 4][: (n + 1) // 2]
+                neg = [q for q in qs if q.get("rating", 0) < 4][: n - len(pos)]
+                f["quotes"] = pos + neg
+        return step
+    return [
+        ("drop_zero_themes", zero_themes),
+        ("quotes_160", quotes_to(160)),
+        ("drop_theme_quotes", drop_theme_quotes),
+        ("drop_weekly", drop_weekly),
+        ("monthly_12", monthly_to(12)),
+        ("round_1dp", round_1),
+        ("quotes_80", quotes_to(80)),
+        ("quotes_4", fewer_quotes(4)),
+        ("monthly_6", monthly_to(6)),
+        ("quotes_2", fewer_quotes(2)),
+    ]
+
+@traced("compact_facts")
+def compact_facts(facts: Dict[str, Any], budget_tokens: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Trim the facts handed to the LLM until their JSON fits `budget_tokens`:
+    drop zero themes, shorten quotes, drop per-theme quotes, thin the trend
+    series, round to 1dp, then fewer quotes. Stops at the first step that fits; the headline counts
+    and averages are never removed. Returns (compacted copy, report).
+    """
+    before = estimate_tokens(json.dumps(facts, ensure_ascii=False))
+    report: Dict[str, Any] = {"budget": budget_tokens, "tokens_before": before, "steps": []}
+    out = facts
+    tokens = before
+    if before > budget_tokens:
+        out = copy.deepcopy(facts)
+        for name, step in _compaction_steps():
+            step(out)
+            report["steps"].append(name)
+            tokens = estimate_tokens(json.dumps(out, ensure_ascii=False))
+            if tokens <= budget_tokens:
+                break
+    report["tokens_after"] = tokens
+    report["within_budget"] = tokens <= budget_tokens
+    return out, report
 
 # ------------- Style & LLM -------------
 DEFAULT_STYLE_TEXT = """# Pub Pulse Summary — [PUB_NAME]
@@ -249,97 +451,345 @@ def load_style(path: Optional[str]) -> str:
     print("[warn] No style file found, using built-in default style")
     return DEFAULT_STYLE_TEXT
 
-def make_llm_summary(pub_title: str, date_window: str, facts: Dict[str, Any], style_text: str, model="gpt-4o-mini") -> str:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+SYSTEM_PROMPT = (
+    "You are a precise analyst. Follow the style guide exactly. "
+    "Use only provided facts/quotes. "
+    "If window_is_all is true or narrative_hints.suppress_volume_trend is true, "
+    "do NOT claim review volume is 'steady' or 'rising'; only compare last90 vs all-time if last90 exists. "
+    "If facts.trends is present, take the direction of travel from facts.trends.direction.signal "
+    "and quote its numbers rather than inferring a trend."
+)
+
+def _chat(messages: List[Dict[str, str]], model: str, temperature: float,
+          meta: Optional[Dict[str, Any]] = None) -> str:
+    # every caller (threads included) shares one RPM/TPM-aware async dispatcher
+    return get_dispatcher().chat(messages, model, temperature, meta=meta)
+
+def _key_facts(facts: Dict[str, Any]) -> Dict[str, Any]:
+    """Facts as the cache key sees them: quote order (ties in the selector) doesn't count."""
+    order = lambda q: (q.get("date") or "", q.get("text") or "", q.get("author") or "")
+    out = dict(facts)
+    if "quotes" in out:
+        out["quotes"] = sorted(out["quotes"], key=order)
+    if "theme_quotes" in out:
+        out["theme_quotes"] = {t: sorted(qs, key=order) for t, qs in out["theme_quotes"].items()}
+    return out
+
+def summary_request(pub_title: str, date_window: str, facts: Dict[str, Any], style_text: str,
+                    model="gpt-4o-mini", *, temperature: float = 0.2, notes: Optional[str] = None,
+                    facts_budget: Optional[int] = None
+                    ) -> Tuple[str, List[Dict[str, str]], Dict[str, Any]]:
+    """
+    (cache key, chat messages, meta) for one Pub Pulse summary. With
+    `facts_budget`, the facts are compacted to that many tokens first; `meta`
+    holds the per-part prompt token estimates and the compaction report.
+    """
+    meta: Dict[str, Any] = {"stage": "summary", "pub": pub_title}
+    if facts_budget:
+        facts, meta["compaction"] = compact_facts(facts, facts_budget)
+    facts_json = json.dumps({
+        "pub_title": pub_title,
+        "window": date_window,
+        "facts": facts
+    }, ensure_ascii=False)
+    meta["prompt_parts"] = {"system": estimate_tokens(SYSTEM_PROMPT), "style": estimate_tokens(style_text),
+                            "facts": estimate_tokens(facts_json),
+                            "notes": estimate_tokens(notes) if notes else 0}
+    key = content_key(system=SYSTEM_PROMPT, style=style_text, model=model, temperature=temperature,
+                      pub_title=pub_title, window=date_window, facts=_key_facts(facts), notes=notes)
     messages = [
-        {
-            "role":"system",
-            "content": (
-                "You are a precise analyst. Follow the style guide exactly. "
-                "Use only provided facts/quotes. "
-                "If window_is_all is true or narrative_hints.suppress_volume_trend is true, "
-                "do NOT claim review volume is 'steady' or 'rising'; only compare last90 vs all-time if last90 exists."
-            )
-        },
+        {"role":"system","content": SYSTEM_PROMPT},
         {"role":"user","content":"Style guide:\n" + style_text},
-        {"role":"user","content":"Summarize this JSON into a Pub Pulse markdown:\n" + json.dumps({
-            "pub_title": pub_title,
-            "window": date_window,
-            "facts": facts
-        }, ensure_ascii=False)}
+        {"role":"user","content":"Summarize this JSON into a Pub Pulse markdown:\n" + facts_json}
     ]
-    resp = client.chat.completions.create(model=model, messages=messages, temperature=0.2)
-    return resp.choices[0].message.content
+    if notes:
+        messages.append({"role":"user","content":(
+            "Review notes distilled from every review in the window (use for themes, staff names, "
+            "events and quotes; numbers must still come from the JSON facts):\n" + notes)})
+    return key, messages, meta
+
+@traced("llm.summary")
+def make_llm_summary(pub_title: str, date_window: str, facts: Dict[str, Any], style_text: str, model="gpt-4o-mini",
+                     *, temperature: float = 0.2, cache: Optional[SummaryCache] = None,
+                     force_refresh: bool = False, notes: Optional[str] = None,
+                     facts_budget: Optional[int] = None) -> str:
+    """
+    With a `cache`, identical inputs (facts, style, model, temperature, prompt,
+    title, window) return the stored markdown without calling the API;
+    `force_refresh` skips the lookup but still stores the fresh result.
+    `notes` (from the map-reduce stage) are passed alongside the facts.
+    `facts_budget` caps the facts' prompt tokens (see compact_facts).
+    """
+    key, messages, meta = summary_request(pub_title, date_window, facts, style_text, model,
+                                          temperature=temperature, notes=notes, facts_budget=facts_budget)
+    if cache and not force_refresh:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+    md = _chat(messages, model, temperature, meta)
+    if cache and md:
+        cache.put(key, md)
+    return md
+
+def queue_llm_summary(pub_title: str, date_window: str, facts: Dict[str, Any], style_text: str,
+                      batch: BatchWriter, model="gpt-4o-mini", *, temperature: float = 0.2,
+                      cache: Optional[SummaryCache] = None, force_refresh: bool = False,
+                      facts_budget: Optional[int] = None,
+                      target: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Batch-mode make_llm_summary: returns the cached markdown if there is one,
+    otherwise adds the request to `batch` (keyed on the cache key) and returns None.
+    `target` ({slug, path, title, window}) is where collect writes the pulse.
+    """
+    key, messages, _ = summary_request(pub_title, date_window, facts, style_text, model,
+                                       temperature=temperature, facts_budget=facts_budget)
+    if cache and not force_refresh:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+    batch.add(key, messages, model, temperature, target=target)
+    return None
+
+# ------------- Map-reduce summarization -------------
+MAP_PROMPT = (
+    "You condense guest reviews of one pub into analyst notes. From the reviews given, list briefly: "
+    "recurring positives, recurring negatives (food execution, speed, service consistency), staff mentioned "
+    "by name with sentiment, events/formats mentioned, value/deals remarks, and up to 3 short verbatim quotes "
+    "(with star rating). Be factual, no preamble, at most ~200 words."
+)
+REDUCE_PROMPT = (
+    "Merge these analyst notes for one pub into a single set of notes with the same headings. "
+    "Keep recurring points, staff names and the most telling quotes; drop repetition. At most ~300 words."
+)
+
+def _review_line(r: Review, max_chars: int = 600) -> str:
+    text = " ".join(r.text.split())[:max_chars]
+    return f"- [{r.date or 'undated'}] {r.rating:g}/5 {r.author or 'Guest'}: {text}"
+
+def chunk_reviews(reviews: Iterable[Review], budget_tokens: int = 3000) -> List[Tuple[str, List[str]]]:
+    """
+    Split reviews into (label, lines) chunks of at most ~budget_tokens each.
+    Chunks never cross a calendar month and fill oldest-first, so when new
+    reviews arrive only the newest month's last chunk changes and every other
+    chunk (and its cached partial summary) stays byte-identical.
+    """
+    by_month: Dict[str, List[Review]] = {}
+    for r in reviews:
+        if r.text:
+            by_month.setdefault(r.date[:7] if r.date else "undated", []).append(r)
+    chunks: List[Tuple[str, List[str]]] = []
+    for month in sorted(by_month):
+        lines: List[str] = []
+        used = part = 0
+        for r in sorted(by_month[month], key=lambda x: (x.date, x.review_id)):
+            line = _review_line(r)
+            cost = estimate_tokens(line)
+            if lines and used + cost > budget_tokens:
+                part += 1
+                chunks.append((f"{month}#{part}", lines))
+                lines, used = [], 0
+            lines.append(line)
+            used += cost
+        if lines:
+            chunks.append((f"{month}#{part + 1}", lines))
+    return chunks
+
+def _cached_chat(prompt: str, label: str, body: str, model: str, cache: Optional[SummaryCache],
+                 force_refresh: bool) -> Tuple[str, bool]:
+    """Returns (text, came_from_cache)."""
+    key = content_key(system=prompt, model=model, temperature=0.0, label=label, body=body) if cache else None
+    if cache and not force_refresh:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit, True
+    out = _chat([{"role": "system", "content": prompt},
+                 {"role": "user", "content": f"{label}\n{body}"}], model, 0.0,
+                {"stage": "map" if prompt is MAP_PROMPT else "reduce", "label": label})
+    if cache and out:
+        cache.put(key, out)
+    return out, False
+
+@traced("llm.mapreduce")
+def make_mapreduce_summary(pub_title: str, date_window: str, facts: Dict[str, Any], reviews: Iterable[Review],
+                           style_text: str, model="gpt-4o-mini", *, chunk_tokens: int = 3000,
+                           reduce_tokens: int = 6000, parallelism: int = 4,
+                           cache: Optional[SummaryCache] = None, force_refresh: bool = False,
+                           facts_budget: Optional[int] = None) -> str:
+    """
+    Hierarchical summary over every review in the window:
+      map    - token-budgeted month chunks summarized concurrently (bounded threads)
+      reduce - partial notes merged in groups until they fit `reduce_tokens`
+      final  - make_llm_summary(facts + merged notes) in the usual Pub Pulse style
+    Partials are cached by content, so reruns only pay for chunks with new reviews.
+    """
+    chunks = chunk_reviews(reviews, chunk_tokens)
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as pool:
+        mapped = list(pool.map(
+            lambda c: _cached_chat(MAP_PROMPT, f"Reviews {c[0]}", "\n".join(c[1]), model, cache, force_refresh),
+            chunks))
+        notes = [text for text, _ in mapped]
+        cached = sum(hit for _, hit in mapped)
+        print(f"[info] Map stage: {len(chunks)} chunks ({cached} cached, {len(chunks) - cached} summarized)")
+
+        level = 0
+        while len(notes) > 1 and estimate_tokens("\n\n".join(notes)) > reduce_tokens:
+            level += 1
+            groups, cur, used = [], [], 0
+            for n in notes:
+                cost = estimate_tokens(n)
+                if cur and used + cost > reduce_tokens:
+                    groups.append(cur)
+                    cur, used = [], 0
+                cur.append(n)
+                used += cost
+            groups.append(cur)
+            if len(groups) == len(notes):   # every note alone exceeds the budget; merge pairwise
+                groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+            notes = [text for text, _ in pool.map(
+                lambda g: _cached_chat(REDUCE_PROMPT, f"Notes (reduce level {level})", "\n\n---\n\n".join(g),
+                                       model, cache, force_refresh),
+                groups)]
+    return make_llm_summary(pub_title, date_window, facts, style_text, model, cache=cache,
+                            force_refresh=force_refresh, notes="\n\n---\n\n".join(notes),
+                            facts_budget=facts_budget)
 
 
 # ------------- CLI -------------
 if __name__ == "__main__":
     import argparse
+    import sys
     ap = argparse.ArgumentParser(description="Phase 2b: summarize normalized reviews into Pub Pulse (Markdown + JSON).")
     src = ap.add_mutually_exclusive_group(required=True)
     src.add_argument("--data-id", help="Google Maps data_id to fetch now.")
-    src.add_argument("--from-json", help="Path to raw reviews JSON previously saved (envelope or list).")
+    src.add_argument("--from-json", help="Path to reviews previously saved: JSON (envelope or list) or NDJSON.")
     ap.add_argument("--pub-title", default="(Pub Name)", help="Shown in the summary header.")
-    ap.add_argument("--window", choices=["all","last90","last180"], default="last90")
+    ap.add_argument("--window", type=window_arg, default="last90",
+                    help="all, last90, last180, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD (default: last90).")
     ap.add_argument("--sort", choices=["newest","rating","most_relevant"], default="newest")
     ap.add_argument("--max", type=int, default=500)
     ap.add_argument("--style-file", help="Path to your style file (*.md/*.txt). If omitted, tries 'pubpulse_style.md'.")
     ap.add_argument("--out-md", default="pub_pulse.md")
     ap.add_argument("--out-json", default="pub_pulse_facts.json")
+    ap.add_argument("--out-ndjson", help="Also write the normalized reviews as NDJSON (streamed).")
+    ap.add_argument("--checkpoint-dir", default=str(Path(".cache") / "checkpoints"),
+                    help="Save fetched pages here so an interrupted fetch resumes (default: .cache/checkpoints).")
+    ap.add_argument("--no-checkpoint", action="store_true", help="Don't checkpoint the fetch.")
+    ap.add_argument("--allow-partial", action="store_true",
+                    help="If the fetch stops early, still write facts (marked partial) and the pulse "
+                         "instead of exiting non-zero.")
+    ap.add_argument("--llm-cache", default=str(Path(".cache") / "llm_summaries"),
+                    help="Directory of cached summaries keyed on facts/style/model (default: .cache/llm_summaries).")
+    ap.add_argument("--no-llm-cache", action="store_true", help="Always call the API; don't read or write the cache.")
+    ap.add_argument("--refresh-summary", action="store_true", help="Ignore a cached summary but store the new one.")
+    ap.add_argument("--trends", action="store_true",
+                    help="Add rolling windows, monthly/weekly series and a direction-of-travel signal to the facts.")
+    ap.add_argument("--map-reduce", action="store_true",
+                    help="Summarize every review in the window in token-budgeted chunks, then reduce into the report.")
+    ap.add_argument("--chunk-tokens", type=int, default=3000, help="Token budget per map chunk (default: 3000).")
+    ap.add_argument("--map-parallelism", type=int, default=4, help="Concurrent chunk summaries (default: 4).")
+    ap.add_argument("--facts-budget", type=int, default=None,
+                    help="Compact the facts sent to the LLM to about this many tokens (the written JSON stays full).")
+    ap.add_argument("--llm-log", help="Append one JSON line per LLM call (tokens, latency, model) to this file.")
+    ap.add_argument("--export", help="Power BI export root (see export.py): this pub's reviews with theme flags "
+                                     "and daily aggregates; only changed month partitions are rewritten.")
+    ap.add_argument("--export-format", choices=("auto", "parquet", "csv"), default="auto")
+    ap.add_argument("--aggregates", help="Persisted per-pub aggregate state (JSON). Only new/edited/removed "
+                                         "reviews are applied to it and the facts are built from it.")
+    ap.add_argument("--dedupe", choices=DEDUPE_MODES, default="off",
+                    help="Near-duplicate reviews: flag (report only) or collapse (drop same-pub copies before metrics).")
+    ap.add_argument("--dedupe-index", default=str(Path(".cache") / "dedupe.sqlite"),
+                    help="Persisted MinHash index, shared across pubs and runs (default: .cache/dedupe.sqlite).")
+    ap.add_argument("--dedupe-threshold", type=float, default=0.8, help="Estimated Jaccard for a duplicate (default: 0.8).")
+    transport.add_cli_args(ap)
+    tracing.add_cli_args(ap)
     args = ap.parse_args()
+    tracing.start_from_args(args)
+    cache_overrides = transport.cache_overrides(args)
+    if cache_overrides:
+        transport.configure(**cache_overrides)
 
     # Determine if we need SerpAPI key (only when fetching)
     _require_keys(fetch_needed=bool(args.data_id))
 
-    # 1) Load / fetch
+    # 1) Load / fetch (streamed: pages/lines become reviews as they arrive)
+    fetch_meta: Dict[str, Any] = {}
     if args.from_json:
-        raw_text = Path(args.from_json).read_text(encoding="utf-8")
-        try:
-            parsed = json.loads(raw_text)
-        except json.JSONDecodeError as e:
-            raise RuntimeError(f"Invalid JSON file: {args.from_json}") from e
-        raw = parsed if isinstance(parsed, dict) else {"reviews": parsed}
+        items = iter_raw_file(Path(args.from_json))
     else:
-        raw = fetch_all_reviews(args.data_id, max_results=args.max, sort_by=args.sort)
-
-    # 2) Normalize + window
-    reviews = normalize_reviews(raw)
-    reviews_win = filter_window(reviews, args.window)
-    last90 = slice_last90(reviews)  # for trend comparison
-
-       # 3) Build facts for the LLM
-    last90 = slice_last90(reviews)
-    metrics_all = basic_metrics(reviews)
-    metrics_win = basic_metrics(reviews_win)
-    metrics_last90 = basic_metrics(last90)
-
-    facts = {
-        "window": args.window,
-        "window_is_all": (args.window == "all"),
-        "total_reviews_all_time": metrics_all["count"],
-        "reviews_in_window": metrics_win["count"],
-        "avg_rating_in_window": metrics_win["avg_rating"],
-        "last90": {
-            "count": metrics_last90["count"],
-            "avg_rating": metrics_last90["avg_rating"],
-        },
-        "all_time": {
-            "count": metrics_all["count"],
-            "avg_rating": metrics_all["avg_rating"],
-        },
-        "sentiment_counts_window": {
-            "positive": metrics_win["pos"],
-            "neutral": metrics_win["neu"],
-            "negative": metrics_win["neg"],
-        },
-        "themes_window": theme_breakdown(reviews_win),
-        "quotes": sample_quotes(reviews_win, n=6),
-        # narrative hints for the LLM
-        "narrative_hints": {
-            "suppress_volume_trend": (args.window == "all"),
-            "prefer_trend_statement": (metrics_last90["count"] > 0 and args.window != "last90"),
-        },
-    }
+        items = iter_raw_reviews(args.data_id, max_results=args.max, sort_by=args.sort,
+                                 checkpoint_dir=None if args.no_checkpoint else Path(args.checkpoint_dir),
+                                 meta=fetch_meta)
+
+    # 2) Normalize + build facts for the LLM in one pass
+    acc = FactsAccumulator(args.window, trends=args.trends)
+    sink = NdjsonSink(Path(args.out_ndjson)) if args.out_ndjson else None
+    bounds = window_bounds(args.window)
+    in_window: List[Review] = []   # only kept for --map-reduce
+    source = args.data_id or Path(args.from_json).stem
+    deduper = None
+    reviews = iter_normalized(items)
+    if args.dedupe != "off":
+        deduper = Deduper(Path(args.dedupe_index), mode=args.dedupe, threshold=args.dedupe_threshold)
+        dedupe_report = DedupeReport(args.dedupe)
+        reviews = deduper.iter_apply(source, reviews, dedupe_report)
+    export = None
+    if args.export:
+        from export import Exporter   # imports this module, so only on this path
+        export = Exporter(Path(args.export), args.export_format).pub(source, args.data_id)
+    agg = None
+    if args.aggregates:
+        from aggregates import PubAggregate   # imports this module, so only on this path
+        agg = PubAggregate.load(Path(args.aggregates), source)
+
+    def tee(reviews: Iterable[Review]) -> Iterator[Review]:
+        for r in reviews:
+            if sink:
+                sink.write(r)
+            if export:
+                export.write(r)
+            if args.map_reduce and (bounds is None or bounds[0] <= date_ordinal(r.date) <= bounds[1]):
+                in_window.append(r)
+            yield r
+
+    with tracing.span("load_and_analyze") as sp:
+        try:
+            if agg is not None:
+                # a fetch that stopped early only adds/updates; missing reviews are not removals
+                delta = agg.apply(tee(reviews), complete=lambda: "error" not in fetch_meta)
+            else:
+                for r in tee(reviews):
+                    acc.add(r)
+        finally:
+            if sink:
+                sink.close()
+        if agg is not None:
+            facts = agg.facts(args.window, trends=args.trends)
+            agg.save(Path(args.aggregates))
+            print(f"[info] Aggregates: {delta['added']} added, {delta['updated']} updated, "
+                  f"{delta['removed']} removed, {delta['unchanged']} unchanged ({args.aggregates})")
+        else:
+            facts = acc.facts()
+        if export is not None:
+            res = export.close()
+            print(f"[info] Export: {res['written']} partitions written, {res['unchanged']} unchanged "
+                  f"({export.exporter.fmt} in {args.export})")
+        if deduper is not None:
+            deduper.close()
+            facts["dedupe"] = dedupe_report.as_dict(top=0)
+            print(f"[info] Dedupe: {dedupe_report.duplicates}/{dedupe_report.checked} near-duplicates "
+                  f"in {len(dedupe_report.clusters)} clusters ({dedupe_report.removed} removed)")
+        sp.set(reviews=facts["total_reviews_all_time"])
+    tracing.count("reviews_processed", facts["total_reviews_all_time"])
+    fetch_error = fetch_meta.get("error")
+    if fetch_error:
+        # the facts describe a truncated history: say so, and only write them when asked to
+        facts["status"] = "partial"
+        facts["fetch_error"] = fetch_error
+        if not args.allow_partial:
+            print(f"[warn] Fetch incomplete ({fetch_error}); not writing {args.out_json} / {args.out_md}. "
+                  f"Rerun to resume, or pass --allow-partial to write partial output.")
+            tracing.finish_from_args(args)
+            sys.exit(1)
 
     # Log data source
     if args.from_json:
@@ -349,9 +799,26 @@ if __name__ == "__main__":
 
     # 4) LLM summary (Markdown)
     style_text = load_style(args.style_file)
-    md = make_llm_summary(args.pub_title, args.window, facts, style_text)
+    llm_cache = None if args.no_llm_cache else SummaryCache(Path(args.llm_cache))
+    if args.llm_log:
+        import llm_dispatch
+        llm_dispatch.configure(call_log=Path(args.llm_log))
+    if args.map_reduce:
+        md = make_mapreduce_summary(args.pub_title, args.window, facts, in_window, style_text,
+                                    chunk_tokens=args.chunk_tokens, parallelism=args.map_parallelism,
+                                    cache=llm_cache, force_refresh=args.refresh_summary,
+                                    facts_budget=args.facts_budget)
+    else:
+        md = make_llm_summary(args.pub_title, args.window, facts, style_text,
+                              cache=llm_cache, force_refresh=args.refresh_summary,
+                              facts_budget=args.facts_budget)
+    if llm_cache:
+        print(f"[info] Summary cache: {llm_cache.hits} hits, {llm_cache.misses} misses ({llm_cache.root})")
 
     # 5) Output
-    Path(args.out_md).write_text(md, encoding="utf-8")
-    Path(args.out_json).write_text(json.dumps(facts, indent=2, ensure_ascii=False), encoding="utf-8")
-    print(f"[done] Wrote: {args.out_md} and {args.out_json}  (reviews in window: {metrics_win['count']})")
+    with tracing.span("write_outputs"):
+        Path(args.out_md).write_text(md, encoding="utf-8")
+        Path(args.out_json).write_text(json.dumps(facts, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[done] Wrote: {args.out_md} and {args.out_json}  (reviews in window: {facts['reviews_in_window']})"
+          + (" [partial]" if fetch_error else ""))
+    tracing.finish_from_args(args)
@@ -0,0 +1,467 @@
+# portfolio.py
+from __future__ import annotations
+import csv, json, re, threading, time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import resolver
+import phase2_fetch
+import phase2b_summarize
+import llm_dispatch
+import tracing
+import transport
+from aggregates import PubAggregate
+from dates import window_arg
+from dedupe import MODES as DEDUPE_MODES, Deduper
+from export import FORMATS as EXPORT_FORMATS, Exporter
+from llm_cache import SummaryCache
+from llm_dispatch import BatchWriter
+from review_store import ReviewStore
+
+# ---------------- Models ----------------
+@dataclass
+class PubJob:
+    name: str
+    location: str
+    ll: Optional[str] = None
+    slug: str = ""
+    tags: Dict[str, str] = field(default_factory=dict)   # extra columns, e.g. region, cluster
+
+@dataclass
+class PubResult:
+    name: str
+    location: str
+    slug: str
+    status: str = "pending"          # ok | partial | unresolved | error
+    tags: Dict[str, str] = field(default_factory=dict)
+    data_id: Optional[str] = None
+    title: Optional[str] = None
+    reviews_fetched: int = 0
+    reviews_in_window: int = 0
+    fetch_meta: Dict[str, Any] = field(default_factory=dict)
+    outputs: Dict[str, str] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+# ------------- Input -------------
+def _slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", (text or "").lower()).strip("_") or "pub"
+
+_JOB_FIELDS = {"name", "location", "ll", "slug"}
+
+def load_jobs(path: Path) -> List[PubJob]:
+    """
+    Read the pub list. Accepts:
+    - CSV with a header row containing `name` and `location` (optional `ll`, `slug`)
+    - JSON list of {"name", "location", ...} objects or [name, location] pairs
+    Any other non-empty columns (e.g. `region`, `cluster`) are kept as tags for rollup.py.
+    """
+    if path.suffix.lower() == ".json":
+        rows = json.loads(path.read_text(encoding="utf-8"))
+        items = [r if isinstance(r, dict) else {"name": r[0], "location": r[1]} for r in rows]
+    else:
+        with path.open(newline="", encoding="utf-8") as f:
+            items = list(csv.DictReader(f))
+
+    jobs: List[PubJob] = []
+    seen: Dict[str, int] = {}
+    for it in items:
+        name = (it.get("name") or "").strip()
+        loc = (it.get("location") or "").strip()
+        if not name or not loc:
+            continue
+        slug = (it.get("slug") or "").strip() or _slugify(f"{name} {loc}")
+        # keep output paths unique when two rows slugify the same way
+        seen[slug] = seen.get(slug, 0) + 1
+        if seen[slug] > 1:
+            slug = f"{slug}_{seen[slug]}"
+        tags = {k: str(v).strip() for k, v in it.items()
+                if k and k not in _JOB_FIELDS and v is not None and str(v).strip()}
+        jobs.append(PubJob(name, loc, (it.get("ll") or None), slug, tags))
+    return jobs
+
+# ------------- Runner -------------
+class PortfolioRunner:
+    """
+    Runs resolve -> fetch -> summarize for many pubs at once on a thread pool.
+
+    Each upstream gets its own semaphore, so the pool can hold enough pubs in
+    flight to keep SerpAPI and OpenAI busy without exceeding either limit.
+    Stages of different pubs overlap: while one pub waits on the LLM, others
+    are resolving or paging reviews.
+    """
+
+    def __init__(self,
+                 out_dir: Path,
+                 *,
+                 cache: resolver.Cache,
+                 store: Optional[ReviewStore] = None,
+                 window: str = "last90",
+                 max_reviews: int = 500,
+                 sort_by: str = "newest",
+                 lang: str = "en",
+                 google_domain: str = "google.co.uk",
+                 style_text: Optional[str] = None,
+                 model: str = "gpt-4o-mini",
+                 serpapi_concurrency: int = 4,
+                 openai_concurrency: int = 2,
+                 summarize: bool = True,
+                 trends: bool = False,
+                 llm_cache: Optional[SummaryCache] = None,
+                 refresh_summaries: bool = False,
+                 map_reduce: bool = False,
+                 map_parallelism: int = 2,
+                 batch: Optional[BatchWriter] = None,
+                 facts_budget: Optional[int] = None,
+                 checkpoint_dir: Optional[Path] = None,
+                 deduper: Optional[Deduper] = None,
+                 aggregates: bool = False,
+                 exporter: Optional[Exporter] = None):
+        self.out_dir = out_dir
+        self.cache = cache
+        self.store = store
+        self.window = window
+        self.max_reviews = max_reviews
+        self.sort_by = sort_by
+        self.lang = lang
+        self.google_domain = google_domain
+        self.style_text = style_text
+        self.model = model
+        self.summarize = summarize
+        self.trends = trends
+        self.llm_cache = llm_cache
+        self.refresh_summaries = refresh_summaries
+        self.map_reduce = map_reduce
+        self.map_parallelism = map_parallelism
+        self.batch = batch
+        self.facts_budget = facts_budget
+        self.checkpoint_dir = checkpoint_dir
+        self.deduper = deduper
+        self.aggregates = aggregates
+        self.exporter = exporter
+        if batch is not None and (llm_cache is None or map_reduce):
+            raise RuntimeError("Batch mode needs the summary cache and does not support --map-reduce")
+        self.serpapi_concurrency = max(1, serpapi_concurrency)
+        self.openai_concurrency = max(1, openai_concurrency)
+        self._serpapi = threading.BoundedSemaphore(self.serpapi_concurrency)
+        self._openai = threading.BoundedSemaphore(self.openai_concurrency)
+
+    # -- stages --
+    def _resolve(self, job: PubJob) -> Dict[str, Any]:
+        cached = self.cache.get(job.name, job.location)
+        if cached:
+            return cached
+        try:
+            with self._serpapi:
+                payload = resolver.resolve_top_data_id(job.name, job.location, lang=self.lang,
+                                                       ll=job.ll, google_domain=self.google_domain)
+        except transport.ReplayMiss as e:
+            return {"success": False, "reason": str(e), "api_error": True}   # unresolved, not cached
+        result = resolver.compact_from_payload(payload)
+        if resolver.cacheable(result):
+            self.cache.put(job.name, job.location, result)
+        return result
+
+    def _page(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        # gate individual page calls, so token waits never hold a SerpAPI slot
+        with self._serpapi:
+            return phase2_fetch._page(*args, **kwargs)
+
+    def _fetch(self, data_id: str) -> Dict[str, Any]:
+        if self.store is not None:
+            return phase2_fetch.fetch_new_reviews(data_id, self.store, max_results=self.max_reviews,
+                                                  lang=self.lang, page_fn=self._page)
+        return phase2_fetch.fetch_all_reviews(data_id, max_results=self.max_reviews, lang=self.lang,
+                                              sort_by=self.sort_by, page_fn=self._page,
+                                              checkpoint_dir=self.checkpoint_dir)
+
+    def _summarize(self, title: str, facts: Dict[str, Any], reviews: List[Any], slug: str) -> Optional[str]:
+        if self.batch is not None:
+            # None = queued in the batch file; collecting the batch writes the pulse
+            target = {"slug": slug, "path": str((self.out_dir / f"{slug}_pulse.md").resolve()),
+                      "title": title, "window": self.window}
+            return phase2b_summarize.queue_llm_summary(title, self.window, facts, self.style_text or "",
+                                                       self.batch, model=self.model, cache=self.llm_cache,
+                                                       force_refresh=self.refresh_summaries,
+                                                       facts_budget=self.facts_budget, target=target)
+        if not self.map_reduce:
+            return self.llm_summary(title, self.window, facts, force_refresh=self.refresh_summaries)
+        with self._openai:
+            # the chunk fan-out stays inside this pub's OpenAI slot
+            return phase2b_summarize.make_mapreduce_summary(
+                title, self.window, facts, phase2b_summarize.filter_window(reviews, self.window),
+                self.style_text or "", model=self.model, parallelism=self.map_parallelism,
+                cache=self.llm_cache, force_refresh=self.refresh_summaries, facts_budget=self.facts_budget)
+
+    def llm_summary(self, title: str, window: str, facts: Dict[str, Any], *, force_refresh: bool = False) -> str:
+        """One pulse from `facts`, in one of this runner's OpenAI slots (style, model and LLM cache as configured)."""
+        with self._openai:
+            return phase2b_summarize.make_llm_summary(title, window, facts, self.style_text or "",
+                                                      model=self.model, cache=self.llm_cache,
+                                                      force_refresh=force_refresh, facts_budget=self.facts_budget)
+
+    def run_one(self, job: PubJob) -> PubResult:
+        res = PubResult(job.name, job.location, job.slug, tags=job.tags)
+        t0 = time.perf_counter()
+        try:
+            resolved = self._resolve(job)
+            res.timings["resolve_s"] = round(time.perf_counter() - t0, 3)
+            if not resolved.get("success"):
+                res.status = "unresolved"
+                res.error = resolved.get("reason")
+                return res
+            res.data_id = resolved["data_id"]
+            res.title = resolved.get("title") or job.name
+
+            t1 = time.perf_counter()
+            with tracing.span("pub.fetch", pub=job.slug):
+                raw = self._fetch(res.data_id)
+            res.timings["fetch_s"] = round(time.perf_counter() - t1, 3)
+            res.reviews_fetched = raw["count"]
+            res.fetch_meta = {k: v for k, v in raw["meta"].items() if k != "fetched_at"}
+            # pagination stopped early: what came back is not the pub's whole history
+            fetch_error = raw["meta"].get("error")
+            if fetch_error and not raw["reviews"]:
+                tracing.count("pubs", status="error")
+                res.status = "error"
+                res.error = fetch_error
+                return res
+            # with neither a store nor aggregates, facts would describe a truncated list
+            facts_ok = not fetch_error or self.aggregates or self.store is not None
+
+            t2 = time.perf_counter()
+            reviews = phase2b_summarize.normalize_reviews(raw)
+            dedupe = None
+            if self.deduper is not None:
+                reviews, dedupe = self.deduper.apply(res.data_id, reviews)
+            if self.aggregates:
+                # fold in only what changed since the last run, then read the windows off the buckets
+                agg_path = self.out_dir / f"{job.slug}_aggregates.json"
+                agg = PubAggregate.load(agg_path, res.data_id)
+                # a partial fetch only adds/updates; missing reviews are not removals
+                res.fetch_meta["aggregate_delta"] = agg.apply(reviews, complete=not fetch_error)
+                facts = agg.facts(self.window, trends=self.trends)
+                agg.save(agg_path)
+                res.outputs["aggregates"] = str(agg_path)
+            elif facts_ok:
+                facts = phase2b_summarize.build_facts(reviews, self.window, trends=self.trends)
+            if dedupe is not None:
+                res.fetch_meta["dedupe"] = dedupe.as_dict()
+            if facts_ok:
+                if dedupe is not None:
+                    facts["dedupe"] = dedupe.as_dict(top=0)
+                res.reviews_in_window = facts["reviews_in_window"]
+                facts_path = self.out_dir / f"{job.slug}_facts.json"
+                with tracing.span("write_outputs", pub=job.slug):
+                    facts_path.write_text(json.dumps(facts, indent=2, ensure_ascii=False), encoding="utf-8")
+                res.outputs["facts"] = str(facts_path)
+            if self.exporter is not None:
+                with tracing.span("pub.export", pub=job.slug):
+                    # a clean delta-store fetch holds the whole history; otherwise merge, never prune
+                    res.fetch_meta["export"] = self.exporter.export_pub(
+                        job.slug, reviews, data_id=res.data_id,
+                        complete=self.store is not None and not fetch_error)
+            res.timings["analyze_s"] = round(time.perf_counter() - t2, 3)
+
+            if self.summarize and facts_ok:
+                t3 = time.perf_counter()
+                with tracing.span("pub.summarize", pub=job.slug):
+                    md = self._summarize(res.title, facts, reviews, job.slug)
+                if md is None:
+                    res.outputs["pulse"] = "queued"
+                else:
+                    md_path = self.out_dir / f"{job.slug}_pulse.md"
+                    with tracing.span("write_outputs", pub=job.slug):
+                        md_path.write_text(md, encoding="utf-8")
+                    res.outputs["pulse"] = str(md_path)
+                res.timings["summarize_s"] = round(time.perf_counter() - t3, 3)
+
+            res.status = "partial" if fetch_error else "ok"
+            res.error = fetch_error or None
+            tracing.count("pubs", status=res.status)
+        except Exception as e:  # one bad pub must not sink the batch
+            tracing.count("pubs", status="error")
+            res.status = "error"
+            res.error = f"{type(e).__name__}: {e}"
+        finally:
+            res.timings["total_s"] = round(time.perf_counter() - t0, 3)
+        return res
+
+    def run(self, jobs: List[PubJob]) -> Dict[str, Any]:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        started = dt.datetime.utcnow().isoformat() + "Z"
+        t0 = time.perf_counter()
+        # enough threads to saturate every upstream at once
+        workers = self.serpapi_concurrency + self.openai_concurrency
+        results: List[PubResult] = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pub") as pool:
+            futures = {pool.submit(self.run_one, j): j for j in jobs}
+            for fut in as_completed(futures):
+                r = fut.result()
+                results.append(r)
+                print(f"[{r.status}] {r.name} ({r.location}) in {r.timings.get('total_s', 0)}s"
+                      + (f" — {r.error}" if r.error else ""))
+
+        order = {j.slug: i for i, j in enumerate(jobs)}
+        results.sort(key=lambda r: order.get(r.slug, 0))
+        if self.exporter is not None:
+            self.exporter.export_pubs({"pub_key": r.slug, "name": r.title or r.name, "location": r.location,
+                                       "data_id": r.data_id, "tags": r.tags} for r in results if r.data_id)
+        manifest = {
+            "started_at": started,
+            "finished_at": dt.datetime.utcnow().isoformat() + "Z",
+            "wall_clock_s": round(time.perf_counter() - t0, 3),
+            "settings": {
+                "window": self.window,
+                "max_reviews": self.max_reviews,
+                "sort_by": self.sort_by,
+                "model": self.model,
+                "summarize": self.summarize,
+                "delta": self.store is not None,
+                "trends": self.trends,
+                "map_reduce": self.map_reduce,
+                "serpapi_concurrency": self.serpapi_concurrency,
+                "openai_concurrency": self.openai_concurrency,
+                "batch": str(self.batch.path) if self.batch else None,
+                "facts_budget": self.facts_budget,
+                "aggregates": self.aggregates,
+                "checkpoint_dir": str(self.checkpoint_dir) if self.checkpoint_dir else None,
+            },
+            "counts": {s: sum(1 for r in results if r.status == s) for s in ("ok", "partial", "unresolved", "error")},
+            "transport": transport.get_transport().metrics(),
+            "serpapi_cache": (transport.get_transport().serp_cache.stats()
+                              if transport.get_transport().serp_cache else None),
+            "llm_cache": self.llm_cache.stats() if self.llm_cache else None,
+            "llm_dispatch": llm_dispatch.get_dispatcher().stats(),
+            "llm_batch_queued": len(self.batch) if self.batch else None,
+            "dedupe": self.deduper.stats() if self.deduper else None,
+            "export": self.exporter.stats() if self.exporter else None,
+            "pubs": [r.__dict__ for r in results],
+        }
+        (self.out_dir / "run_manifest.json").write_text(
+            json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+        return manifest
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Run resolve -> fetch -> summarize for a list of pubs concurrently.")
+    ap.add_argument("--pubs", required=True, help="CSV (name,location[,ll,slug]) or JSON list of pubs.")
+    ap.add_argument("--out-dir", default="portfolio_out", help="Directory for per-pub outputs + run_manifest.json.")
+    ap.add_argument("--window", type=window_arg, default="last90",
+                    help="all, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD (default: last90).")
+    ap.add_argument("--sort", choices=["newest","rating","most_relevant"], default="newest")
+    ap.add_argument("--max", type=int, default=500, help="Max reviews per pub.")
+    ap.add_argument("--lang", default="en")
+    ap.add_argument("--google-domain", default="google.co.uk")
+    ap.add_argument("--cache-path", default=str(Path(".cache") / "pubreview_resolutions.sqlite"))
+    ap.add_argument("--store", default=None,
+                    help="Review store directory; enables delta fetches (newest-first, stop at known reviews).")
+    ap.add_argument("--checkpoint-dir", default=str(Path(".cache") / "checkpoints"),
+                    help="Per-pub fetch checkpoints; a rerun after a crash resumes each pub's pagination.")
+    ap.add_argument("--no-checkpoint", action="store_true", help="Disable fetch checkpoints.")
+    ap.add_argument("--style-file", help="Path to your style file. If omitted, tries 'pubpulse_style.md'.")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--serpapi-concurrency", type=int, default=4, help="Max in-flight SerpAPI calls.")
+    ap.add_argument("--openai-concurrency", type=int, default=8,
+                    help="Pubs summarizing at once (calls are paced by the RPM/TPM limiter).")
+    ap.add_argument("--openai-rpm", type=float, default=None, help="Requests/minute budget (env PUBPULSE_OPENAI_RPM, default 500).")
+    ap.add_argument("--openai-tpm", type=float, default=None, help="Tokens/minute budget (env PUBPULSE_OPENAI_TPM, default 200000).")
+    ap.add_argument("--trends", action="store_true", help="Include trend series in each pub's facts.")
+    ap.add_argument("--llm-cache", default=str(Path(".cache") / "llm_summaries"),
+                    help="Summary cache directory; unchanged pubs skip the LLM call.")
+    ap.add_argument("--no-llm-cache", action="store_true")
+    ap.add_argument("--refresh-summaries", action="store_true", help="Bypass cached summaries (still stores new ones).")
+    ap.add_argument("--map-reduce", action="store_true", help="Summarize every windowed review via map-reduce.")
+    ap.add_argument("--map-parallelism", type=int, default=2, help="Concurrent chunk summaries per pub.")
+    ap.add_argument("--facts-budget", type=int, default=None,
+                    help="Compact each pub's facts to about this many prompt tokens before summarizing.")
+    ap.add_argument("--llm-log", default="llm_calls.jsonl",
+                    help="Per-call LLM log (tokens, latency, model), relative to --out-dir; '' to disable.")
+    ap.add_argument("--llm-batch", nargs="?", const="llm_batch_requests.jsonl", default=None,
+                    help="Write uncached summary requests to a batch JSONL in --out-dir instead of calling the API "
+                         "(default name: llm_batch_requests.jsonl); collect with llm_dispatch.py.")
+    ap.add_argument("--submit-batch", action="store_true", help="Upload and start the --llm-batch file after the run.")
+    ap.add_argument("--no-summary", action="store_true", help="Write facts only; skip the LLM step.")
+    ap.add_argument("--aggregates", action="store_true",
+                    help="Keep mergeable per-pub aggregates (<slug>_aggregates.json) and apply only changed reviews.")
+    ap.add_argument("--export", default=None,
+                    help="Power BI export root: reviews with theme flags plus daily aggregates, partitioned by "
+                         "pub and month; only changed partitions are rewritten (see export.py).")
+    ap.add_argument("--export-format", choices=EXPORT_FORMATS, default="auto",
+                    help="parquet (needs pyarrow), csv (gzipped) or auto (default).")
+    ap.add_argument("--rollup", action="store_true",
+                    help="After the run, write estate/region/cluster views to --out-dir/rollup.json (see rollup.py).")
+    ap.add_argument("--dedupe", choices=DEDUPE_MODES, default="off",
+                    help="Near-duplicate reviews across the estate: flag, or collapse same-pub copies before metrics.")
+    ap.add_argument("--dedupe-index", default=str(Path(".cache") / "dedupe.sqlite"),
+                    help="Persisted MinHash index; later runs only sign new or edited reviews.")
+    ap.add_argument("--dedupe-threshold", type=float, default=0.8, help="Estimated Jaccard for a duplicate.")
+    transport.add_cli_args(ap)
+    tracing.add_cli_args(ap)
+    args = ap.parse_args()
+    tracing.start_from_args(args)
+
+    jobs = load_jobs(Path(args.pubs))
+    if not jobs:
+        raise RuntimeError(f"No valid (name, location) rows in {args.pubs}")
+    # one keep-alive slot per in-flight call on each upstream
+    transport.configure(pool_size=max(args.serpapi_concurrency, args.openai_concurrency),
+                        **transport.cache_overrides(args))
+    if args.no_summary:
+        resolver._require_env_key()
+    else:
+        phase2b_summarize._require_keys(fetch_needed=True)
+    llm_dispatch.configure(call_log=Path(args.out_dir) / args.llm_log if args.llm_log else None,
+                           **{k: v for k, v in (("rpm", args.openai_rpm), ("tpm", args.openai_tpm)) if v})
+    batch = BatchWriter(Path(args.out_dir) / args.llm_batch) if args.llm_batch and not args.no_summary else None
+    runner = PortfolioRunner(
+        Path(args.out_dir),
+        cache=resolver.Cache(Path(args.cache_path)),
+        store=ReviewStore(Path(args.store)) if args.store else None,
+        window=args.window,
+        max_reviews=args.max,
+        sort_by=args.sort,
+        lang=args.lang,
+        google_domain=args.google_domain,
+        style_text=None if args.no_summary else phase2b_summarize.load_style(args.style_file),
+        model=args.model,
+        serpapi_concurrency=args.serpapi_concurrency,
+        openai_concurrency=args.openai_concurrency,
+        summarize=not args.no_summary,
+        trends=args.trends,
+        llm_cache=None if args.no_llm_cache else SummaryCache(Path(args.llm_cache)),
+        refresh_summaries=args.refresh_summaries,
+        map_reduce=args.map_reduce,
+        map_parallelism=args.map_parallelism,
+        batch=batch,
+        facts_budget=args.facts_budget,
+        checkpoint_dir=None if args.no_checkpoint else Path(args.checkpoint_dir),
+        deduper=(Deduper(Path(args.dedupe_index), mode=args.dedupe, threshold=args.dedupe_threshold)
+                 if args.dedupe != "off" else None),
+        aggregates=args.aggregates,
+        exporter=Exporter(Path(args.export), args.export_format) if args.export else None,
+    )
+    print(f"[info] Running {len(jobs)} pubs (serpapi={runner.serpapi_concurrency}, openai={runner.openai_concurrency})")
+    try:
+        manifest = runner.run(jobs)
+    finally:
+        if batch:
+            batch.close()
+    if batch:
+        print(f"[info] Queued {len(batch)} summaries in {batch.path}")
+        if args.submit_batch and len(batch):
+            state = llm_dispatch.submit_batch(batch.path)
+            print(f"[info] Submitted batch {state['batch_id']}; collect with: "
+                  f"python llm_dispatch.py collect {batch.path.with_suffix('.batch.json')}")
+    if args.rollup:
+        import rollup
+        doc = rollup.run(Path(args.out_dir), roster=rollup.roster_from_jobs(jobs), window=args.window)
+        print(f"[info] Rollup: {doc['estate']['pubs']} pubs, {len(doc['by'])} groupings "
+              f"({doc['stats']['reprocessed']} re-read) — {Path(args.out_dir) / 'rollup.json'}")
+    print(f"[done] {manifest['counts']} in {manifest['wall_clock_s']}s — manifest: "
+          f"{Path(args.out_dir) / 'run_manifest.json'}")
+    tracing.finish_from_args(args)
@@ -0,0 +1,120 @@
+# quotes.py
+from __future__ import annotations
+import datetime as dt
+import heapq, itertools
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from dates import date_ordinal
+from minhash import MinHasher, similarity, tokens
+
+# Score weights (sum to 1)
+W_SPECIFIC, W_LENGTH, W_THEMES, W_RECENT = 0.35, 0.25, 0.25, 0.15
+SWEET_SPOT = (80, 280)        # characters; quotes are cut at 300 in the facts
+MIN_CHARS = 25                # shorter reviews ("Great pub!") are never quoted
+RECENCY_HALF_LIFE_DAYS = 180
+NEAR_DUP = 0.6                # estimated Jaccard at or above which two quotes count as the same
+
+def _base_score(text: str, n_themes: int, age_days: Optional[int]) -> float:
+    # everything but specificity, which needs a tokenize
+    n = len(text)
+    if n < MIN_CHARS:
+        return -1.0
+    lo, hi = SWEET_SPOT
+    length = 1.0 if lo <= n <= hi else (n / lo if n < lo else max(0.0, 1 - (n - hi) / (2 * hi)))
+    themes = min(1.0, n_themes / 3)
+    recent = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS) if age_days is not None and age_days >= 0 else 0.0
+    return W_LENGTH * length + W_THEMES * themes + W_RECENT * recent
+
+def specificity(text: str) -> float:
+    """Distinct content words (4+ letters), saturating at 25."""
+    return min(1.0, len({w for w in tokens(text) if len(w) > 3}) / 25)
+
+def quote_score(text: str, n_themes: int, age_days: Optional[int]) -> float:
+    """
+    0..1 quality score for a review as a quote: specificity (distinct
+    content words), a length sweet spot, theme coverage and recency.
+    Negative when the text is too short to quote.
+    """
+    base = _base_score(text, n_themes, age_days)
+    return base if base < 0 else base + W_SPECIFIC * specificity(text)
+
+class QuoteSelector:
+    """
+    Single-pass top-k quote selection. Every review is scored once and
+    offered to bounded min-heaps (per sentiment and per theme) holding the
+    best `k * pool_factor` candidates, so memory and per-review cost stay constant.
+    select() then walks each heap best-first, skipping near-duplicates of
+    quotes already chosen (MinHash over word shingles, computed only for
+    the few candidates). Ties break on review_id, so input order never
+    changes the result. Theme quotes prefer reviews not already quoted.
+    """
+
+    def __init__(self, *, k_positive: int = 3, k_negative: int = 3, k_theme: int = 1,
+                 pool_factor: int = 4, today: Optional[dt.date] = None, hasher: Optional[MinHasher] = None):
+        self.k = {"positive": k_positive, "negative": k_negative}
+        self.k_theme = k_theme
+        self.pool_factor = pool_factor
+        self._today = (today or dt.date.today()).toordinal()
+        self._hasher = hasher
+        self._heaps: Dict[Any, List[Tuple[float, str, int, Any]]] = {}
+        self._seq = itertools.count()
+
+    def _targets(self, bucket: str, hits: FrozenSet[str]) -> List[Tuple[Any, int]]:
+        out = []
+        if self.k.get(bucket):
+            out.append((bucket, self.k[bucket] * self.pool_factor))
+        if self.k_theme:
+            out += [(("theme", t), self.k_theme * self.pool_factor) for t in hits]
+        return out
+
+    def add(self, r: Any, bucket: str, hits: FrozenSet[str] = frozenset()) -> None:
+        """Offer review `r` (sentiment `bucket`, matched themes `hits`)."""
+        targets = self._targets(bucket, hits)
+        if not targets:
+            return
+        d = date_ordinal(r.date)
+        base = _base_score(r.text, len(hits), self._today - d if d else None)
+        if base < 0:
+            return
+        heaps = [(self._heaps.setdefault(key, []), cap) for key, cap in targets]
+        if all(len(h) >= cap and base + W_SPECIFIC <= h[0][0] for h, cap in heaps):
+            return   # can't beat any pool even with full specificity: skip the tokenize
+        item = (base + W_SPECIFIC * specificity(r.text), r.review_id, next(self._seq), r)
+        for h, cap in heaps:
+            if len(h) < cap:
+                heapq.heappush(h, item)
+            elif item > h[0]:
+                heapq.heapreplace(h, item)
+
+    def _pick(self, heap: List[Tuple[float, str, int, Any]], k: int, chosen: List[Any]) -> List[Any]:
+        if self._hasher is None:
+            self._hasher = MinHasher()
+        out: List[Any] = []
+        for _, _, _, r in sorted(heap, reverse=True):
+            if len(out) >= k:
+                break
+            sig = self._hasher.signature(r.text)
+            if any(similarity(sig, s) >= NEAR_DUP for s in chosen):
+                continue
+            chosen.append(sig)
+            out.append(r)
+        return out
+
+    def select(self) -> Dict[str, Any]:
+        """{"positive": [...], "negative": [...], "themes": {theme: [...]}}, best first."""
+        chosen: List[Any] = []     # signatures of everything quoted so far
+        out: Dict[str, Any] = {b: self._pick(self._heaps.get(b, []), k, chosen) for b, k in self.k.items()}
+        out["themes"] = {}
+        for key in sorted(k for k in self._heaps if isinstance(k, tuple)):
+            # a fresh review where the pool has one; else the theme's best, even if quoted elsewhere
+            picked = self._pick(self._heaps[key], self.k_theme, chosen) or self._pick(self._heaps[key], self.k_theme, [])
+            if picked:
+                out["themes"][key[1]] = picked
+        return out
+
+def select_quotes(reviews: Iterable[Any], bucket_of: Any, themes_of: Any, **kwargs: Any) -> Dict[str, Any]:
+    """Convenience wrapper: one QuoteSelector pass over `reviews`."""
+    sel = QuoteSelector(**kwargs)
+    for r in reviews:
+        sel.add(r, bucket_of(r.rating), themes_of(r.text))
+    return sel.select()
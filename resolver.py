@@ -2,18 +2,20 @@ from __future__ import annotations
 import os
 import re
 import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from pathlib import Path
 
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    pass
-
-from serpapi import GoogleSearch
+from envfile import load_env
+from tracing import traced
+import transport
+from transport import get_transport
 
+load_env()
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY", "").strip()
 
 # -----------------------------
@@ -31,35 +33,122 @@ class PlacePick:
     position: Optional[int]
 
 # -----------------------------
-# Cache helper (JSON file)
+# Cache helper (SQLite)
 # -----------------------------
 class Cache:
-    def __init__(self, path: Path):
+    """
+    Resolution cache backed by SQLite (WAL mode): O(1) keyed lookups/inserts,
+    each put is its own atomic transaction, and SQLite's file locking makes it
+    safe for several resolver processes at once. Entries expire after `ttl_days`;
+    genuine misses (no match, failed sanity check) are stored too, with the
+    shorter `negative_ttl_days`, so they aren't retried every run. Callers
+    decide what to store via cacheable(). A small in-memory LRU sits in front.
+
+    A legacy `pubreview_resolutions.json` next to the DB is imported on first use.
+    """
+
+    def __init__(self,
+                 path: Path,
+                 *,
+                 ttl_days: Optional[float] = 90.0,
+                 negative_ttl_days: Optional[float] = 7.0,
+                 lru_size: int = 1024):
+        if path.suffix == ".json":
+            path = path.with_suffix(".sqlite")
         self.path = path
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        if self.path.exists():
-            try:
-                self._data = json.loads(self.path.read_text(encoding="utf-8"))
-            except Exception:
-                self._data = {}
-        else:
-            self._data = {}
+        self.ttl_s = ttl_days * 86400 if ttl_days else None
+        self.negative_ttl_s = negative_ttl_days * 86400 if negative_ttl_days else None
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, Tuple[Dict[str, Any], Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS resolutions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, success INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, expires_at REAL)"
+        )
+        self._import_legacy(self.path.with_suffix(".json"))
+
+    def _import_legacy(self, legacy: Path) -> None:
+        if not legacy.exists():
+            return
+        if self._db.execute("SELECT 1 FROM resolutions LIMIT 1").fetchone():
+            return
+        try:
+            data = json.loads(legacy.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO resolutions VALUES (?, ?, ?, ?, ?)",
+                [(k, json.dumps(v, ensure_ascii=False), int(bool(v.get("success"))), now,
+                  now + self.ttl_s if self.ttl_s else None) for k, v in data.items() if isinstance(v, dict)],
+            )
+            self._db.execute("COMMIT")
 
     def _key(self, pub_name: str, location: str) -> str:
         return f"{_normalize(pub_name)}|{_normalize(location)}"
 
+    def _remember(self, key: str, obj: Dict[str, Any], expires_at: Optional[float]) -> None:
+        self._lru[key] = (obj, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
     def get(self, pub_name: str, location: str) -> Optional[Dict[str, Any]]:
-        return self._data.get(self._key(pub_name, location))
+        key = self._key(pub_name, location)
+        now = time.time()
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM resolutions WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                hit = (json.loads(row[0]), row[1])
+                self._remember(key, *hit)
+            else:
+                self._lru.move_to_end(key)
+        obj, expires_at = hit
+        if expires_at is not None and expires_at <= now:
+            return None  # stale: caller re-resolves and overwrites
+        return obj
 
     def put(self, pub_name: str, location: str, obj: Dict[str, Any]) -> None:
-        self._data[self._key(pub_name, location)] = obj
-        self.path.write_text(json.dumps(self._data, indent=2, ensure_ascii=False), encoding="utf-8")
+        key = self._key(pub_name, location)
+        now = time.time()
+        ttl = self.ttl_s if obj.get("success") else self.negative_ttl_s
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(obj, ensure_ascii=False), int(bool(obj.get("success"))), now, expires_at),
+            )
+            self._remember(key, obj, expires_at)
+
+    def purge_expired(self) -> int:
+        """Delete expired rows and reclaim space. Returns rows removed."""
+        with self._lock:
+            n = self._db.execute("DELETE FROM resolutions WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                                 (time.time(),)).rowcount
+            self._lru.clear()
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return n
+
+    def close(self) -> None:
+        self._db.close()
 
 # -----------------------------
 # Utils
 # -----------------------------
 def _require_env_key() -> None:
-    if not SERPAPI_API_KEY:
+    if not SERPAPI_API_KEY and not transport.offline():
         raise RuntimeError("Missing SERPAPI_API_KEY. Put it in your environment or .env file.")
 
 def _normalize(text: str) -> str:
@@ -80,6 +169,7 @@ def _to_pick(d: Dict[str, Any]) -> PlacePick:
 # -----------------------------
 # Core logic
 # -----------------------------
+@traced("resolve")
 def resolve_top_data_id(pub_name: str,
                         location: str,
                         *,
@@ -87,7 +177,7 @@ def resolve_top_data_id(pub_name: str,
                         ll: Optional[str] = None,
                         google_domain: str = "google.co.uk") -> Dict[str, Any]:
     """
-    Resolve the top (position=1) result via SerpAPI client and return
+    Resolve the top (position=1) result via the shared SerpAPI transport and return
     a payload with success + pick + candidates + raw metadata.
     """
     _require_env_key()
@@ -110,7 +200,7 @@ def resolve_top_data_id(pub_name: str,
     if ll:
         params["ll"] = ll  # e.g. "@52.598,-2.166,14z"
 
-    payload = GoogleSearch(params).get_dict()
+    payload = get_transport().serpapi_get(params)
 
     local_results: List[Dict[str, Any]] = payload.get("local_results") or []
     place_results: Dict[str, Any] = payload.get("place_results") or {}
@@ -124,9 +214,13 @@ def resolve_top_data_id(pub_name: str,
     candidates: List[PlacePick] = [_to_pick(d) for d in rows if isinstance(d, dict)]
 
     if not candidates:
+        # SerpAPI reports "no results" as a 200 with an `error` field: only a
+        # failed request (status >= 400) is an API error rather than a miss
+        failed = transport.error_status(payload) is not None
         return {
             "success": False,
-            "reason": "No local_results/place_results returned by SerpAPI.",
+            "reason": payload.get("error") or "No local_results/place_results returned by SerpAPI.",
+            "api_error": payload.get("error") if failed else None,
             "raw_search_parameters": payload.get("search_parameters"),
             "raw_metadata": payload.get("search_metadata"),
             "candidates": [],
@@ -165,12 +259,24 @@ def resolve_top_data_id(pub_name: str,
         "candidates": [c.__dict__ for c in candidates[:5]],
     }
 
+def cacheable(result: Dict[str, Any]) -> bool:
+    """
+    Whether a compact result belongs in the Cache: hits, and misses where
+    SerpAPI answered normally (including its 200 "no results" error). A
+    failed request (quota, bad key, 429/5xx, replay miss) says nothing about
+    the pub and is retried.
+    """
+    return bool(result.get("success")) or not result.get("api_error")
+
 def compact_from_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Convert the verbose payload to a compact object for downstream steps.
     """
     if not payload.get("success"):
-        return {"success": False, "reason": payload.get("reason", "Unknown")}
+        out = {"success": False, "reason": payload.get("reason", "Unknown")}
+        if payload.get("api_error"):
+            out["api_error"] = True
+        return out
     p = payload["pick"]
     return {
         "success": True,
@@ -185,37 +291,51 @@ def compact_from_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
 # -----------------------------
 if __name__ == "__main__":
     import argparse
+    import tracing
     ap = argparse.ArgumentParser(description="Resolve SerpAPI Google Maps data_id for a pub (with cache).")
     ap.add_argument("--name", required=True, help="Pub name (e.g., 'The Two Greens')")
     ap.add_argument("--location", required=True, help="Town/area/city/borough (e.g., 'Tettenhall')")
     ap.add_argument("--lang", default="en", help="Language (default: en)")
     ap.add_argument("--ll", default=None, help="Geo-bias like '@52.598,-2.166,14z' (optional)")
     ap.add_argument("--google-domain", default="google.co.uk", help="Default: google.co.uk")
-    ap.add_argument("--cache-path", default=str(Path(".cache") / "pubreview_resolutions.json"),
-                    help="Path to JSON cache file.")
+    ap.add_argument("--cache-path", default=str(Path(".cache") / "pubreview_resolutions.sqlite"),
+                    help="Path to SQLite cache file (a legacy .json cache beside it is imported).")
+    ap.add_argument("--cache-ttl-days", type=float, default=90.0, help="Expire cached data_ids after N days.")
+    ap.add_argument("--negative-ttl-days", type=float, default=7.0,
+                    help="Remember failed lookups for N days before retrying.")
     ap.add_argument("--confirm", action="store_true", help="Print a short confirmation (title + address).")
     ap.add_argument("--debug", action="store_true", help="Print full verbose payload instead of compact output.")
+    transport.add_cli_args(ap)
+    tracing.add_cli_args(ap)
     args = ap.parse_args()
+    tracing.start_from_args(args)
+    cache_overrides = transport.cache_overrides(args)
+    if cache_overrides:
+        transport.configure(**cache_overrides)
 
-    cache = Cache(Path(args.cache_path))
+    cache = Cache(Path(args.cache_path), ttl_days=args.cache_ttl_days, negative_ttl_days=args.negative_ttl_days)
 
     # 1) Try cache first
     cached = cache.get(args.name, args.location)
+    payload = None
     if cached:
         result = cached  # already a compact object
     else:
         # 2) Resolve via SerpAPI
-        payload = resolve_top_data_id(
-            args.name,
-            args.location,
-            lang=args.lang,
-            ll=args.ll,
-            google_domain=args.google_domain,
-        )
+        try:
+            payload = resolve_top_data_id(
+                args.name,
+                args.location,
+                lang=args.lang,
+                ll=args.ll,
+                google_domain=args.google_domain,
+            )
+        except transport.ReplayMiss as e:
+            payload = {"success": False, "reason": str(e), "api_error": str(e)}
         # 3) Compact object
         result = compact_from_payload(payload)
-        # 4) Save to cache if success
-        if result.get("success"):
+        # 4) Save to cache (genuine misses too, with the shorter negative TTL; never API errors)
+        if cacheable(result):
             cache.put(args.name, args.location, result)
 
     # Optional human confirmation
@@ -224,14 +344,11 @@ if __name__ == "__main__":
 
     # Output
     if args.debug:
-        # If debug, recompute verbose payload from live (not from cache)
-        if cached:
-            # If cached, we don’t have verbose payload; print compact + note
+        if payload is None:
+            # the cache only holds the compact object; the verbose payload was never fetched
             print(json.dumps({"note": "cached_compact_only", "compact": cached}, indent=2, ensure_ascii=False))
         else:
-            # We still have the verbose payload in this code path (could be stored if desired)
-            payload = resolve_top_data_id(args.name, args.location,
-                                          lang=args.lang, ll=args.ll, google_domain=args.google_domain)
             print(json.dumps(payload, indent=2, ensure_ascii=False))
     else:
         print(json.dumps(result, indent=2, ensure_ascii=False))
+    tracing.finish_from_args(args)
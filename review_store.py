@@ -0,0 +1,97 @@
+# review_store.py
+from __future__ import annotations
+import hashlib, json, os, re
+import datetime as dt
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# -----------------------------
+# Keys
+# -----------------------------
+def review_key(r: Dict[str, Any]) -> str:
+    """
+    Stable id for a raw SerpAPI review. Falls back to a content hash when the
+    payload carries no review_id (older/odd responses).
+    """
+    rid = r.get("review_id") or r.get("id")
+    if rid:
+        return str(rid)
+    user = r.get("user") or {}
+    author = (user.get("name") if isinstance(user, dict) else None) or r.get("author") or ""
+    basis = "|".join([author, str(r.get("iso_date") or r.get("date") or ""),
+                      (r.get("snippet") or r.get("text") or "")[:200]])
+    return "h:" + hashlib.sha1(basis.encode("utf-8")).hexdigest()[:20]
+
+def edit_stamp(r: Dict[str, Any]) -> str:
+    return str(r.get("iso_date_of_last_edit") or r.get("iso_date") or "")
+
+def _safe_name(data_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", data_id)
+
+# -----------------------------
+# Store
+# -----------------------------
+class ReviewStore:
+    """
+    Persistent raw-review store: one JSON file per data_id under `root`,
+    mapping review_id -> raw SerpAPI review dict.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._loaded: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def _path(self, data_id: str) -> Path:
+        return self.root / f"{_safe_name(data_id)}.json"
+
+    def get(self, data_id: str) -> Dict[str, Dict[str, Any]]:
+        if data_id not in self._loaded:
+            p = self._path(data_id)
+            data: Dict[str, Any] = {}
+            if p.exists():
+                try:
+                    data = json.loads(p.read_text(encoding="utf-8")).get("reviews") or {}
+                except Exception:
+                    data = {}
+            self._loaded[data_id] = data
+        return self._loaded[data_id]
+
+    def known(self, data_id: str, r: Dict[str, Any]) -> Optional[str]:
+        """Return the stored edit stamp for this review, or None if unseen."""
+        prev = self.get(data_id).get(review_key(r))
+        return edit_stamp(prev) if prev is not None else None
+
+    def merge(self, data_id: str, items: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Insert new reviews and replace edited ones. Returns {"new", "updated"}."""
+        stored = self.get(data_id)
+        new = updated = 0
+        for r in items:
+            k = review_key(r)
+            prev = stored.get(k)
+            if prev is None:
+                new += 1
+            elif edit_stamp(prev) != edit_stamp(r):
+                updated += 1
+            else:
+                continue
+            stored[k] = r
+        return {"new": new, "updated": updated}
+
+    def reviews(self, data_id: str, pending: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """All stored reviews, overlaid with `pending` ones not merged in (yet), newest first."""
+        items = self.get(data_id)
+        if pending:
+            items = {**items, **{review_key(r): r for r in pending}}
+        return sorted(items.values(), key=lambda r: str(r.get("iso_date") or ""), reverse=True)
+
+    def save(self, data_id: str) -> None:
+        p = self._path(data_id)
+        body = {
+            "data_id": data_id,
+            "updated_at": dt.datetime.utcnow().isoformat() + "Z",
+            "reviews": self.get(data_id),
+        }
+        tmp = p.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(body, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, p)  # atomic swap so a crash never leaves half a store
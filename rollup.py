@@ -0,0 +1,303 @@
+# rollup.py
+from __future__ import annotations
+import datetime as dt
+import json, os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aggregates import PubAggregate, add_cell
+from dates import window_arg, window_bounds
+from phase2b_summarize import THEME_KEYWORDS
+from tracing import traced
+
+STATE_VERSION = 1
+PERCENTILES = (10, 25, 50, 75, 90)
+# percentile rank (100 = best pub in the estate) -> band
+BANDS = ((90, "top 10%"), (75, "top 25%"), (25, "middle 50%"), (10, "bottom 25%"), (0, "bottom 10%"))
+# league metrics: higher avg rating is better; lower negative share / theme pain is better
+METRICS = (("avg_rating", True), ("negative_share", False))
+
+def _empty() -> List[Any]:
+    return [0, 0.0, 0, 0, 0, {}]
+
+# ---------------- Inputs ----------------
+def _scan(in_dir: Path) -> Dict[str, Tuple[str, os.stat_result]]:
+    """slug -> (file name, stat) of its input; aggregates win over facts (any window, exact)."""
+    found: Dict[str, Tuple[str, os.stat_result]] = {}
+    with os.scandir(in_dir) as it:
+        for e in it:
+            for suffix in ("_aggregates.json", "_facts.json"):
+                if e.name.endswith(suffix) and e.is_file():
+                    slug = e.name[:-len(suffix)]
+                    if suffix == "_aggregates.json" or slug not in found:
+                        found[slug] = (e.name, e.stat())
+    return found
+
+def _from_facts(path: Path, window: str) -> Optional[List[Any]]:
+    """Window totals from a facts file, or None when it was built for another window."""
+    f = json.loads(path.read_text(encoding="utf-8"))
+    if f.get("window") != window:
+        return None
+    n = f.get("reviews_in_window") or 0
+    s = f.get("sentiment_counts_window") or {}
+    themes = {t: [c.get("positive", 0), c.get("neutral", 0), c.get("negative", 0)]
+              for t, c in (f.get("themes_window") or {}).items()}
+    # avg is rounded in the facts, so the estate average from facts files is approximate
+    return [n, (f.get("avg_rating_in_window") or 0.0) * n,
+            s.get("positive", 0), s.get("neutral", 0), s.get("negative", 0), themes]
+
+def roster_from_manifest(in_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """slug -> {"name", "location", "tags"} from a portfolio run_manifest.json, if any."""
+    try:
+        m = json.loads((in_dir / "run_manifest.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {p["slug"]: {"name": p.get("title") or p.get("name"), "location": p.get("location"),
+                        "tags": p.get("tags") or {}} for p in m.get("pubs", [])}
+
+def roster_from_jobs(jobs: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """slug -> {"name", "location", "tags"} from portfolio.PubJob rows."""
+    return {j.slug: {"name": j.name, "location": j.location, "tags": j.tags} for j in jobs}
+
+# ---------------- Stats ----------------
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile of already-sorted `values`."""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def band(pct: float) -> str:
+    for floor, label in BANDS:
+        if pct >= floor:
+            return label
+    return BANDS[-1][1]
+
+def _metrics(cell: List[Any]) -> Dict[str, Any]:
+    n = cell[0]
+    return {
+        "reviews": n,
+        "avg_rating": round(cell[1] / n, 3) if n else None,
+        "negative_share": round(cell[4] / n, 4) if n else None,
+        "sentiment": {"positive": cell[2], "neutral": cell[3], "negative": cell[4]},
+        # share of the window's reviews that are negative about the theme
+        "theme_pain": {t: round(cell[5].get(t, [0, 0, 0])[2] / n, 4) if n else None for t in THEME_KEYWORDS},
+    }
+
+def _ranked(items: List[Tuple[str, Optional[float], int]], higher_better: bool) -> List[Tuple[str, float]]:
+    """(key, value) best first; ties go to the larger sample, then the key."""
+    rows = [(k, v, n) for k, v, n in items if v is not None]
+    rows.sort(key=lambda r: ((-r[1] if higher_better else r[1]), -r[2], r[0]))
+    return [(k, v) for k, v, _ in rows]
+
+# ---------------- Rollup ----------------
+class Rollup:
+    """
+    Estate, group (region/cluster/... tags) and per-pub views over a
+    directory of per-pub outputs (`<slug>_aggregates.json`, else
+    `<slug>_facts.json` built for the same window).
+
+    Each pub's window totals are additive (counts, rating sum, sentiment and
+    per-theme sentiment), so every group is a plain sum and one pass over
+    the pubs builds all views. Totals are cached in a state file keyed by
+    each input's mtime/size; a rerun re-reads only pubs whose input changed
+    (or, for aggregates, all of them when the window's dates moved on).
+    """
+
+    def __init__(self, in_dir: Path, *, window: str = "last90", by: Iterable[str] = ("region", "cluster"),
+                 min_reviews: int = 10, top: int = 10, state_path: Optional[Path] = None,
+                 today: Optional[dt.date] = None):
+        self.in_dir = in_dir
+        self.window = window
+        self.by = list(by)
+        self.min_reviews = min_reviews
+        self.top = top
+        self.state_path = state_path or in_dir / "rollup_state.json"
+        self.bounds = window_bounds(window, today)
+        self.stats = {"pubs": 0, "reprocessed": 0, "reused": 0, "skipped_window": 0, "missing": 0}
+
+    # -- per-pub totals --
+    def _signature(self) -> Dict[str, Any]:
+        return {"v": STATE_VERSION, "window": self.window, "themes": sorted(THEME_KEYWORDS)}
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return state.get("pubs", {}) if state.get("signature") == self._signature() else {}
+
+    def _save_state(self, pubs: Dict[str, Any]) -> None:
+        tmp = self.state_path.with_suffix(self.state_path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"signature": self._signature(), "pubs": pubs},
+                                  separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    @traced("rollup.totals")
+    def totals(self, *, full: bool = False) -> Dict[str, List[Any]]:
+        """slug -> window totals, re-reading only inputs that changed since the last rollup."""
+        prev = {} if full else self._load_state()
+        bounds = list(self.bounds) if self.bounds else None
+        state: Dict[str, Any] = {}
+        out: Dict[str, List[Any]] = {}
+        for slug, (name, st) in sorted(_scan(self.in_dir).items()):
+            sig = [name, st.st_mtime_ns, st.st_size]
+            entry = prev.get(slug)
+            fresh = entry is not None and entry["sig"] == sig
+            if fresh and name.endswith("_aggregates.json") and entry.get("bounds") != bounds:
+                fresh = False   # same file, but "last90" now covers different days
+            if fresh:
+                self.stats["reused"] += 1
+            else:
+                path = self.in_dir / name
+                if name.endswith("_aggregates.json"):
+                    cell = PubAggregate.load(path, None).totals(self.bounds)
+                else:
+                    cell = _from_facts(path, self.window)
+                entry = {"sig": sig, "bounds": bounds, "totals": cell}
+                self.stats["reprocessed"] += 1
+            state[slug] = entry
+            if entry["totals"] is None:
+                self.stats["skipped_window"] += 1
+            else:
+                out[slug] = entry["totals"]
+        self._save_state(state)
+        self.stats["pubs"] = len(out)
+        return out
+
+    # -- views --
+    def _league(self, rows: Dict[str, Dict[str, Any]], metric: str, higher_better: bool,
+                theme: Optional[str] = None) -> List[Tuple[str, float]]:
+        items = [(k, (m["theme_pain"][theme] if theme else m[metric]), m["reviews"])
+                 for k, m in rows.items() if m["reviews"] >= self.min_reviews]
+        return _ranked(items, higher_better)
+
+    def _table(self, ranked: List[Tuple[str, float]], label: Any) -> Any:
+        table = [{"rank": i + 1, "key": k, "name": label(k), "value": v} for i, (k, v) in enumerate(ranked)]
+        if self.top and len(table) > 2 * self.top:
+            return {"top": table[:self.top], "bottom": table[-self.top:], "ranked": len(table)}
+        return table
+
+    def _bands(self, pub_rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        eligible = [m for m in pub_rows if m["reviews"] >= self.min_reviews]
+        out: Dict[str, Any] = {"pubs_ranked": len(eligible)}
+        for metric, _ in METRICS:
+            vals = sorted(m[metric] for m in eligible if m[metric] is not None)
+            out[metric] = {f"p{q}": (round(v, 4) if (v := percentile(vals, q)) is not None else None)
+                           for q in PERCENTILES}
+        return out
+
+    @traced("rollup.build")
+    def build(self, roster: Optional[Dict[str, Dict[str, Any]]] = None, *, full: bool = False) -> Dict[str, Any]:
+        roster = roster if roster is not None else roster_from_manifest(self.in_dir)
+        totals = self.totals(full=full)
+        self.stats["missing"] = sum(1 for s in roster if s not in totals)
+
+        def name(slug: str) -> str:
+            return (roster.get(slug) or {}).get("name") or slug
+
+        # one pass: per-pub metrics and every group's running totals
+        pubs: Dict[str, Dict[str, Any]] = {}
+        estate = _empty()
+        groups: Dict[str, Dict[str, List[Any]]] = {dim: {} for dim in self.by}
+        members: Dict[str, Dict[str, List[str]]] = {dim: {} for dim in self.by}
+        for slug, cell in totals.items():
+            tags = (roster.get(slug) or {}).get("tags") or {}
+            pubs[slug] = {"name": name(slug), "tags": tags, **_metrics(cell)}
+            add_cell(estate, cell)
+            for dim in self.by:
+                g = tags.get(dim)
+                if g:
+                    add_cell(groups[dim].setdefault(g, _empty()), cell)
+                    members[dim].setdefault(g, []).append(slug)
+
+        # estate-wide ranks and bands for each pub
+        league: Dict[str, Any] = {}
+        for metric, higher_better in METRICS:
+            ranked = self._league(pubs, metric, higher_better)
+            n = len(ranked)
+            for i, (slug, _) in enumerate(ranked):
+                pct = 100.0 * (n - 1 - i) / (n - 1) if n > 1 else 100.0
+                pubs[slug].setdefault("rank", {})[metric] = i + 1
+                pubs[slug].setdefault("band", {})[metric] = band(pct)
+            league[metric] = self._table(ranked, name)
+        league["theme_pain"] = {t: self._table(self._league(pubs, "theme_pain", False, t), name)
+                                for t in THEME_KEYWORDS}
+
+        views: Dict[str, Any] = {}
+        for dim in self.by:
+            if not groups[dim]:
+                continue
+            rows = {g: {"pubs": len(members[dim][g]), **_metrics(cell),
+                        "bands": self._bands(pubs[s] for s in members[dim][g])}
+                    for g, cell in sorted(groups[dim].items())}
+            # groups are ranked on their pooled metrics; min_reviews still applies
+            ranks = {metric: [g for g, _ in self._league(rows, metric, hb)] for metric, hb in METRICS}
+            ranks["theme_pain"] = {t: [g for g, _ in self._league(rows, "theme_pain", False, t)]
+                                   for t in THEME_KEYWORDS}
+            views[dim] = {"groups": rows, "league": ranks}
+
+        return {
+            "generated_at": dt.datetime.utcnow().isoformat() + "Z",
+            "window": self.window,
+            "min_reviews": self.min_reviews,
+            "estate": {"pubs": len(pubs), **_metrics(estate), "bands": self._bands(pubs.values())},
+            "by": views,
+            "league": league,
+            "pubs": pubs,
+            "stats": dict(self.stats),
+        }
+
+def run(in_dir: Path, out_path: Optional[Path] = None, *, roster: Optional[Dict[str, Dict[str, Any]]] = None,
+        full: bool = False, **kwargs: Any) -> Dict[str, Any]:
+    """Build the rollup for `in_dir` and write it (default `<in_dir>/rollup.json`)."""
+    doc = Rollup(in_dir, **kwargs).build(roster, full=full)
+    out_path = out_path or in_dir / "rollup.json"
+    out_path.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    return doc
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    import tracing
+    ap = argparse.ArgumentParser(description="Estate, region and cluster views over per-pub facts/aggregates.")
+    ap.add_argument("--in", dest="in_dir", default="portfolio_out",
+                    help="Directory with <slug>_aggregates.json / <slug>_facts.json (default: portfolio_out).")
+    ap.add_argument("--pubs", help="Pub list (as for portfolio.py) with grouping columns, e.g. region, cluster. "
+                                   "Default: names and tags from the directory's run_manifest.json.")
+    ap.add_argument("--window", type=window_arg, default="last90",
+                    help="all, lastN, YYYY-MM or YYYY-MM-DD..YYYY-MM-DD (default: last90). "
+                         "Facts files built for another window are skipped.")
+    ap.add_argument("--by", action="append", default=None,
+                    help="Tag to group by; repeatable (default: region and cluster).")
+    ap.add_argument("--min-reviews", type=int, default=10, help="Fewest reviews in window to be ranked (default: 10).")
+    ap.add_argument("--top", type=int, default=10,
+                    help="League tables show the top and bottom N when longer than 2N; 0 for full tables.")
+    ap.add_argument("--out", default=None, help="Output JSON (default: <in>/rollup.json).")
+    ap.add_argument("--state", default=None, help="Incremental state file (default: <in>/rollup_state.json).")
+    ap.add_argument("--full", action="store_true", help="Ignore the state file and re-read every pub.")
+    tracing.add_cli_args(ap)
+    args = ap.parse_args()
+    tracing.start_from_args(args)
+
+    in_dir = Path(args.in_dir)
+    if not in_dir.is_dir():
+        raise RuntimeError(f"No such directory: {in_dir}")
+    roster = None
+    if args.pubs:
+        from portfolio import load_jobs
+        roster = roster_from_jobs(load_jobs(Path(args.pubs)))
+    out_path = Path(args.out) if args.out else in_dir / "rollup.json"
+    doc = run(in_dir, out_path, roster=roster, full=args.full, window=args.window,
+              by=args.by or ("region", "cluster"), min_reviews=args.min_reviews, top=args.top,
+              state_path=Path(args.state) if args.state else None)
+    s = doc["stats"]
+    print(f"[info] {s['pubs']} pubs: {s['reprocessed']} re-read, {s['reused']} unchanged"
+          + (f", {s['skipped_window']} skipped (facts for another window)" if s["skipped_window"] else "")
+          + (f", {s['missing']} listed without outputs" if s["missing"] else ""))
+    e = doc["estate"]
+    print(f"[info] Estate: {e['reviews']} reviews, avg {e['avg_rating']}, negative share {e['negative_share']}")
+    print(f"[done] Wrote: {out_path}")
+    tracing.finish_from_args(args)
@@ -0,0 +1,143 @@
+# serp_cache.py
+from __future__ import annotations
+import gzip, json, os, threading, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from llm_cache import canonical_json, content_key
+
+MODES = ("passthrough", "record", "replay")
+_IGNORED_PARAMS = {"api_key", "output", "no_cache", "async"}   # don't change what SerpAPI returns
+
+class ReplayMiss(RuntimeError):
+    """A replay-mode request that was never recorded (nothing is sent to SerpAPI)."""
+
+def request_key(params: Dict[str, Any]) -> str:
+    """sha256 over the request params that shape the response (api_key excluded)."""
+    return content_key(serpapi={k: str(v) for k, v in params.items()
+                                if k not in _IGNORED_PARAMS and v is not None})
+
+class SerpCache:
+    """
+    Raw SerpAPI responses on disk, addressed by `request_key(params)`:
+    `root/<2-char shard>/<key>.json.gz`, plus an append-only `index.jsonl`
+    (key, engine, params, status, size, recorded_at) for listing and fixtures.
+
+    Modes:
+    - passthrough: no reads or writes (the default; the store is untouched)
+    - record: every call goes to the API and its response is (re)written
+    - replay: every call is served from disk; a miss raises ReplayMiss instead of calling out
+
+    Pagination replays too, since next_page_token values come from recorded pages.
+    """
+
+    def __init__(self, root: Path, mode: str = "record"):
+        if mode not in MODES:
+            raise RuntimeError(f"Unknown SerpAPI cache mode '{mode}' (use {', '.join(MODES)})")
+        self.root = root
+        self.mode = mode
+        self.hits = self.misses = self.writes = 0
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / "index.jsonl"
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json.gz"
+
+    def get(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            with gzip.open(self._path(request_key(params)), "rb") as f:
+                payload = json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return payload
+
+    def put(self, params: Dict[str, Any], payload: Dict[str, Any], *, status: int = 200) -> str:
+        key = request_key(params)
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{threading.get_ident()}.tmp")
+        # mtime=0: identical responses give identical bytes
+        tmp.write_bytes(gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), mtime=0))
+        os.replace(tmp, p)
+        entry = {"key": key, "engine": params.get("engine"),
+                 "params": {k: v for k, v in params.items() if k not in _IGNORED_PARAMS},
+                 "status": status, "bytes": p.stat().st_size, "recorded_at": time.time()}
+        with self._lock:
+            self.writes += 1
+            with self.index_path.open("a", encoding="utf-8") as f:
+                f.write(canonical_json(entry) + "\n")
+            if self._index is not None:
+                self._index[key] = entry
+        return key
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Latest index entry per key (a re-record supersedes the earlier line)."""
+        with self._lock:
+            if self._index is None:
+                self._index = {}
+                try:
+                    lines = self.index_path.read_text(encoding="utf-8").splitlines()
+                except FileNotFoundError:
+                    lines = []
+                for line in lines:
+                    try:
+                        e = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue   # torn append from a killed run
+                    if self._path(e["key"]).exists():
+                        self._index[e["key"]] = e
+            return dict(self._index)
+
+    def compact(self) -> int:
+        """Rewrite index.jsonl with one line per stored response. Returns lines dropped."""
+        entries = self.entries()
+        with self._lock:
+            try:
+                before = sum(1 for _ in self.index_path.open(encoding="utf-8"))
+            except FileNotFoundError:
+                return 0
+            tmp = self.index_path.with_suffix(".tmp")
+            tmp.write_text("".join(canonical_json(e) + "\n" for e in entries.values()), encoding="utf-8")
+            os.replace(tmp, self.index_path)
+        return before - len(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"mode": self.mode, "root": str(self.root),
+                    "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Inspect the recorded SerpAPI response store.")
+    ap.add_argument("--root", default=str(Path(".cache") / "serpapi"), help="Store directory (default: .cache/serpapi).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("ls", help="List recorded requests.")
+    ls.add_argument("--engine", default=None, help="Only this engine (google_maps, google_maps_reviews).")
+    sub.add_parser("stats", help="Entry counts and size per engine.")
+    sub.add_parser("compact", help="Drop superseded index lines.")
+    args = ap.parse_args()
+
+    store = SerpCache(Path(args.root))
+    if args.cmd == "ls":
+        for e in store.entries().values():
+            if args.engine in (None, e.get("engine")):
+                print(f"{e['key'][:12]}  {e.get('engine')}  {e.get('status')}  "
+                      f"{json.dumps(e.get('params'), ensure_ascii=False)}")
+    elif args.cmd == "stats":
+        by_engine: Dict[str, List[int]] = {}
+        for e in store.entries().values():
+            row = by_engine.setdefault(e.get("engine") or "?", [0, 0])
+            row[0] += 1
+            row[1] += e.get("bytes", 0)
+        print(json.dumps({k: {"entries": n, "bytes": b} for k, (n, b) in by_engine.items()}, indent=2))
+    else:
+        print(f"[done] Dropped {store.compact()} superseded index lines")
@@ -0,0 +1,438 @@
+# service.py
+from __future__ import annotations
+import json, re, threading, time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import phase2b_summarize
+import resolver
+import tracing
+import transport
+from aggregates import PubAggregate
+from dates import window_bounds
+from llm_cache import SummaryCache
+from portfolio import PortfolioRunner, PubJob, load_jobs
+from review_store import ReviewStore
+
+# ---------------- Coalescing ----------------
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Request coalescing: while a call for `key` is running, further calls
+    with the same key wait for it and get its result (or its exception)
+    instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _Call] = {}
+        self.executed = self.shared = 0
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> List[Any]:
+        with self._lock:
+            return list(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+# ---------------- Service ----------------
+class PubPulseService:
+    """
+    Long-running PubPulse: one process keeps everything warm between
+    requests — the resolver cache, the review store, each pub's aggregate
+    state (aggregates.PubAggregate), the compiled theme matcher, the style
+    text and the HTTP/OpenAI clients — and refreshes pubs in the background
+    through a PortfolioRunner (resolve -> delta fetch -> aggregate sync).
+
+    Facts for any window are read off the in-memory aggregates and cached
+    until the pub's next refresh; summaries go through the summary cache.
+    Identical concurrent requests (same pub, window, state) share one
+    computation. A refreshed aggregate replaces the old object whole, so
+    readers never see a half-applied delta.
+    """
+
+    def __init__(self, runner: PortfolioRunner, jobs: List[PubJob], *, refresh_every: float = 3600.0,
+                 workers: int = 4):
+        if not runner.aggregates or runner.summarize:
+            raise RuntimeError("The service runner needs aggregates=True and summarize=False")
+        self.runner = runner
+        self.jobs = {j.slug: j for j in jobs}
+        self.refresh_every = refresh_every
+        self.flight = SingleFlight()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._aggs: Dict[str, PubAggregate] = {}
+        self._state: Dict[str, Dict[str, Any]] = {s: {"status": "cold", "version": 0} for s in self.jobs}
+        # entries are valid for one aggregate version on one day (relative windows move daily)
+        self._facts: Dict[Tuple[str, str, bool], Tuple[int, dt.date, Dict[str, Any]]] = {}
+        self._summaries: Dict[Tuple[str, str], Tuple[int, dt.date, str]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="refresh")
+        self._stop = threading.Event()
+        self._scheduler: Optional[threading.Thread] = None
+
+    def _agg_path(self, slug: str) -> Path:
+        return self.runner.out_dir / f"{slug}_aggregates.json"
+
+    # -- warm-up --
+    def warm(self) -> int:
+        """Load every pub's saved aggregate; returns how many were found."""
+        n = 0
+        for slug in self.jobs:
+            p = self._agg_path(slug)
+            agg = PubAggregate.load(p, None)
+            if not agg.days:
+                continue
+            with self._lock:
+                self._aggs[slug] = agg
+                self._state[slug].update(status="ok", version=1, refreshed_at=p.stat().st_mtime,
+                                         reviews=len(agg.reviews), data_id=agg.key)
+            n += 1
+        # pay the lazy SDK/client imports now rather than on the first request
+        transport.get_transport()
+        if phase2b_summarize.OPENAI_API_KEY:
+            transport.get_transport().openai_client(phase2b_summarize.OPENAI_API_KEY)
+        return n
+
+    # -- refresh --
+    def _job(self, slug: str) -> PubJob:
+        job = self.jobs.get(slug)
+        if job is None:
+            raise KeyError(slug)
+        return job
+
+    def refresh(self, slug: str) -> Dict[str, Any]:
+        """Resolve, fetch and sync one pub now (coalesced with any refresh already running)."""
+        return self.flight.do(("refresh", slug), lambda: self._refresh(self._job(slug)))
+
+    def refresh_async(self, slug: str) -> None:
+        """Queue a refresh on the worker pool and return at once (KeyError for an unknown pub)."""
+        self._job(slug)
+        with self._lock:
+            self._state[slug]["status"] = "refreshing" if slug in self._aggs else "loading"
+        self._pool.submit(self._background, slug)
+
+    def _refresh(self, job: PubJob) -> Dict[str, Any]:
+        with self._lock:
+            self._state[job.slug]["status"] = "refreshing" if job.slug in self._aggs else "loading"
+        with tracing.span("service.refresh", pub=job.slug):
+            res = self.runner.run_one(job)
+            agg = PubAggregate.load(self._agg_path(job.slug), res.data_id) if res.status in ("ok", "partial") else None
+        with self._lock:
+            st = self._state[job.slug]
+            st.update(refreshed_at=time.time(), error=res.error, fetch=res.fetch_meta, timings=res.timings)
+            if agg is not None:
+                self._aggs[job.slug] = agg
+                st.update(status=res.status, version=st["version"] + 1, reviews=len(agg.reviews),
+                          data_id=res.data_id, title=res.title)
+            else:
+                # keep serving the last good state, if any
+                st["status"] = "stale" if job.slug in self._aggs else res.status
+            return dict(st)
+
+    def _due(self, now: float) -> List[str]:
+        with self._lock:
+            return [s for s, st in self._state.items()
+                    if st["status"] not in ("refreshing", "loading")
+                    and now - st.get("refreshed_at", 0) >= self.refresh_every]
+
+    def _schedule(self) -> None:
+        while not self._stop.is_set():
+            for slug in self._due(time.time()):
+                self.refresh_async(slug)
+            self._stop.wait(min(30.0, max(1.0, self.refresh_every / 10)))
+
+    def _background(self, slug: str) -> None:
+        try:
+            self.refresh(slug)
+        except Exception as e:  # one bad pub must not stop the scheduler
+            with self._lock:
+                self._state[slug].update(status="error", error=f"{type(e).__name__}: {e}", refreshed_at=time.time())
+
+    def start(self) -> None:
+        self._scheduler = threading.Thread(target=self._schedule, name="refresh-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # -- reads --
+    def _snapshot(self, slug: str) -> Tuple[PubAggregate, int, Dict[str, Any]]:
+        self._job(slug)
+        with self._lock:
+            agg = self._aggs.get(slug)
+            st = dict(self._state[slug])
+        if agg is None:
+            # never fetched: this request waits for (or joins) the first refresh
+            self.refresh(slug)
+            with self._lock:
+                agg = self._aggs.get(slug)
+                st = dict(self._state[slug])
+            if agg is None:
+                raise RuntimeError(f"No data for '{slug}': {st.get('error') or st['status']}")
+        return agg, st["version"], st
+
+    def facts(self, slug: str, window: str, trends: bool = False) -> Dict[str, Any]:
+        agg, version, _ = self._snapshot(slug)
+        return self._facts_at(slug, agg, version, window, trends, dt.date.today())
+
+    def _facts_at(self, slug: str, agg: PubAggregate, version: int, window: str, trends: bool,
+                  today: dt.date) -> Dict[str, Any]:
+        key = (slug, window, trends)
+        with self._lock:
+            hit = self._facts.get(key)
+        if hit is not None and hit[:2] == (version, today):
+            return hit[2]
+
+        def build() -> Dict[str, Any]:
+            facts = agg.facts(window, today=today, trends=trends)
+            with self._lock:
+                self._facts[key] = (version, today, facts)
+            return facts
+        return self.flight.do(("facts",) + key + (version, today), build)
+
+    def summary(self, slug: str, window: str) -> str:
+        if not phase2b_summarize.OPENAI_API_KEY:
+            raise RuntimeError("Missing OPENAI_API_KEY")
+        agg, version, st = self._snapshot(slug)
+        today = dt.date.today()
+        facts = self._facts_at(slug, agg, version, window, False, today)
+        key = (slug, window)
+        with self._lock:
+            hit = self._summaries.get(key)
+        if hit is not None and hit[:2] == (version, today):
+            return hit[2]
+        title = st.get("title") or self.jobs[slug].name
+
+        def build() -> str:
+            md = self.runner.llm_summary(title, window, facts)
+            with self._lock:
+                self._summaries[key] = (version, today, md)
+            return md
+        return self.flight.do(("summary",) + key + (version, today), build)
+
+    def pubs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"slug": s, "name": j.name, "location": j.location, "tags": j.tags,
+                     **{k: v for k, v in self._state[s].items() if k not in ("fetch", "timings")}}
+                    for s, j in self.jobs.items()]
+
+    def pub(self, slug: str) -> Dict[str, Any]:
+        job = self._job(slug)
+        with self._lock:
+            return {"slug": slug, "name": job.name, "location": job.location, "tags": job.tags,
+                    **self._state[slug]}
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for st in self._state.values():
+                counts[st["status"]] = counts.get(st["status"], 0) + 1
+        return {"ok": True, "uptime_s": round(time.time() - self.started, 1), "pubs": counts,
+                "refresh_every_s": self.refresh_every}
+
+    def stats(self) -> Dict[str, Any]:
+        t = transport.get_transport()
+        return {
+            "coalescing": self.flight.stats(),
+            "transport": t.metrics(),
+            "serpapi_cache": t.serp_cache.stats() if t.serp_cache else None,
+            "llm_cache": self.runner.llm_cache.stats() if self.runner.llm_cache else None,
+        }
+
+# ---------------- HTTP ----------------
+_PUB = re.compile(r"^/pubs/([^/]+)(?:/(facts|summary|refresh))?/?$")
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    GET  /health                          uptime and pub status counts
+    GET  /stats                           coalescing, transport and cache counters
+    GET  /pubs                            every pub with its refresh state
+    GET  /pubs/<slug>                     one pub's state (last fetch meta, timings)
+    GET  /pubs/<slug>/facts?window=last90&trends=1
+    GET  /pubs/<slug>/summary?window=last90[&format=json]   markdown by default
+    POST /pubs/<slug>/refresh[?wait=0]    refresh now (202 and in the background with wait=0)
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "PubPulse"
+    service: PubPulseService
+    default_window = "last90"
+    verbose = False
+
+    def _send(self, status: int, body: Any, content_type: str = "application/json") -> None:
+        data = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False, default=str)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Elapsed-Ms", f"{(time.perf_counter() - self._t0) * 1000:.1f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, method: str) -> None:
+        self._t0 = time.perf_counter()
+        url = urlparse(self.path)
+        q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        svc = self.service
+        try:
+            if method == "GET" and url.path == "/health":
+                return self._send(200, svc.health())
+            if method == "GET" and url.path == "/stats":
+                return self._send(200, svc.stats())
+            if method == "GET" and url.path.rstrip("/") == "/pubs":
+                return self._send(200, svc.pubs())
+            m = _PUB.match(url.path)
+            if not m:
+                return self._send(404, {"error": f"No route for {method} {url.path}"})
+            slug, action = m.group(1), m.group(2)
+            window = q.get("window", self.default_window)
+            window_bounds(window)   # ValueError -> 400
+            if method == "GET" and action is None:
+                return self._send(200, svc.pub(slug))
+            if method == "GET" and action == "facts":
+                return self._send(200, svc.facts(slug, window, trends=q.get("trends") in ("1", "true")))
+            if method == "GET" and action == "summary":
+                md = svc.summary(slug, window)
+                if q.get("format") == "json":
+                    return self._send(200, {"slug": slug, "window": window, "markdown": md})
+                return self._send(200, md, "text/markdown")
+            if method == "POST" and action == "refresh":
+                if q.get("wait") == "0":
+                    svc.refresh_async(slug)
+                    return self._send(202, {"slug": slug, "status": "queued"})
+                return self._send(200, svc.refresh(slug))
+            return self._send(405, {"error": f"{method} not allowed on {url.path}"})
+        except KeyError as e:
+            return self._send(404, {"error": f"Unknown pub {e}"})
+        except ValueError as e:
+            return self._send(400, {"error": str(e)})
+        except RuntimeError as e:
+            return self._send(503, {"error": str(e)})
+        except Exception as e:
+            return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self) -> None:
+        self._route("GET")
+
+    def do_POST(self) -> None:
+        self._route("POST")
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        if self.verbose:
+            super().log_message(fmt, *args)
+
+def make_server(service: PubPulseService, host: str = "127.0.0.1", port: int = 8787, *,
+                window: str = "last90", verbose: bool = False) -> ThreadingHTTPServer:
+    handler = type("PubPulseHandler", (Handler,), {"service": service, "default_window": window, "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# ------------- CLI -------------
+if __name__ == "__main__":
+    import argparse
+    from dates import window_arg
+    ap = argparse.ArgumentParser(description="Serve pub facts and summaries over local HTTP with warm caches "
+                                             "and scheduled background refreshes.")
+    ap.add_argument("--pubs", required=True, help="CSV (name,location[,ll,slug,...]) or JSON list of pubs.")
+    ap.add_argument("--out-dir", default="service_out", help="Aggregate and facts files (reloaded on restart).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--window", type=window_arg, default="last90", help="Default window for requests (default: last90).")
+    ap.add_argument("--refresh-every", type=float, default=6 * 3600.0,
+                    help="Seconds between background refreshes of each pub (default: 6h).")
+    ap.add_argument("--workers", type=int, default=4, help="Pubs refreshing at once.")
+    ap.add_argument("--no-refresh", action="store_true", help="Serve saved state only; refresh on POST .../refresh.")
+    ap.add_argument("--max", type=int, default=500, help="Max reviews per pub.")
+    ap.add_argument("--lang", default="en")
+    ap.add_argument("--cache-path", default=str(Path(".cache") / "pubreview_resolutions.sqlite"))
+    ap.add_argument("--store", default=str(Path(".cache") / "reviews"),
+                    help="Review store directory (delta fetches); '' to refetch in full each time.")
+    ap.add_argument("--style-file", help="Path to your style file. If omitted, tries 'pubpulse_style.md'.")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--serpapi-concurrency", type=int, default=4)
+    ap.add_argument("--openai-concurrency", type=int, default=4)
+    ap.add_argument("--llm-cache", default=str(Path(".cache") / "llm_summaries"))
+    ap.add_argument("--facts-budget", type=int, default=None)
+    ap.add_argument("--verbose", action="store_true", help="Log every request.")
+    transport.add_cli_args(ap)
+    tracing.add_cli_args(ap)
+    args = ap.parse_args()
+    tracing.start_from_args(args)
+
+    jobs = load_jobs(Path(args.pubs))
+    if not jobs:
+        raise RuntimeError(f"No valid (name, location) rows in {args.pubs}")
+    transport.configure(pool_size=max(args.serpapi_concurrency, args.openai_concurrency),
+                        **transport.cache_overrides(args))
+    resolver._require_env_key()
+    runner = PortfolioRunner(
+        Path(args.out_dir),
+        cache=resolver.Cache(Path(args.cache_path)),
+        store=ReviewStore(Path(args.store)) if args.store else None,
+        window=args.window,
+        max_reviews=args.max,
+        lang=args.lang,
+        style_text=phase2b_summarize.load_style(args.style_file),
+        model=args.model,
+        serpapi_concurrency=args.serpapi_concurrency,
+        openai_concurrency=args.openai_concurrency,
+        summarize=False,
+        llm_cache=SummaryCache(Path(args.llm_cache)),
+        facts_budget=args.facts_budget,
+        aggregates=True,
+    )
+    runner.out_dir.mkdir(parents=True, exist_ok=True)
+    service = PubPulseService(runner, jobs, refresh_every=args.refresh_every, workers=args.workers)
+    warm = service.warm()
+    print(f"[info] {len(jobs)} pubs, {warm} warm from {args.out_dir}")
+    if not args.no_refresh:
+        service.start()
+    server = make_server(service, args.host, args.port, window=args.window, verbose=args.verbose)
+    print(f"[info] Listening on http://{args.host}:{args.port} "
+          f"(refresh every {args.refresh_every:g}s{', disabled' if args.no_refresh else ''})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        print(f"[done] Stopped at {dt.datetime.utcnow().isoformat()}Z")
+        tracing.finish_from_args(args)
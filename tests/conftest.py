@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# the modules live flat at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,100 @@
+# tests/test_aggregates.py
+import dataclasses
+import datetime as dt
+from typing import Any, Dict, List
+
+import pytest
+
+import bench
+from aggregates import PubAggregate
+from phase2_fetch import Review, normalize_review
+from phase2b_summarize import FactsAccumulator
+
+TODAY = dt.date(2026, 10, 1)
+WINDOWS = ["last90", "all", "2026-05", "2026-01-01..2026-03-31"]
+
+@pytest.fixture(scope="module")
+def reviews() -> List[Review]:
+    return [normalize_review(r) for r in bench.synthetic_reviews(2000, seed=5, today=TODAY)]
+
+def reference(reviews: List[Review], window: str, trends: bool) -> Dict[str, Any]:
+    acc = FactsAccumulator(window, today=TODAY, trends=trends)
+    for r in reviews:
+        acc.add(r)
+    return acc.facts()
+
+def edited(reviews: List[Review]) -> List[Review]:
+    """2 removed, 5 edited (rating and text), 3 new."""
+    out = reviews[2:]
+    for i in range(5):
+        out[i] = dataclasses.replace(out[i], rating=1.0, text=out[i].text + " Edited: awful, cold food.")
+    out += [Review(f"new{i}", 2.0, "2026-09-20", "", "Slow service and cold food, waited ages for the manager",
+                   None) for i in range(3)]
+    return out
+
+@pytest.mark.parametrize("trends", [False, True])
+@pytest.mark.parametrize("window", WINDOWS)
+def test_facts_match_build_facts(reviews, window, trends):
+    agg = PubAggregate("pub")
+    agg.sync(reviews)
+    assert agg.facts(window, today=TODAY, trends=trends) == reference(reviews, window, trends)
+
+def test_incremental_sync_matches_rebuild(reviews, tmp_path):
+    path = tmp_path / "pub_aggregates.json"
+    agg = PubAggregate("pub")
+    assert agg.sync(reviews)["added"] == len(reviews)
+    agg.save(path)
+
+    after = edited(reviews)
+    loaded = PubAggregate.load(path, "pub")
+    assert loaded.sync(after) == {"added": 3, "updated": 5, "removed": 2, "unchanged": len(reviews) - 7}
+    for window in WINDOWS:
+        assert loaded.facts(window, today=TODAY, trends=True) == reference(after, window, True)
+
+    fresh = PubAggregate("pub")
+    fresh.sync(after)
+    assert loaded.days == fresh.days
+
+def test_partial_apply_never_removes(reviews):
+    agg = PubAggregate("pub")
+    agg.sync(reviews)
+    delta = agg.apply(reviews[:10])
+    assert delta == {"added": 0, "updated": 0, "removed": 0, "unchanged": 10}
+    assert len(agg.reviews) == len(reviews)
+
+def test_stream_decides_completeness_at_the_end(reviews):
+    agg = PubAggregate("pub")
+    agg.sync(reviews)
+    meta: Dict[str, Any] = {}
+
+    def stream():
+        yield from reviews[:10]
+        meta["error"] = "HTTP 503"   # set only once the stream is exhausted
+    assert agg.apply(stream(), complete=lambda: "error" not in meta)["removed"] == 0
+    assert agg.apply(iter(reviews[:10]), complete=lambda: True)["removed"] == len(reviews) - 10
+
+def test_unchanged_sync_is_a_no_op(reviews):
+    agg = PubAggregate("pub")
+    agg.sync(reviews)
+    days = {d: list(c) for d, c in agg.days.items()}
+    assert agg.sync(reviews)["unchanged"] == len(reviews)
+    assert agg.days == days
+
+def test_load_rejects_another_pub(reviews, tmp_path):
+    path = tmp_path / "a.json"
+    agg = PubAggregate("pub")
+    agg.sync(reviews[:50])
+    agg.save(path)
+    assert not PubAggregate.load(path, "other").reviews
+    anyone = PubAggregate.load(path, None)
+    assert anyone.key == "pub" and len(anyone.reviews) == 50
+
+def test_merge_adds_counts(reviews):
+    a, b, both = PubAggregate("a"), PubAggregate("b"), PubAggregate("ab")
+    a.sync(reviews[:1000])
+    b.sync(reviews[1000:])
+    a.merge(b)
+    both.sync(reviews)
+    fa, fb = a.facts("all", today=TODAY), both.facts("all", today=TODAY)
+    for k in ("reviews_in_window", "avg_rating_in_window", "sentiment_counts_window", "themes_window"):
+        assert fa[k] == fb[k]
@@ -0,0 +1,83 @@
+# tests/test_dedupe.py
+import random
+from typing import List
+
+import pytest
+
+from dedupe import MIN_WORDS, Deduper, LSHIndex
+from minhash import MinHasher, shingles, similarity
+from phase2_fetch import Review
+
+BASE = "The Sunday roast was superb, generous portions and the staff could not have been more welcoming to us"
+SPAM = "Best pub in town, amazing food and drinks, visit now and ask for the special loyalty discount code"
+
+def rv(rid: str, text: str) -> Review:
+    return Review(rid, 5.0, "2026-09-01", "", text, None)
+
+def corpus(n: int, seed: int = 3) -> List[str]:
+    rng = random.Random(seed)
+    words = ("food staff service quiz beer garden roast wait slow quick friendly cold warm lovely dirty "
+             "clean price value manager music dog family table booking chips pie").split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(10, 25))) for _ in range(n)]
+
+def test_minhash_estimates_jaccard():
+    h = MinHasher(256, seed=1)
+    a, b = BASE, BASE.replace("superb", "excellent")
+    sa, sb = shingles(a), shingles(b)
+    exact = len(sa & sb) / len(sa | sb)
+    assert abs(similarity(h.signature(a), h.signature(b)) - exact) < 0.15
+    assert h.signature(a) == MinHasher(256, seed=1).signature(a)   # stable across instances
+    assert h.signature("") is None
+
+def test_lsh_finds_near_duplicate_only():
+    h = MinHasher(64)
+    lsh = LSHIndex(64, 16)
+    for i, t in enumerate(corpus(200)):
+        lsh.add(f"k{i}", h.signature(t))
+    lsh.add("base", h.signature(BASE))
+    hits = lsh.query(h.signature(BASE + " again"), 0.7)
+    assert [k for _, k in hits] == ["base"]
+    with pytest.raises(RuntimeError):
+        LSHIndex(64, 10)
+
+def test_flag_reports_without_removing():
+    d = Deduper(None, mode="flag")
+    revs = [rv("1", SPAM), rv("2", SPAM), rv("3", SPAM + "!"), rv("4", BASE)]
+    kept, report = d.apply("pubA", revs)
+    assert kept == revs
+    assert report.duplicates == 2 and report.removed == 0
+    assert report.clusters == {"pubA|1": 2}
+
+def test_collapse_drops_same_pub_duplicates_only():
+    d = Deduper(None, mode="collapse")
+    d.apply("pubA", [rv("1", SPAM)])
+    kept, report = d.apply("pubB", [rv("1", SPAM), rv("2", SPAM), rv("3", BASE)])
+    # pubB's first copy matches pubA's (cross-pub: kept); its second matches the same cluster, also cross-pub
+    assert report.cross_pub == 2 and report.removed == 0 and len(kept) == 3
+    kept, report = d.apply("pubA", [rv("1", SPAM), rv("9", SPAM)])
+    assert report.removed == 1 and [r.review_id for r in kept] == ["1"]
+
+def test_short_reviews_are_never_flagged():
+    short = "Great pub, lovely staff"
+    assert len(short.split()) < MIN_WORDS
+    _, report = Deduper(None).apply("p", [rv(str(i), short) for i in range(5)])
+    assert report.duplicates == 0
+
+def test_unique_corpus_has_no_duplicates():
+    _, report = Deduper(None).apply("p", [rv(str(i), t) for i, t in enumerate(corpus(300))])
+    assert report.duplicates == 0
+
+def test_persisted_index_is_reused(tmp_path):
+    path = tmp_path / "dedupe.sqlite"
+    d = Deduper(path)
+    d.apply("pubA", [rv("1", SPAM), rv("2", BASE)])
+    d.close()
+    again = Deduper(path)
+    assert again.stats()["reviews"] == 2
+    _, report = again.apply("pubB", [rv("7", SPAM)])
+    assert report.clusters == {"pubA|1": 1} and report.cross_pub == 1
+    again.close()
+
+def test_unknown_mode():
+    with pytest.raises(RuntimeError):
+        Deduper(None, mode="merge")
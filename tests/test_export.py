@@ -0,0 +1,101 @@
+# tests/test_export.py
+import csv
+import dataclasses
+import datetime as dt
+import gzip
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+import bench
+from export import THEME_COLUMNS, Exporter
+from phase2_fetch import Review, normalize_review
+
+TODAY = dt.date(2026, 10, 1)
+
+@pytest.fixture(scope="module")
+def reviews() -> List[Review]:
+    return [normalize_review(r) for r in bench.synthetic_reviews(600, seed=2, today=TODAY)]
+
+def read(path: Path) -> List[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+def table(root: Path, name: str, key: str = "pubA") -> List[Dict[str, Any]]:
+    return [r for p in sorted(root.glob(f"{name}/pub={key}/month=*/part.csv.gz")) for r in read(p)]
+
+def test_partitions_and_daily_totals(tmp_path, reviews):
+    ex = Exporter(tmp_path, "csv")
+    out = ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    assert out["written"] == out["partitions"] and out["rows"] == len(reviews)
+    rows = table(tmp_path, "reviews")
+    assert len(rows) == len(reviews)
+    assert set(THEME_COLUMNS.values()) <= set(rows[0])
+    months = {p.parent.name for p in tmp_path.glob("reviews/pub=pubA/month=*/part.csv.gz")}
+    assert months == {f"month={r['month']}" for r in rows}
+    daily = table(tmp_path, "daily")
+    dated = sum(1 for r in reviews if r.date)
+    assert sum(int(r["reviews"]) for r in daily if r["date"]) == dated
+
+def test_unchanged_export_writes_nothing(tmp_path, reviews):
+    ex = Exporter(tmp_path, "csv")
+    ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    again = Exporter(tmp_path, "csv").export_pub("pubA", reviews, data_id="0x1", complete=True)
+    assert again["written"] == 0 and again["unchanged"] == again["partitions"]
+
+def test_only_changed_month_is_rewritten(tmp_path, reviews):
+    ex = Exporter(tmp_path, "csv")
+    ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    i = next(i for i, r in enumerate(reviews) if r.date)
+    edited = list(reviews)
+    edited[i] = dataclasses.replace(reviews[i], text=reviews[i].text + " edited")
+    out = ex.export_pub("pubA", edited, data_id="0x1", complete=True)
+    assert out["written"] == 1
+    last = json.loads((tmp_path / "_changes.jsonl").read_text().splitlines()[-1])
+    assert (last["op"], last["pub"], last["month"]) == ("write", "pubA", reviews[i].date[:7])
+
+def test_complete_export_removes_vanished_months(tmp_path, reviews):
+    ex = Exporter(tmp_path, "csv")
+    ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    oldest = min(r.date[:7] for r in reviews if r.date)
+    kept = [r for r in reviews if r.date[:7] != oldest]
+    out = ex.export_pub("pubA", kept, data_id="0x1", complete=True)
+    assert out["removed"] == 1
+    assert not (tmp_path / "reviews" / "pub=pubA" / f"month={oldest}").exists()
+
+def test_partial_export_keeps_older_rows(tmp_path, reviews):
+    ex = Exporter(tmp_path, "csv")
+    ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    newest = sorted((r for r in reviews if r.date), key=lambda r: r.date, reverse=True)[:5]
+    out = ex.export_pub("pubA", newest, data_id="0x1", complete=False)
+    assert out["removed"] == 0 and out["written"] == 0
+    assert len(table(tmp_path, "reviews")) == len(reviews)
+
+def test_empty_author_and_text_round_trip(tmp_path):
+    revs = [Review("a", 5.0, "2026-09-01", "", "", ""), Review("b", 1.0, "2026-09-02", "", "slow food", None),
+            Review("c", 3.0, "2026-09-03", "", "ok", "Al")]
+    for _ in range(2):
+        out = Exporter(tmp_path, "csv").export_pub("p", revs, data_id="", complete=False)
+    assert out["written"] == 0
+    # a partial merge that reads the partition back still hashes the same
+    assert Exporter(tmp_path, "csv").export_pub("p", revs[1:], data_id="", complete=False)["written"] == 0
+
+def test_pub_dimension_table(tmp_path):
+    ex = Exporter(tmp_path, "csv")
+    path = ex.export_pubs([{"pub_key": "a", "name": "A", "location": "X", "data_id": "0x1", "tags": {"region": "N"}},
+                           {"pub_key": "b", "name": "B", "location": "Y", "data_id": "0x2", "tags": {}}])
+    rows = read(path)
+    assert [r["pub_key"] for r in rows] == ["a", "b"]
+    assert rows[0]["region"] == "N" and rows[1]["region"] == ""
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(RuntimeError):
+        Exporter(tmp_path, "xlsx")
+
+def test_parquet_round_trip(tmp_path, reviews):
+    pytest.importorskip("pyarrow")
+    ex = Exporter(tmp_path, "parquet")
+    ex.export_pub("pubA", reviews, data_id="0x1", complete=True)
+    assert Exporter(tmp_path, "parquet").export_pub("pubA", reviews[:50], data_id="0x1")["written"] == 0
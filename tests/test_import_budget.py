@@ -0,0 +1,23 @@
+# tests/test_import_budget.py
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("numpy", "openai", "pyarrow", "requests", "tiktoken")
+
+@pytest.mark.parametrize("modules", [("phase2_fetch",), ("phase2b_summarize",), ("portfolio",),
+                                     ("phase2_fetch", "phase2b_summarize", "portfolio")])
+def test_entry_modules_do_not_load_sdks_at_import(modules):
+    probe = (f"import sys, json\nimport {', '.join(modules)}\n"
+             f"print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))")
+    # -X importtime: the stderr report names every module the import pulled in
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=ROOT,
+                         capture_output=True, text=True, timeout=60)
+    assert res.returncode == 0, res.stderr[-2000:]
+    assert json.loads(res.stdout.strip().splitlines()[-1]) == []
+    imported = {line.rsplit("|", 1)[-1].strip() for line in res.stderr.splitlines() if "|" in line}
+    assert not {m for m in imported if m.split(".")[0] in HEAVY}
@@ -0,0 +1,70 @@
+# tests/test_llm_cache.py
+import os
+from typing import Any, List
+
+import pytest
+
+import phase2b_summarize
+from llm_cache import SummaryCache, canonical_json, content_key
+
+FACTS = {"reviews_in_window": 12, "avg_rating_in_window": 4.1,
+         "quotes": [{"text": "b", "date": "2026-09-02"}, {"text": "a", "date": "2026-09-01"}]}
+
+def test_content_key_ignores_dict_order():
+    assert canonical_json({"b": 1, "a": [1, "é"]}) == '{"a":[1,"é"],"b":1}'
+    assert content_key(x={"a": 1, "b": 2}, y=1) == content_key(y=1, x={"b": 2, "a": 1})
+    assert content_key(x=1) != content_key(x=2)
+
+def test_get_put_and_persistence(tmp_path):
+    c = SummaryCache(tmp_path)
+    assert c.get("ab" * 32) is None
+    c.put("ab" * 32, "# Pulse")
+    assert c.get("ab" * 32) == "# Pulse"
+    assert (c.hits, c.misses, c.writes) == (1, 1, 1)
+    assert SummaryCache(tmp_path).stats()["entries"] == 1
+
+def test_evicts_least_recently_used(tmp_path):
+    c = SummaryCache(tmp_path, max_bytes=250)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    for i, k in enumerate(keys):
+        c.put(k, "x" * 100)
+        os.utime(c._path(k), (i, i))
+        c._index[k][1] = i
+    # 3 x 100 bytes > 250: the oldest entry went on the third write
+    assert c.evictions == 1 and c.get(keys[0]) is None
+    c.get(keys[1])          # now more recent than keys[2]
+    c.put("ff" * 32, "y" * 100)
+    assert c.get(keys[1]) is not None and c.get(keys[2]) is None
+    assert c.stats()["bytes"] <= 250
+
+@pytest.fixture
+def chat(monkeypatch):
+    calls: List[Any] = []
+
+    def fake_chat(messages, model, temperature, meta=None):
+        calls.append(messages)
+        return f"# Pulse {len(calls)}"
+    monkeypatch.setattr(phase2b_summarize, "_chat", fake_chat)
+    return calls
+
+def test_summary_is_served_from_cache(tmp_path, chat):
+    cache = SummaryCache(tmp_path)
+    first = phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "style", cache=cache)
+    # same facts, quotes in another order (a tie in the selector): still a hit
+    reordered = {**FACTS, "quotes": list(reversed(FACTS["quotes"]))}
+    assert phase2b_summarize.make_llm_summary("Pub", "last90", reordered, "style", cache=cache) == first
+    assert len(chat) == 1
+
+    # anything that shapes the output misses
+    phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "other style", cache=cache)
+    phase2b_summarize.make_llm_summary("Pub", "last90", {**FACTS, "reviews_in_window": 13}, "style", cache=cache)
+    phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "style", model="gpt-4o", cache=cache)
+    assert len(chat) == 4
+
+def test_force_refresh_skips_lookup_but_stores(tmp_path, chat):
+    cache = SummaryCache(tmp_path)
+    phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "style", cache=cache)
+    fresh = phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "style", cache=cache, force_refresh=True)
+    assert fresh == "# Pulse 2"
+    assert phase2b_summarize.make_llm_summary("Pub", "last90", FACTS, "style", cache=cache) == fresh
+    assert len(chat) == 2
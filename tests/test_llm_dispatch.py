@@ -0,0 +1,130 @@
+# tests/test_llm_dispatch.py
+import json
+import types
+from typing import Any, Dict, List
+
+import pytest
+
+import llm_dispatch
+from llm_cache import SummaryCache
+from llm_dispatch import BatchWriter, Dispatcher, TokenBucket, collect_batch
+
+class FakeClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+def test_token_bucket_refills_and_caps():
+    clock = FakeClock()
+    b = TokenBucket(60, capacity=5, clock=clock)       # 1 unit/s
+    assert b.take(5) == 0.0
+    assert b.take(2) == pytest.approx(2.0)             # nothing is consumed while waiting
+    clock.t = 2.0
+    assert b.take(2) == 0.0 and b.level == pytest.approx(0.0)
+    clock.t = 100.0
+    assert b.wait_time(1) == 0.0 and b.level == 5      # never above capacity
+    assert b.take(50) == 0.0                           # larger than the bucket: clamped, still fits
+
+def test_token_bucket_adjust_can_go_into_debt():
+    clock = FakeClock()
+    b = TokenBucket(60, capacity=10, clock=clock)
+    b.take(10)
+    b.adjust(-5)                                       # usage came in over the estimate
+    assert b.wait_time(1) == pytest.approx(6.0)
+    b.adjust(100)                                      # refunds stop at capacity
+    assert b.level == 10
+
+class APIError(Exception):
+    def __init__(self, status: int, headers: Dict[str, str] = None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+
+class FakeAsyncClient:
+    """chat.completions.create raises the queued errors, then answers."""
+
+    def __init__(self, errors: List[Exception]):
+        self.errors = errors
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs: Any) -> Any:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = types.SimpleNamespace(prompt_tokens=40, completion_tokens=10, total_tokens=50)
+        msg = types.SimpleNamespace(content=f"reply to {kwargs['messages'][-1]['content']}")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)], usage=usage)
+
+    async def close(self) -> None:
+        pass
+
+@pytest.fixture
+def dispatcher(monkeypatch, tmp_path):
+    made: Dict[str, Any] = {}
+
+    def make(errors: List[Exception], **kw: Any) -> Dispatcher:
+        client = FakeAsyncClient(errors)
+        monkeypatch.setattr(llm_dispatch, "get_transport",
+                            lambda: types.SimpleNamespace(openai_async_client=lambda key: client))
+        d = Dispatcher("test-key", base_delay=0.001, max_delay=0.01, call_log=tmp_path / "calls.jsonl", **kw)
+        made.update(d=d, client=client)
+        return d
+    yield make
+    if "d" in made:
+        made["d"].close()
+
+def test_dispatcher_retries_throttling_and_server_errors(dispatcher, tmp_path):
+    d = dispatcher([APIError(429, {"retry-after-ms": "5"}), APIError(503)])
+    out = d.chat([{"role": "user", "content": "hi"}], "gpt-4o-mini", 0.0, meta={"stage": "summary"})
+    assert out == "reply to hi"
+    st = d.stats()
+    assert st["retries"] == 2 and st["rate_limited"] == 1 and st["failed"] == 0
+    assert st["prompt_tokens"] == 40 and st["completion_tokens"] == 10
+    rec = json.loads((tmp_path / "calls.jsonl").read_text(encoding="utf-8"))
+    assert rec["stage"] == "summary" and rec["attempts"] == 3 and rec["total_tokens"] == 50
+
+def test_dispatcher_does_not_retry_client_errors(dispatcher):
+    d = dispatcher([APIError(400)])
+    with pytest.raises(APIError):
+        d.chat([{"role": "user", "content": "hi"}], "gpt-4o-mini", 0.0)
+    assert d.stats()["failed"] == 1 and d.stats()["retries"] == 0
+
+def test_chat_many_keeps_input_order(dispatcher):
+    d = dispatcher([], concurrency=2)
+    jobs = [([{"role": "user", "content": str(i)}], "gpt-4o-mini", 0.0) for i in range(6)]
+    assert d.chat_many(jobs) == [f"reply to {i}" for i in range(6)]
+
+def test_batch_writer_dedupes_and_keeps_every_target(tmp_path):
+    w = BatchWriter(tmp_path / "batch.jsonl")
+    msgs = [{"role": "user", "content": "facts"}]
+    w.add("k1", msgs, "gpt-4o-mini", 0.2, target={"slug": "a", "path": str(tmp_path / "a.md")})
+    w.add("k1", msgs, "gpt-4o-mini", 0.2, target={"slug": "b", "path": str(tmp_path / "b.md")})
+    w.add("k2", msgs, "gpt-4o-mini", 0.2)
+    assert not (tmp_path / "batch.jsonl").exists()     # only published on close
+    w.close()
+    rows = [json.loads(l) for l in (tmp_path / "batch.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [r["custom_id"] for r in rows] == ["k1", "k2"] and len(w) == 2
+    assert rows[0]["url"] == "/v1/chat/completions" and rows[0]["body"]["messages"] == msgs
+    targets = json.loads((tmp_path / "batch.targets.json").read_text(encoding="utf-8"))
+    assert [t["slug"] for t in targets["k1"]] == ["a", "b"]
+
+def test_collect_batch_fills_cache_and_writes_pulses(tmp_path, monkeypatch):
+    output = "\n".join(json.dumps(r) for r in [
+        {"custom_id": "k1", "response": {"body": {"choices": [{"message": {"content": "# A"}}]}}},
+        {"custom_id": "k2", "error": {"message": "bad"}},
+    ])
+    client = types.SimpleNamespace(
+        batches=types.SimpleNamespace(retrieve=lambda bid: types.SimpleNamespace(
+            status="completed", output_file_id="out", error_file_id=None)),
+        files=types.SimpleNamespace(content=lambda fid: types.SimpleNamespace(text=output)))
+    monkeypatch.setattr(llm_dispatch, "get_transport",
+                        lambda: types.SimpleNamespace(openai_client=lambda key: client))
+    cache = SummaryCache(tmp_path / "cache")
+    targets = {"k1": [{"path": str(tmp_path / "out" / "a_pulse.md")}, {"path": str(tmp_path / "b_pulse.md")}]}
+    res = collect_batch("batch_1", cache, targets=targets, api_key="test-key")
+    assert (res["stored"], res["failed"], len(res["written"])) == (1, 1, 2)
+    assert cache.get("k1") == "# A"
+    assert (tmp_path / "out" / "a_pulse.md").read_text(encoding="utf-8") == "# A"
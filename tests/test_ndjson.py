@@ -0,0 +1,65 @@
+# tests/test_ndjson.py
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from phase2_fetch import NdjsonSink, normalize_review
+from phase2b_summarize import iter_normalized, iter_raw_file
+from serp_cache import SerpCache
+
+ROOT = Path(__file__).resolve().parents[1]
+
+RAW = [
+    {"review_id": "r1", "rating": 5, "iso_date": "2026-09-01T18:00:00Z", "snippet": " Lovely pint ",
+     "user": {"name": "Sam"}},
+    {"review_id": "r2", "rating": 2, "date": "2026-08-15", "text": "Slow — very slow", "author": "Jo"},
+    {"review_id": "r3", "rating": 4, "iso_date": "2026-07-04"},
+]
+
+def test_sink_round_trips_through_the_file_reader(tmp_path):
+    reviews = [normalize_review(r) for r in RAW]
+    with NdjsonSink(tmp_path / "out" / "reviews.ndjson") as sink:
+        for r in reviews:
+            sink.write(r)
+    assert sink.count == 3
+    lines = sink.path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3 and "—" in lines[1]   # one review per line, not ASCII-escaped
+    assert list(iter_normalized(iter_raw_file(sink.path))) == reviews
+
+def test_reader_skips_blank_lines_and_reports_bad_ones(tmp_path):
+    p = tmp_path / "reviews.jsonl"
+    p.write_text(json.dumps(RAW[0]) + "\n\n" + json.dumps(RAW[1]) + "\n", encoding="utf-8")
+    assert [r["review_id"] for r in iter_raw_file(p)] == ["r1", "r2"]
+
+    p.write_text(json.dumps(RAW[0]) + "\n{torn\n", encoding="utf-8")
+    items = iter_raw_file(p)
+    assert next(items)["review_id"] == "r1"
+    with pytest.raises(RuntimeError, match="line 2"):
+        next(items)
+
+def test_reader_accepts_json_envelopes_and_lists(tmp_path):
+    (tmp_path / "env.json").write_text(json.dumps({"reviews": RAW}), encoding="utf-8")
+    (tmp_path / "list.json").write_text(json.dumps(RAW), encoding="utf-8")
+    assert list(iter_raw_file(tmp_path / "env.json")) == RAW == list(iter_raw_file(tmp_path / "list.json"))
+
+def test_cli_refuses_to_write_facts_from_a_truncated_fetch(tmp_path):
+    # one recorded page whose next page was never recorded: the replayed fetch stops early
+    cache = SerpCache(tmp_path / "serp")
+    cache.put({"engine": "google_maps_reviews", "data_id": "0x1", "hl": "en", "sort_by": "newest"},
+              {"reviews": RAW, "serpapi_pagination": {"next_page_token": "t1"}})
+    env = {**os.environ, "OPENAI_API_KEY": "test-key", "SERPAPI_API_KEY": ""}
+    proc = subprocess.run(
+        [sys.executable, str(ROOT / "phase2b_summarize.py"), "--data-id", "0x1", "--window", "all",
+         "--serpapi-cache", "replay", "--serpapi-cache-dir", str(tmp_path / "serp"), "--no-checkpoint",
+         "--out-json", str(tmp_path / "facts.json"), "--out-md", str(tmp_path / "pulse.md"),
+         "--out-ndjson", str(tmp_path / "reviews.ndjson")],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 1, proc.stdout + proc.stderr
+    assert "--allow-partial" in proc.stdout
+    assert not (tmp_path / "facts.json").exists() and not (tmp_path / "pulse.md").exists()
+    # what was fetched is still streamed out
+    assert len((tmp_path / "reviews.ndjson").read_text(encoding="utf-8").splitlines()) == 3
@@ -0,0 +1,139 @@
+# tests/test_pagination.py
+from typing import Any, Dict, List, Optional
+
+from pagination import PageCheckpoint, PageCursor, PaginationScheduler
+from transport import ReplayMiss
+
+class FakeClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+    def sleep(self, s: float) -> None:
+        self.t += s
+
+def scheduler(responses: List[Any], calls: List[Optional[str]], **kw: Any) -> PaginationScheduler:
+    """page_fn that returns (or raises) `responses` in order and logs the tokens it was called with."""
+    def page_fn(data_id: str, token: Optional[str], **_: Any) -> Dict[str, Any]:
+        calls.append(token)
+        r = responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    clock = FakeClock()
+    return PaginationScheduler(page_fn, clock=clock, sleep=clock.sleep, **kw)
+
+def page(n: int, start: int = 0, token: Optional[str] = None) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"reviews": [{"review_id": str(i)} for i in range(start, start + n)]}
+    if token:
+        out["serpapi_pagination"] = {"next_page_token": token}
+    return out
+
+def test_token_not_ready_is_retried_with_backoff():
+    calls: List[Optional[str]] = []
+    sched = scheduler([page(10, 0, "t1"), {"error": "not ready"}, {"error": "not ready"}, page(5, 10)], calls)
+    cur = sched.add(PageCursor("x"))
+    stats = sched.run()
+    assert cur.error is None
+    assert cur.count == 15 and cur.pages == 2
+    assert stats.retries == 2
+    assert calls == [None, "t1", "t1", "t1"]
+    assert stats.wait_s > 0
+
+def test_token_retries_give_up_after_max_attempts():
+    calls: List[Optional[str]] = []
+    sched = scheduler([page(10, 0, "t1")] + [{"error": "not ready"}] * 3, calls, max_attempts=3)
+    cur = sched.add(PageCursor("x"))
+    sched.run()
+    assert cur.error == "not ready"
+    assert cur.count == 10
+
+def test_max_results_and_should_stop():
+    calls: List[Optional[str]] = []
+    sched = scheduler([page(10, 0, "t1"), page(10, 10, "t2")], calls)
+    cur = sched.add(PageCursor("x", max_results=15))
+    sched.run()
+    assert cur.count == 15 and [r["review_id"] for r in cur.reviews][-1] == "14"
+
+    calls = []
+    sched = scheduler([page(10, 0, "t1"), page(10, 10, "t2")], calls)
+    cur = sched.add(PageCursor("x", should_stop=lambda reviews: True))
+    sched.run()
+    assert cur.pages == 1 and calls == [None]
+
+def test_cursors_interleave_while_one_backs_off():
+    order: List[str] = []
+    pending = {"a": [page(2, 0, "ta"), {"error": "not ready"}, page(2, 2)], "b": [page(2, 0, "tb"), page(2, 2)]}
+
+    def page_fn(data_id: str, token: Optional[str], **_: Any) -> Dict[str, Any]:
+        order.append(data_id)
+        return pending[data_id].pop(0)
+    clock = FakeClock()
+    sched = PaginationScheduler(page_fn, clock=clock, sleep=clock.sleep, token_grace=0.0)
+    a, b = sched.add(PageCursor("a")), sched.add(PageCursor("b"))
+    sched.run()
+    assert a.count == 4 and b.count == 4
+    # "b" finishes while "a" waits on its token
+    assert order == ["a", "b", "a", "b", "a"]
+
+def test_server_errors_are_transient_by_status():
+    calls: List[Optional[str]] = []
+    sched = scheduler([{"error": "Internal error", "http_status": 503}, {"error": "slow down", "http_status": 429},
+                       page(3)], calls)
+    cur = sched.add(PageCursor("x"))
+    stats = sched.run()
+    assert cur.error is None and cur.count == 3
+    assert stats.errors == 2
+
+def test_transient_errors_give_up_after_max_error_attempts():
+    calls: List[Optional[str]] = []
+    sched = scheduler([{"error": "HTTP 502", "http_status": 502}] * 3, calls, max_error_attempts=3)
+    cur = sched.add(PageCursor("x"))
+    sched.run()
+    assert cur.error == "HTTP 502"
+    assert len(calls) == 3
+
+def test_error_text_alone_does_not_make_an_error_transient():
+    # a 200 "no results" payload that happens to say "try again" is just an empty pub
+    calls: List[Optional[str]] = []
+    sched = scheduler([{"error": "No reviews yet, try again later"}], calls)
+    cur = sched.add(PageCursor("x"))
+    stats = sched.run()
+    assert cur.error is None and cur.count == 0
+    assert stats.errors == 0 and len(calls) == 1
+
+def test_first_page_http_error_is_final():
+    calls: List[Optional[str]] = []
+    sched = scheduler([{"error": "Invalid API key", "http_status": 401}], calls)
+    cur = sched.add(PageCursor("x"))
+    sched.run()
+    assert cur.error == "Invalid API key"
+    assert len(calls) == 1
+
+def test_failed_fetch_resumes_from_checkpoint(tmp_path):
+    calls: List[Optional[str]] = []
+    sched = scheduler([page(10, 0, "t1"), page(10, 10, "t2")] + [{"error": "HTTP 503", "http_status": 503}] * 2,
+                      calls, max_error_attempts=2)
+    cur = sched.add(PageCursor("x", checkpoint=PageCheckpoint(tmp_path / "x.jsonl")))
+    sched.run()
+    assert cur.error == "HTTP 503" and cur.count == 20
+
+    # the next run re-walks the saved pages and only asks SerpAPI for the rest
+    calls = []
+    sched = scheduler([page(5, 20)], calls)
+    cur = sched.add(PageCursor("x", checkpoint=PageCheckpoint(tmp_path / "x.jsonl")))
+    stats = sched.run()
+    assert cur.resumed and cur.error is None
+    assert cur.count == 25 and stats.replayed == 2
+    assert calls == ["t2"]
+    assert not (tmp_path / "x.jsonl").exists()
+
+def test_replay_miss_is_final():
+    calls: List[Optional[str]] = []
+    sched = scheduler([ReplayMiss("not recorded")], calls)
+    cur = sched.add(PageCursor("x"))
+    stats = sched.run()
+    assert cur.error == "not recorded"
+    assert len(calls) == 1 and stats.errors == 0
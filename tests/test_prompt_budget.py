@@ -0,0 +1,59 @@
+# tests/test_prompt_budget.py
+import datetime as dt
+import json
+
+import bench
+from llm_dispatch import estimate_prompt_tokens, estimate_tokens
+from phase2_fetch import normalize_review
+from phase2b_summarize import FactsAccumulator, compact_facts, summary_request
+
+TODAY = dt.date(2026, 10, 1)
+HEADLINE = ("reviews_in_window", "avg_rating_in_window", "total_reviews_all_time")
+
+def facts(n: int = 3000):
+    acc = FactsAccumulator("last180", today=TODAY, quotes_n=12, theme_quotes=3, trends=True)
+    for r in bench.synthetic_reviews(n, seed=3, today=TODAY):
+        acc.add(normalize_review(r))
+    return acc.facts()
+
+def tokens(f) -> int:
+    return estimate_tokens(json.dumps(f, ensure_ascii=False))
+
+def test_prompt_estimate_adds_message_framing():
+    msgs = [{"role": "system", "content": "abcd" * 10}, {"role": "user", "content": ""}]
+    assert estimate_prompt_tokens(msgs) == estimate_tokens("abcd" * 10) + estimate_tokens("") + 4 * 2 + 2
+
+def test_facts_within_budget_are_untouched():
+    f = facts()
+    out, report = compact_facts(f, tokens(f) + 10)
+    assert out is f and report["steps"] == [] and report["within_budget"]
+
+def test_compaction_stops_at_first_step_that_fits():
+    f = facts()
+    before = json.dumps(f, sort_keys=True)
+    out, report = compact_facts(f, tokens(f) - 1)
+    assert report["within_budget"] and report["steps"]
+    assert report["tokens_after"] == tokens(out) <= report["budget"]
+    assert json.dumps(f, sort_keys=True) == before      # the caller's facts are not mutated
+    # one token less and the same steps no longer fit
+    tighter = compact_facts(f, report["tokens_after"] - 1)[1]
+    assert tighter["steps"][:len(report["steps"])] == report["steps"]
+    assert len(tighter["steps"]) > len(report["steps"])
+
+def test_tight_budget_keeps_headline_numbers():
+    f = facts()
+    out, report = compact_facts(f, 300)
+    assert len(report["steps"]) > 3 and report["tokens_after"] < report["tokens_before"]
+    assert report["within_budget"] == (report["tokens_after"] <= 300)
+    assert "theme_quotes" not in out
+    for k in HEADLINE:
+        assert out[k] == (round(f[k], 1) if isinstance(f[k], float) else f[k])
+
+def test_summary_request_reports_prompt_parts_and_compaction():
+    f = facts()
+    key, messages, meta = summary_request("Pub", "last180", f, "style", facts_budget=400)
+    assert meta["prompt_parts"]["style"] == estimate_tokens("style")
+    assert meta["compaction"]["budget"] == 400 and meta["compaction"]["steps"]
+    assert meta["prompt_parts"]["facts"] < meta["compaction"]["tokens_before"]
+    # the budget changes what is sent, so it changes the cache key too
+    assert key != summary_request("Pub", "last180", f, "style")[0]
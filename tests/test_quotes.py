@@ -0,0 +1,83 @@
+# tests/test_quotes.py
+import datetime as dt
+import random
+from typing import List
+
+import bench
+from dates import date_ordinal
+from phase2_fetch import Review, normalize_review
+from phase2b_summarize import THEME_MATCHER, sentiment_bucket
+from quotes import MIN_CHARS, QuoteSelector, quote_score, select_quotes
+
+TODAY = dt.date(2026, 10, 1)
+WORDS = ("burger chips gravy quiz landlord garden terrace darts carvery ale cider lager sunday roast "
+         "pudding bartender karaoke booth fireplace jukebox snooker pickled onion scampi pie").split()
+
+def review(i: int, rating: float, text: str, date: str = "2026-09-01") -> Review:
+    return Review(f"r{i:03d}", rating, date, "", text, None)
+
+def distinct_reviews(n: int, seed: int = 1) -> List[Review]:
+    """Reviews with no shared vocabulary beyond a few words, so none are near-duplicates."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        words = [f"{rng.choice(WORDS)}{i}x{j}" for j in range(rng.randint(6, 40))]
+        day = (TODAY - dt.timedelta(days=rng.randint(0, 700))).isoformat()
+        out.append(review(i, rng.choice([1.0, 2.0, 4.0, 5.0]), " ".join(words), day))
+    return out
+
+def pick(reviews: List[Review], **kw) -> dict:
+    return select_quotes(reviews, sentiment_bucket, THEME_MATCHER.match, today=TODAY, **kw)
+
+def ids(rs: List[Review]) -> List[str]:
+    return [r.review_id for r in rs]
+
+def test_matches_a_full_sort():
+    reviews = distinct_reviews(400)
+    out = pick(reviews, k_positive=5, k_negative=4, k_theme=0)
+
+    def best(bucket: str, k: int) -> List[str]:
+        scored = [(quote_score(r.text, len(THEME_MATCHER.match(r.text)),
+                               TODAY.toordinal() - date_ordinal(r.date)), r.review_id)
+                  for r in reviews if sentiment_bucket(r.rating) == bucket and len(r.text) >= MIN_CHARS]
+        return [rid for _, rid in sorted(scored, reverse=True)[:k]]
+    assert ids(out["positive"]) == best("positive", 5)
+    assert ids(out["negative"]) == best("negative", 4)
+
+def test_input_order_does_not_matter():
+    reviews = [normalize_review(r) for r in bench.synthetic_reviews(1500, seed=9, today=TODAY)]
+    first = pick(reviews)
+    shuffled = reviews[:]
+    random.Random(4).shuffle(shuffled)
+    again = pick(shuffled)
+    assert ids(first["positive"]) == ids(again["positive"]) and ids(first["negative"]) == ids(again["negative"])
+    assert {t: ids(rs) for t, rs in first["themes"].items()} == {t: ids(rs) for t, rs in again["themes"].items()}
+
+def test_short_reviews_are_never_quoted():
+    out = pick([review(1, 5.0, "Great pub!"), review(2, 1.0, "Awful.")])
+    assert out["positive"] == [] and out["negative"] == []
+
+def test_near_duplicates_are_skipped():
+    text = ("The Sunday roast was stone cold and the gravy had a skin on it, we waited over an hour "
+            "and the manager never came over to apologise for any of it")
+    reviews = [review(1, 1.0, text), review(2, 1.0, text + " at all"),
+               review(3, 2.0, "Cold chips, flat lager and the quiz host ignored our table all evening long")]
+    out = pick(reviews, k_negative=2, k_theme=0)
+    assert len(out["negative"]) == 2
+    assert {"r003"} < set(ids(out["negative"])) and not {"r001", "r002"} <= set(ids(out["negative"]))
+
+def test_theme_quotes_prefer_reviews_not_already_quoted():
+    staff = [review(i, 5.0, f"The bar staff were friendly and helpful, special thanks to {name} for the "
+                            f"{dish} recommendation on a packed night")
+             for i, (name, dish) in enumerate([("Alice", "steak"), ("Bob", "lasagne"), ("Cara", "chicken")])]
+    out = pick(staff, k_positive=1, k_negative=0, k_theme=1)
+    quoted = ids(out["positive"])
+    theme = ids(out["themes"]["Staff & Service"])
+    assert len(quoted) == 1 and len(theme) == 1 and theme != quoted
+
+def test_selector_is_incremental():
+    reviews = distinct_reviews(200, seed=2)
+    sel = QuoteSelector(today=TODAY)
+    for r in reviews:
+        sel.add(r, sentiment_bucket(r.rating), THEME_MATCHER.match(r.text))
+    assert ids(sel.select()["positive"]) == ids(pick(reviews)["positive"])
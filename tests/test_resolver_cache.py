@@ -0,0 +1,95 @@
+# tests/test_resolver_cache.py
+import json
+
+import pytest
+
+import resolver
+from resolver import Cache, cacheable, compact_from_payload
+
+HIT = {"success": True, "data_id": "0x1", "place_id": "p1", "title": "The Royal Oak", "address": "High St"}
+MISS = {"success": False, "reason": "No candidates"}
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = {"t": 1_000_000.0}
+    monkeypatch.setattr(resolver.time, "time", lambda: clock["t"])
+    return clock
+
+def test_hit_round_trips_and_normalizes_key(tmp_path, now):
+    c = Cache(tmp_path / "r.sqlite")
+    c.put("The Royal  Oak", "Tettenhall", HIT)
+    assert c.get("the royal oak", " TETTENHALL ") == HIT
+    c.close()
+    # persisted: a fresh instance (empty LRU) reads it from SQLite
+    assert Cache(tmp_path / "r.sqlite").get("The Royal Oak", "Tettenhall") == HIT
+
+def test_hit_expires_after_ttl(tmp_path, now):
+    c = Cache(tmp_path / "r.sqlite", ttl_days=1, negative_ttl_days=0.5)
+    c.put("A", "B", HIT)
+    now["t"] += 86400 - 1
+    assert c.get("A", "B") == HIT
+    now["t"] += 2
+    assert c.get("A", "B") is None
+    assert Cache(tmp_path / "r.sqlite").get("A", "B") is None
+
+def test_miss_uses_shorter_negative_ttl(tmp_path, now):
+    c = Cache(tmp_path / "r.sqlite", ttl_days=1, negative_ttl_days=0.5)
+    c.put("A", "B", MISS)
+    now["t"] += 43200 - 1
+    assert c.get("A", "B") == MISS
+    now["t"] += 2
+    assert c.get("A", "B") is None
+
+def test_no_ttl_never_expires(tmp_path, now):
+    c = Cache(tmp_path / "r.sqlite", ttl_days=None, negative_ttl_days=None)
+    c.put("A", "B", HIT)
+    c.put("C", "D", MISS)
+    now["t"] += 10 * 365 * 86400
+    assert c.get("A", "B") == HIT and c.get("C", "D") == MISS
+
+def test_purge_expired(tmp_path, now):
+    c = Cache(tmp_path / "r.sqlite", ttl_days=1, negative_ttl_days=0.5)
+    c.put("A", "B", HIT)
+    c.put("C", "D", MISS)
+    now["t"] += 50000
+    assert c.purge_expired() == 1
+    assert c.get("A", "B") == HIT and c.get("C", "D") is None
+
+def test_legacy_json_is_imported(tmp_path, now):
+    (tmp_path / "r.json").write_text(json.dumps({"a|b": HIT}), encoding="utf-8")
+    c = Cache(tmp_path / "r.json")   # the .json path is moved to .sqlite
+    assert c.path.suffix == ".sqlite"
+    assert c.get("A", "B") == HIT
+
+def test_api_errors_are_not_cacheable():
+    assert cacheable(HIT)
+    assert cacheable(compact_from_payload({"success": False, "reason": "No candidates"}))
+    failed = compact_from_payload({"success": False, "reason": "quota", "api_error": "Your account has run out"})
+    assert failed["api_error"] is True
+    assert not cacheable(failed)
+
+class FakeTransport:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def serpapi_get(self, params):
+        return self.payload
+
+def resolve_compact(monkeypatch, payload):
+    monkeypatch.setattr(resolver, "SERPAPI_API_KEY", "test-key")
+    monkeypatch.setattr(resolver, "get_transport", lambda: FakeTransport(payload))
+    return compact_from_payload(resolver.resolve_top_data_id("The Royal Oak", "Tettenhall"))
+
+def test_no_results_reply_is_a_cacheable_miss(monkeypatch, tmp_path, now):
+    compact = resolve_compact(monkeypatch, {"error": "Google hasn't returned any results for this query."})
+    assert compact["success"] is False and "api_error" not in compact
+    assert cacheable(compact)
+    c = Cache(tmp_path / "r.sqlite")
+    c.put("The Royal Oak", "Tettenhall", compact)
+    assert c.get("The Royal Oak", "Tettenhall") == compact
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_failed_request_is_not_cacheable(monkeypatch, status):
+    compact = resolve_compact(monkeypatch, {"error": "try later", "http_status": status})
+    assert compact["success"] is False and compact["api_error"] is True
+    assert not cacheable(compact)
@@ -0,0 +1,103 @@
+# tests/test_review_store.py
+from typing import Any, Dict, List, Optional, Set
+
+import pytest
+
+import phase2_fetch
+from pagination import PaginationScheduler
+from review_store import ReviewStore, edit_stamp, review_key
+
+def review(i: int, edited: Optional[str] = None) -> Dict[str, Any]:
+    r = {"review_id": f"r{i}", "iso_date": f"2026-09-{i:02d}", "rating": 4, "snippet": f"visit {i}"}
+    if edited:
+        r["iso_date_of_last_edit"] = edited
+    return r
+
+class FakeClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+    def sleep(self, s: float) -> None:
+        self.t += s
+
+class PagedReviews:
+    """page_fn over `reviews` (newest first), one review per page; pages in `failing` answer 503."""
+
+    def __init__(self, reviews: List[Dict[str, Any]], failing: Set[int] = frozenset()):
+        self.reviews = reviews
+        self.failing = failing
+        self.pages: List[int] = []
+
+    def __call__(self, data_id: str, token: Optional[str], **_: Any) -> Dict[str, Any]:
+        i = int(token[1:]) if token else 0
+        self.pages.append(i)
+        if i in self.failing:
+            return {"error": "HTTP 503", "http_status": 503}
+        out: Dict[str, Any] = {"reviews": self.reviews[i:i + 1]}
+        if i + 1 < len(self.reviews):
+            out["serpapi_pagination"] = {"next_page_token": f"t{i + 1}"}
+        return out
+
+@pytest.fixture(autouse=True)
+def offline_scheduler(monkeypatch):
+    monkeypatch.setattr(phase2_fetch, "SERPAPI_API_KEY", "test-key")
+    clock = FakeClock()
+    monkeypatch.setattr(phase2_fetch, "_scheduler",
+                        lambda page_fn: PaginationScheduler(page_fn, clock=clock, sleep=clock.sleep))
+
+def newest_first(ids) -> List[Dict[str, Any]]:
+    return [review(i) for i in sorted(ids, reverse=True)]
+
+def test_review_key_falls_back_to_a_content_hash():
+    a = {"user": {"name": "Sam"}, "iso_date": "2026-09-01", "snippet": "great"}
+    assert review_key(a) == review_key(dict(a)) and review_key(a).startswith("h:")
+    assert review_key({**a, "snippet": "awful"}) != review_key(a)
+    assert review_key({"review_id": "x"}) == "x"
+
+def test_merge_counts_new_and_edited_and_persists(tmp_path):
+    store = ReviewStore(tmp_path)
+    assert store.merge("p", [review(1), review(2)]) == {"new": 2, "updated": 0}
+    assert store.merge("p", [review(2), review(1, edited="2026-09-20")]) == {"new": 0, "updated": 1}
+    store.save("p")
+    again = ReviewStore(tmp_path)
+    assert [r["review_id"] for r in again.reviews("p")] == ["r2", "r1"]
+    assert edit_stamp(again.get("p")["r1"]) == "2026-09-20"
+
+def test_delta_stops_at_known_history(tmp_path):
+    store = ReviewStore(tmp_path)
+    store.merge("p", newest_first(range(1, 6)))
+    page_fn = PagedReviews(newest_first(range(1, 9)))
+    raw = phase2_fetch.fetch_new_reviews("p", store, page_fn=page_fn)
+    assert page_fn.pages == [0, 1, 2, 3]   # r8, r7, r6, then r5 is already held
+    assert raw["meta"]["new"] == 3 and raw["count"] == 8
+    assert len(ReviewStore(tmp_path).get("p")) == 8
+
+def test_edited_review_is_refetched(tmp_path):
+    store = ReviewStore(tmp_path)
+    store.merge("p", newest_first(range(1, 4)))
+    page_fn = PagedReviews([review(3, edited="2026-09-30"), review(2), review(1)])
+    raw = phase2_fetch.fetch_new_reviews("p", store, page_fn=page_fn)
+    assert page_fn.pages == [0, 1]
+    assert raw["meta"]["updated"] == 1 and raw["meta"]["new"] == 0
+
+def test_failed_delta_does_not_advance_the_store(tmp_path):
+    store = ReviewStore(tmp_path)
+    store.merge("p", newest_first(range(1, 6)))
+    store.save("p")
+    upstream = newest_first(range(1, 12))   # r6..r11 are new
+
+    raw = phase2_fetch.fetch_new_reviews("p", ReviewStore(tmp_path), page_fn=PagedReviews(upstream, failing={4}))
+    assert raw["meta"]["error"] == "HTTP 503"
+    # what was fetched is returned, but the store still ends at r5
+    assert raw["meta"]["new"] == 4 and raw["count"] == 9
+    assert sorted(ReviewStore(tmp_path).get("p")) == [f"r{i}" for i in range(1, 6)]
+
+    # the next run walks past r11..r8 again and fills the gap down to r5
+    page_fn = PagedReviews(upstream)
+    raw = phase2_fetch.fetch_new_reviews("p", ReviewStore(tmp_path), page_fn=page_fn)
+    assert "error" not in raw["meta"] and raw["meta"]["new"] == 6
+    assert page_fn.pages == [0, 1, 2, 3, 4, 5, 6]
+    assert len(ReviewStore(tmp_path).get("p")) == 11
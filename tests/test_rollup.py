@@ -0,0 +1,102 @@
+# tests/test_rollup.py
+import datetime as dt
+import json
+import os
+import random
+from typing import List
+
+import pytest
+
+import bench
+import rollup
+from aggregates import PubAggregate
+from phase2_fetch import Review, normalize_review
+from phase2b_summarize import build_facts
+
+TODAY = dt.date(2026, 10, 1)
+
+@pytest.fixture(scope="module")
+def reviews() -> List[Review]:
+    return [normalize_review(r) for r in bench.synthetic_reviews(1500, seed=11, today=TODAY)]
+
+@pytest.fixture
+def estate(tmp_path, reviews):
+    """12 pubs in 3 regions / 2 clusters, each with a random sample of reviews."""
+    rnd = random.Random(1)
+    roster = {}
+    for i in range(12):
+        agg = PubAggregate(f"id{i}")
+        agg.sync(rnd.sample(reviews, 60 + 10 * i))
+        agg.save(tmp_path / f"p{i}_aggregates.json")
+        roster[f"p{i}"] = {"name": f"Pub {i}", "location": "Town",
+                           "tags": {"region": f"R{i % 3}", "cluster": f"C{i % 2}"}}
+    return tmp_path, roster
+
+def test_percentile_and_band():
+    assert rollup.percentile([], 50) is None
+    assert rollup.percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert rollup.percentile([5.0], 90) == 5.0
+    assert rollup.band(95) == "top 10%" and rollup.band(50) == "middle 50%" and rollup.band(0) == "bottom 10%"
+
+def test_groups_sum_to_estate(estate):
+    d, roster = estate
+    doc = rollup.run(d, roster=roster, window="all", today=TODAY)
+    pubs = doc["pubs"]
+    assert doc["estate"]["pubs"] == 12
+    assert doc["estate"]["reviews"] == sum(p["reviews"] for p in pubs.values())
+    for dim in ("region", "cluster"):
+        groups = doc["by"][dim]["groups"]
+        assert sum(g["reviews"] for g in groups.values()) == doc["estate"]["reviews"]
+        assert sum(g["pubs"] for g in groups.values()) == 12
+    assert json.loads((d / "rollup.json").read_text())["window"] == "all"
+
+def test_league_is_sorted_and_ranked(estate):
+    d, roster = estate
+    doc = rollup.run(d, roster=roster, window="all", today=TODAY, top=0)
+    table = doc["league"]["avg_rating"]
+    values = [row["value"] for row in table]
+    assert values == sorted(values, reverse=True)
+    best = table[0]["key"]
+    assert doc["pubs"][best]["rank"]["avg_rating"] == 1
+    assert doc["pubs"][best]["band"]["avg_rating"] == "top 10%"
+    neg = [row["value"] for row in doc["league"]["negative_share"]]
+    assert neg == sorted(neg)
+
+def test_pub_totals_match_facts(estate):
+    d, roster = estate
+    doc = rollup.run(d, roster=roster, window="all", today=TODAY)
+    agg = PubAggregate.load(d / "p0_aggregates.json", None)
+    facts = agg.facts("all", today=TODAY)
+    p0 = doc["pubs"]["p0"]
+    assert p0["reviews"] == facts["reviews_in_window"]
+    assert round(p0["avg_rating"], 2) == facts["avg_rating_in_window"]
+
+def test_min_reviews_excludes_small_pubs(estate):
+    d, roster = estate
+    doc = rollup.run(d, roster=roster, window="all", today=TODAY, min_reviews=100, top=0)
+    ranked = {row["key"] for row in doc["league"]["avg_rating"]}
+    assert ranked == {s for s, p in doc["pubs"].items() if p["reviews"] >= 100}
+    assert "rank" not in doc["pubs"]["p0"]
+
+def test_rerun_reuses_unchanged_inputs(estate):
+    d, roster = estate
+    first = rollup.run(d, roster=roster, window="last90", today=TODAY)
+    assert first["stats"]["reprocessed"] == 12
+    again = rollup.run(d, roster=roster, window="last90", today=TODAY)
+    assert again["stats"]["reused"] == 12 and again["stats"]["reprocessed"] == 0
+    assert again["estate"] == first["estate"]
+
+    st = (d / "p3_aggregates.json").stat()
+    os.utime(d / "p3_aggregates.json", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert rollup.run(d, roster=roster, window="last90", today=TODAY)["stats"]["reprocessed"] == 1
+    # the window moved on: every aggregate is re-read
+    moved = rollup.run(d, roster=roster, window="last90", today=TODAY + dt.timedelta(days=1))
+    assert moved["stats"]["reprocessed"] == 12
+
+def test_facts_files_for_other_windows_are_skipped(tmp_path, reviews):
+    (tmp_path / "a_facts.json").write_text(json.dumps(build_facts(reviews[:200], "all")), encoding="utf-8")
+    (tmp_path / "b_facts.json").write_text(json.dumps(build_facts(reviews[200:400], "last90")), encoding="utf-8")
+    doc = rollup.run(tmp_path, roster={}, window="all")
+    assert set(doc["pubs"]) == {"a"}
+    assert doc["stats"]["skipped_window"] == 1
+    assert doc["pubs"]["a"]["reviews"] == 200
@@ -0,0 +1,75 @@
+# tests/test_serp_cache.py
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+from serp_cache import ReplayMiss, SerpCache, request_key
+from transport import Transport, TransportConfig
+
+PARAMS = {"engine": "google_maps_reviews", "data_id": "0x1", "hl": "en", "api_key": "secret"}
+
+class FakeResponse:
+    def __init__(self, status_code: int, payload: Dict[str, Any]):
+        self.status_code = status_code
+        self._payload = payload
+        self.content = json.dumps(payload).encode("utf-8")
+
+    def json(self) -> Dict[str, Any]:
+        return dict(self._payload)
+
+class FakeSession:
+    def __init__(self, responses: List[FakeResponse]):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, url: str, **kw: Any) -> FakeResponse:
+        self.calls += 1
+        return self.responses.pop(0)
+
+    def close(self) -> None:
+        pass
+
+def transport(tmp_path, mode: str, responses: List[FakeResponse] = ()) -> Transport:
+    t = Transport(TransportConfig(serpapi_cache_mode=mode, serpapi_cache_dir=str(tmp_path)))
+    t._session = FakeSession(list(responses))
+    return t
+
+def test_request_key_ignores_api_key():
+    assert request_key(PARAMS) == request_key({**PARAMS, "api_key": "other"})
+    assert request_key(PARAMS) != request_key({**PARAMS, "hl": "fr"})
+
+def test_record_then_replay_without_network(tmp_path):
+    rec = transport(tmp_path, "record", [FakeResponse(200, {"reviews": [{"review_id": "r1"}]})])
+    assert rec.serpapi_get(PARAMS) == {"reviews": [{"review_id": "r1"}]}
+    assert rec.serp_cache.writes == 1
+
+    rep = transport(tmp_path, "replay")
+    assert rep.serpapi_get({**PARAMS, "api_key": "other"}) == {"reviews": [{"review_id": "r1"}]}
+    assert rep._session.calls == 0
+    with pytest.raises(ReplayMiss):
+        rep.serpapi_get({**PARAMS, "data_id": "0x2"})
+
+def test_throttling_and_server_errors_are_not_recorded(tmp_path):
+    rec = transport(tmp_path, "record", [FakeResponse(503, {"error": "busy"}), FakeResponse(429, {"error": "slow"}),
+                                         FakeResponse(401, {"error": "Invalid API key"})])
+    assert rec.serpapi_get(PARAMS)["http_status"] == 503
+    assert rec.serpapi_get(PARAMS)["http_status"] == 429
+    assert rec.serp_cache.writes == 0
+    assert rec.serpapi_get(PARAMS)["http_status"] == 401
+    entries = list(SerpCache(tmp_path, "replay").entries().values())
+    assert [e["status"] for e in entries] == [401]
+    assert "api_key" not in entries[0]["params"]
+
+def test_rerecord_supersedes_and_compact_drops_old_lines(tmp_path):
+    cache = SerpCache(tmp_path, "record")
+    cache.put(PARAMS, {"reviews": []})
+    cache.put(PARAMS, {"reviews": [{"review_id": "r1"}]})
+    assert cache.get(PARAMS) == {"reviews": [{"review_id": "r1"}]}
+    assert len(cache.entries()) == 1
+    assert cache.compact() == 1
+    assert len(cache.index_path.read_text(encoding="utf-8").splitlines()) == 1
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(RuntimeError):
+        SerpCache(tmp_path, "sometimes")
@@ -0,0 +1,174 @@
+# tests/test_service.py
+import datetime as dt
+import json
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List
+
+import pytest
+
+import phase2_fetch
+import phase2b_summarize
+import resolver
+import service
+from portfolio import PortfolioRunner, PubJob
+from service import PubPulseService, SingleFlight, make_server
+
+class FakeUpstream:
+    """Stands in for SerpAPI: resolves any pub, serves `n` reviews per fetch (slowly, to overlap requests)."""
+
+    def __init__(self, n: int = 40):
+        self.n = n
+        self.error = None
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str, location: str, **_: Any) -> Dict[str, Any]:
+        return {"success": True, "pick": {"data_id": "0x:" + name, "title": name, "address": location}}
+
+    def fetch(self, data_id: str, **_: Any) -> Dict[str, Any]:
+        with self._lock:
+            self.fetches += 1
+        time.sleep(0.2)
+        revs = [{"review_id": str(i), "rating": i % 5 + 1, "iso_date": f"2026-07-{i % 28 + 1:02d}",
+                 "snippet": "friendly staff, slow food"} for i in range(self.n)]
+        return {"data_id": data_id, "count": len(revs), "reviews": revs,
+                "meta": {"error": self.error} if self.error else {}}
+
+@pytest.fixture
+def upstream(monkeypatch):
+    up = FakeUpstream()
+    monkeypatch.setattr(resolver, "resolve_top_data_id", up.resolve)
+    monkeypatch.setattr(phase2_fetch, "fetch_all_reviews", up.fetch)
+    return up
+
+@pytest.fixture
+def svc(tmp_path, upstream):
+    runner = PortfolioRunner(tmp_path, cache=resolver.Cache(tmp_path / "r.sqlite"), summarize=False, aggregates=True)
+    s = PubPulseService(runner, [PubJob("Pub A", "Town", None, "a"), PubJob("Pub B", "Town", None, "b")])
+    yield s
+    s.stop()
+
+def fake_today(monkeypatch, day: dt.date) -> None:
+    class Today(dt.date):
+        @classmethod
+        def today(cls):
+            return day
+    monkeypatch.setattr(service, "dt", types.SimpleNamespace(date=Today, datetime=dt.datetime))
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls: List[int] = []
+    gate = threading.Event()
+
+    def slow() -> int:
+        calls.append(1)
+        gate.wait(1)
+        return 42
+    out: List[int] = []
+    ts = [threading.Thread(target=lambda: out.append(flight.do("k", slow))) for _ in range(6)]
+    for t in ts:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in ts:
+        t.join()
+    assert out == [42] * 6 and len(calls) == 1
+    assert flight.stats()["in_flight"] == 0
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight.do("k", lambda: 1) == 1
+
+def test_cold_requests_share_one_fetch(svc, upstream, monkeypatch):
+    fake_today(monkeypatch, dt.date(2026, 8, 1))
+    out: List[Dict[str, Any]] = []
+    ts = [threading.Thread(target=lambda: out.append(svc.facts("a", "all"))) for _ in range(8)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    assert upstream.fetches == 1
+    assert len(out) == 8 and all(f["reviews_in_window"] == 40 for f in out)
+    assert svc.pub("a")["status"] == "ok"
+
+def test_facts_are_cached_per_version_and_day(svc, upstream, monkeypatch):
+    fake_today(monkeypatch, dt.date(2026, 8, 1))
+    first = svc.facts("a", "last90")
+    assert svc.facts("a", "last90") is first
+    assert first["reviews_in_window"] == 40
+
+    fake_today(monkeypatch, dt.date(2026, 11, 15))   # July has left the last 90 days
+    assert svc.facts("a", "last90")["reviews_in_window"] == 0
+
+    upstream.n = 50
+    svc.refresh("a")
+    assert svc.facts("a", "all")["reviews_in_window"] == 50
+    assert svc.pub("a")["version"] == 2
+
+def test_partial_refresh_keeps_serving(svc, upstream):
+    svc.refresh("a")
+    upstream.error, upstream.n = "HTTP 503", 10
+    st = svc.refresh("a")
+    assert st["status"] == "partial" and st["error"] == "HTTP 503"
+    # nothing was removed from the aggregate by the partial fetch
+    assert svc.facts("a", "all")["reviews_in_window"] == 40
+
+def test_refresh_async(svc, upstream):
+    with pytest.raises(KeyError):
+        svc.refresh_async("nope")
+    svc.refresh_async("b")
+    deadline = time.time() + 5
+    while svc.pub("b")["version"] < 1 and time.time() < deadline:
+        time.sleep(0.05)
+    assert svc.pub("b")["status"] == "ok" and upstream.fetches == 1
+
+def test_summary_goes_through_the_runner_and_is_cached(svc, upstream, monkeypatch):
+    calls: List[Any] = []
+
+    def fake_summary(title, window, facts, style, **kw):
+        calls.append((title, window, facts["reviews_in_window"], kw["force_refresh"]))
+        return f"# {title}"
+    monkeypatch.setattr(phase2b_summarize, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(phase2b_summarize, "make_llm_summary", fake_summary)
+    assert svc.summary("a", "all") == "# Pub A"
+    assert svc.summary("a", "all") == "# Pub A"
+    assert calls == [("Pub A", "all", 40, False)]
+
+def test_warm_reloads_saved_aggregates(svc, tmp_path, upstream):
+    svc.refresh("a")
+    again = PubPulseService(svc.runner, list(svc.jobs.values()))
+    assert again.warm() == 1
+    assert again.facts("a", "all")["reviews_in_window"] == 40
+    assert upstream.fetches == 1
+    again.stop()
+
+def test_http_routes(svc, upstream):
+    server = make_server(svc, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def call(path: str, method: str = "GET"):
+        req = urllib.request.Request(base + path, method=method)
+        try:
+            with urllib.request.urlopen(req) as resp:
+                return resp.status, json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+    try:
+        assert call("/health")[0] == 200
+        status, facts = call("/pubs/a/facts?window=all")
+        assert status == 200 and facts["reviews_in_window"] == 40
+        assert call("/pubs/a/facts?window=yesterday")[0] == 400
+        assert call("/pubs/zzz")[0] == 404
+        assert call("/pubs/b/refresh?wait=0", "POST") == (202, {"slug": "b", "status": "queued"})
+        assert call("/pubs/a/facts", "POST")[0] == 405
+        assert call("/nowhere")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,58 @@
+# tests/test_theme_matcher.py
+import random
+import re
+from typing import Dict, FrozenSet, List
+
+from phase2b_summarize import THEME_KEYWORDS, THEME_MATCHER
+from theme_matcher import ThemeMatcher
+
+def naive(themes: Dict[str, List[str]], text: str, whole_words: bool = False) -> FrozenSet[str]:
+    """Reference: one regex per keyword, anchored at a word start (and end with whole_words)."""
+    low = text.lower()
+    tail = r"(?!\w)" if whole_words else ""
+    return frozenset(t for t, words in themes.items()
+                     if any(re.search(rf"(?<!\w){re.escape(w.lower())}{tail}", low) for w in words))
+
+SAMPLES = [
+    "The bar staff scolded us, food was Cold; portions small, 2-for-1 deal, Quiz events!",
+    "she scolded the team",
+    "Friendly FOH, cosy vibe, kids welcome",
+    "Waited ages. Slowest service ever; microwave meal.",
+    "karaoke host was great, live music on Friday",
+    "",
+    "nothing to see here",
+    "the manager's menu (steak) was expensive-ish",
+]
+
+def test_matches_naive_on_samples():
+    for text in SAMPLES:
+        assert THEME_MATCHER.match(text) == naive(THEME_KEYWORDS, text), text
+
+def test_word_start_only():
+    assert THEME_MATCHER.match("she scolded") == frozenset()
+    assert THEME_MATCHER.match("it was cold") == {"Food Quality / Execution"}
+    # keywords may run on into a longer word
+    assert THEME_MATCHER.match("big portions") == {"Food Quality / Execution"}
+
+def test_nested_keywords_are_all_credited():
+    themes = {"A": ["bar"], "B": ["bar staff"], "C": ["staff"], "D": ["staff room"]}
+    m = ThemeMatcher(themes, whole_words=True)
+    assert m.match("the bar staff room") == {"A", "B", "C", "D"}
+    assert m.match("barstaff") == frozenset()
+    assert m.match("bars") == frozenset()
+    assert ThemeMatcher(themes).match("bars") == {"A"}
+
+def test_matches_naive_on_random_text():
+    rng = random.Random(7)
+    vocab = [w for ws in THEME_KEYWORDS.values() for w in ws] + ["scold", "xcold", "the", "was", "un-friendly"]
+    seps = [" ", ", ", "-", ". ", "", "'"]
+    matchers = {False: THEME_MATCHER, True: ThemeMatcher(THEME_KEYWORDS, whole_words=True)}
+    for _ in range(500):
+        text = "".join(rng.choice(vocab) + rng.choice(seps) for _ in range(rng.randint(1, 12)))
+        if rng.random() < 0.5:
+            text = text.upper()
+        for whole, m in matchers.items():
+            assert m.match(text) == naive(THEME_KEYWORDS, text, whole), (whole, text)
+
+def test_empty_keyword_set():
+    assert ThemeMatcher({"A": ["", "  "]}).match("anything") == frozenset()
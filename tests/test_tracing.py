@@ -0,0 +1,67 @@
+# tests/test_tracing.py
+import json
+import types
+
+import pytest
+
+import tracing
+
+@pytest.fixture
+def traced_run():
+    tracing.enable()
+    yield
+    tracing.disable()
+    tracing._state = tracing._State()
+
+def test_disabled_spans_and_counters_record_nothing():
+    assert not tracing.enabled()
+    with tracing.span("x", a=1) as sp:
+        sp.set(b=2)
+    tracing.count("c")
+    assert tracing.span("x") is tracing._NULL
+    assert tracing.summary() == []
+
+def test_spans_feed_events_histograms_and_attrs(traced_run, tmp_path):
+    @tracing.traced("work")
+    def work(n):
+        return n * 2
+    assert work(2) == 4 and work(3) == 6
+    with tracing.span("stage", pub="a") as sp:
+        sp.set(reviews=10)
+    with pytest.raises(ValueError):
+        with tracing.span("boom"):
+            raise ValueError("x")
+
+    assert {n: c for n, c, _ in tracing.summary()} == {"work": 2, "stage": 1, "boom": 1}
+    tracing.export_json(tmp_path / "trace.json")
+    doc = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))
+    events = {e["name"]: e for e in doc["traceEvents"]}
+    assert events["stage"]["args"] == {"pub": "a", "reviews": 10} and events["stage"]["ph"] == "X"
+    assert events["boom"]["args"] == {"error": "ValueError"}
+    assert doc["otherData"]["spans"]["work"]["count"] == 2
+
+def test_prometheus_export(traced_run, tmp_path):
+    with tracing.span("serpapi.page"):
+        pass
+    tracing.count("http_requests", host="serpapi.com", status=200)
+    tracing.count("http_requests", host="serpapi.com", status=200)
+    tracing.count("http_requests", host="serpapi.com", status="error")
+    tracing.export_prometheus(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert 'pubpulse_span_seconds_count{span="serpapi.page"} 1' in text
+    assert 'pubpulse_span_seconds_bucket{span="serpapi.page",le="+Inf"} 1' in text
+    assert 'pubpulse_http_requests_total{host="serpapi.com",status="200"} 2' in text
+    assert 'pubpulse_http_requests_total{host="serpapi.com",status="error"} 1' in text
+
+def test_cli_flags_start_and_finish(tmp_path, capsys):
+    args = types.SimpleNamespace(trace=str(tmp_path / "t.json"), metrics=None, profile=None, profile_out=None)
+    tracing.start_from_args(args)
+    try:
+        with tracing.span("load"):
+            pass
+        tracing.finish_from_args(args)
+    finally:
+        tracing._state = tracing._State()
+    assert (tmp_path / "t.json").exists()
+    assert "Slowest spans: load" in capsys.readouterr().out
+    assert not tracing.enabled()
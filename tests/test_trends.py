@@ -0,0 +1,64 @@
+# tests/test_trends.py
+import datetime as dt
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from trends import TrendAccumulator
+
+TODAY = dt.date(2026, 10, 1)
+T = TODAY.toordinal()
+
+def bucket(rating: float) -> str:
+    return "positive" if rating >= 4 else "negative" if rating <= 2 else "neutral"
+
+def feed(rows: List[Tuple[int, float]], **kw: Any) -> Dict[str, Any]:
+    acc = TrendAccumulator(today=TODAY, **kw)
+    for day, rating in rows:
+        acc.add(day, rating, bucket(rating), frozenset({"Food"}) if rating <= 2 else frozenset())
+    return acc.result()
+
+def test_rolling_windows_are_inclusive_and_undated_only_count_in_all():
+    out = feed([(T, 5), (T - 7, 4), (T - 8, 1), (T - 365, 3), (T - 366, 5), (0, 2)])
+    rolling = out["rolling"]
+    assert rolling["last7"]["count"] == 2
+    assert rolling["last30"]["count"] == 3
+    assert rolling["last365"]["count"] == 4
+    assert rolling["all"]["count"] == 6 and out["undated_reviews"] == 1
+    assert rolling["last30"]["sentiment"] == {"positive": 2, "neutral": 0, "negative": 1}
+    assert rolling["last30"]["avg_rating"] == round(10 / 3, 2)
+
+def test_monthly_and_weekly_buckets():
+    out = feed([(T, 5), (T - 1, 1), (T - 3, 4), (T - 7, 4), (T - 40, 2)], months=2, weeks=2)
+    # Sep 30, 28 and 24 are in September; Aug 22 is before both horizons
+    assert [m["period"] for m in out["monthly"]] == ["2026-09", "2026-10"]
+    sep = out["monthly"][0]
+    assert sep["count"] == 3 and sep["themes"] == {"Food": {"mentions": 1, "negative": 1}}
+    # ISO weeks start on Monday: Sep 28 opens W40, Sep 24 is in W39
+    assert [(w["period"], w["count"]) for w in out["weekly"]] == [("2026-W39", 1), ("2026-W40", 3)]
+
+@pytest.mark.parametrize("recent, prior, signal", [(4.5, 3.5, "improving"), (3.0, 4.0, "declining"),
+                                                   (4.0, 4.1, "stable")])
+def test_direction_of_travel(recent, prior, signal):
+    rows = [(T - 10, recent)] * 10 + [(T - 100, prior)] * 10
+    d = feed(rows)["direction"]
+    assert d["signal"] == signal
+    assert d["last90"]["count"] == 10 and d["prior90"]["count"] == 10
+    assert d["delta_avg_rating"] == round(recent - prior, 2)
+
+def test_direction_needs_enough_reviews_on_both_sides():
+    d = feed([(T - 10, 5)] * 10 + [(T - 100, 1)] * 9)["direction"]
+    assert d["signal"] == "insufficient_data" and "delta_avg_rating" not in d
+
+def test_add_day_matches_add():
+    rows = [(T - i, (i % 5) + 1.0) for i in range(0, 400, 3)] + [(0, 3.0)]
+    by_day: Dict[int, List[float]] = {}
+    for day, rating in rows:
+        by_day.setdefault(day, []).append(rating)
+    acc = TrendAccumulator(today=TODAY)
+    for day, ratings in by_day.items():
+        b = [bucket(r) for r in ratings]
+        neg = b.count("negative")
+        acc.add_day(day, len(ratings), sum(ratings), b.count("positive"), b.count("neutral"), neg,
+                    {"Food": (neg, neg)} if neg else None)
+    assert acc.result() == feed(rows)
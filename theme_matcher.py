@@ -0,0 +1,89 @@
+# theme_matcher.py
+from __future__ import annotations
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Set
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+def _trie_pattern(words: Iterable[str], tail: str) -> str:
+    """
+    Regex alternation factored as a prefix trie, so the engine follows one
+    branch per character instead of trying every keyword. Longer
+    continuations are listed before the end-of-keyword option, so the
+    longest keyword at a position wins.
+    """
+    trie: Dict[str, Any] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if "" in node:
+            alts.append(tail)
+        if len(alts) == 1:
+            return alts[0]
+        return "(?:" + "|".join(alts) + ")"
+
+    return build(trie)
+
+class ThemeMatcher:
+    """
+    Compiled multi-keyword theme matcher. All keywords of all themes go into
+    one regex, so each review is lowercased once and scanned once.
+
+    Keywords must start on a word boundary ("cold" no longer hits "scold").
+    By default they may run on into a longer word ("portion" hits "portions",
+    "event" hits "events"); with `whole_words=True` they must also end on one.
+
+    The keywords are compiled into one trie-shaped regex, tried as a zero-width
+    lookahead at each word start, so cost grows with text length rather than
+    keyword count. The longest keyword at a position wins; shorter keywords
+    nested inside it (e.g. "staff" in "bar staff") are credited from a table
+    built at compile time, so no overlapping hit is lost.
+    """
+
+    def __init__(self, themes: Dict[str, Iterable[str]], *, whole_words: bool = False):
+        self.whole_words = whole_words
+        owners: Dict[str, Set[str]] = {}
+        for theme, words in themes.items():
+            for w in words:
+                w = w.strip().lower()
+                if w:
+                    owners.setdefault(w, set()).add(theme)
+        self.themes: List[str] = list(themes)
+        self.keyword_count = len(owners)
+
+        # keyword -> every theme it implies, including nested keywords
+        self._hits: Dict[str, FrozenSet[str]] = {
+            kw: frozenset(t for inner in self._nested(kw, owners) for t in owners[inner]) for kw in owners
+        }
+        tail = r"(?!\w)" if whole_words else ""
+        self._rx = re.compile(rf"(?<!\w)(?=({_trie_pattern(owners, tail)}))") if owners else None
+
+    def _nested(self, kw: str, owners: Dict[str, Set[str]]) -> List[str]:
+        """Keywords that also match wherever `kw` matches (including kw itself)."""
+        out = []
+        for s in range(len(kw)):
+            if s > 0 and _is_word(kw[s - 1]):
+                continue
+            for e in range(s + 1, len(kw) + 1):
+                if self.whole_words and e < len(kw) and _is_word(kw[e]):
+                    continue
+                if kw[s:e] in owners:
+                    out.append(kw[s:e])
+        return out
+
+    def match(self, text: str) -> FrozenSet[str]:
+        """Set of themes mentioned in `text`."""
+        if not text or self._rx is None:
+            return frozenset()
+        found: Set[str] = set()
+        for m in self._rx.finditer(text.lower()):
+            found |= self._hits[m.group(1)]
+            if len(found) == len(self.themes):
+                break
+        return frozenset(found)
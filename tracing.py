@@ -0,0 +1,267 @@
+# tracing.py
+from __future__ import annotations
+import functools, json, os, sys, threading, time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Span durations land in these histogram buckets (seconds) for the Prometheus export.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_EVENTS = 200_000   # trace-event cap; later spans still feed the histograms
+
+# ---------------- State ----------------
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.hist: Dict[str, List[float]] = {}   # name -> [count, sum, *bucket counts]
+        self.profiler: Any = None
+
+_state = _State()
+
+def enabled() -> bool:
+    return _state.enabled
+
+def enable(profile: Optional[str] = None, *, sample_interval: float = 0.005) -> None:
+    """Start recording. `profile` = "cprofile" or "sample" also starts a profiler."""
+    global _state
+    _state = _State()
+    _state.enabled = True
+    if profile == "cprofile":
+        import cProfile
+        _state.profiler = cProfile.Profile()
+        _state.profiler.enable()
+    elif profile == "sample":
+        _state.profiler = _Sampler(sample_interval)
+        _state.profiler.start()
+    elif profile:
+        raise RuntimeError(f"Unknown profiler '{profile}' (use cprofile or sample)")
+
+def disable() -> None:
+    _state.enabled = False
+    if _state.profiler is not None:
+        _state.profiler.disable()
+
+# ---------------- Spans & counters ----------------
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+_NULL = _NullSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record_span(self.name, self.start, end, self.attrs)
+
+    def set(self, **attrs: Any) -> None:
+        """Attach attributes discovered inside the span (counts, sizes...)."""
+        self.attrs.update(attrs)
+
+def span(name: str, **attrs: Any) -> Any:
+    """`with span("serpapi.page", data_id=...):` — a shared no-op object when tracing is off."""
+    if not _state.enabled:
+        return _NULL
+    return Span(name, attrs)
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of span(); when disabled it costs one flag check per call."""
+    def deco(fn: Callable[..., Any]) -> Callable[..., Any]:
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with Span(label, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    if not _state.enabled:
+        return
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _state.lock:
+        _state.counters[key] = _state.counters.get(key, 0) + value
+
+def _record_span(name: str, start: float, end: float, attrs: Dict[str, Any]) -> None:
+    dur = end - start
+    st = _state
+    with st.lock:
+        h = st.hist.get(name)
+        if h is None:
+            h = st.hist[name] = [0, 0.0] + [0] * len(BUCKETS)
+        h[0] += 1
+        h[1] += dur
+        for i, b in enumerate(BUCKETS):
+            if dur <= b:
+                h[2 + i] += 1
+        if len(st.events) < MAX_EVENTS:
+            st.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                              "ts": round((start - st.t0) * 1e6, 1), "dur": round(dur * 1e6, 1),
+                              "args": attrs})
+        else:
+            st.dropped += 1
+
+# ---------------- Profilers ----------------
+class _Sampler:
+    """
+    Poor man's sampling profiler: a daemon thread snapshots every thread's
+    stack each `interval` seconds and counts the collapsed stacks (the
+    "folded" format flamegraph.pl / speedscope read).
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(parts))] += 1
+
+    def disable(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+# ---------------- Export ----------------
+def export_json(path: Path) -> None:
+    """Chrome trace-event JSON (open in chrome://tracing or ui.perfetto.dev), plus counters."""
+    with _state.lock:
+        doc = {
+            "traceEvents": list(_state.events),
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _state.counters.items()],
+                "spans": {n: {"count": h[0], "total_s": round(h[1], 6)} for n, h in _state.hist.items()},
+                "dropped_events": _state.dropped,
+            },
+        }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(doc), encoding="utf-8")
+
+def _metric(name: str) -> str:
+    return "pubpulse_" + "".join(c if c.isalnum() else "_" for c in name)
+
+def _labels(pairs: Any) -> str:
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def export_prometheus(path: Path) -> None:
+    """Prometheus text exposition format (e.g. for node_exporter's textfile collector)."""
+    lines: List[str] = []
+    with _state.lock:
+        if _state.hist:
+            lines += ["# HELP pubpulse_span_seconds Duration of traced spans.",
+                      "# TYPE pubpulse_span_seconds histogram"]
+            for name in sorted(_state.hist):
+                h = _state.hist[name]
+                for i, b in enumerate(BUCKETS):
+                    lines.append(f'pubpulse_span_seconds_bucket{{span="{name}",le="{b:g}"}} {h[2 + i]}')
+                lines.append(f'pubpulse_span_seconds_bucket{{span="{name}",le="+Inf"}} {h[0]}')
+                lines.append(f'pubpulse_span_seconds_sum{{span="{name}"}} {h[1]:.6f}')
+                lines.append(f'pubpulse_span_seconds_count{{span="{name}"}} {h[0]}')
+        by_name: Dict[str, List[Tuple[Any, float]]] = {}
+        for (name, labels), v in _state.counters.items():
+            by_name.setdefault(name, []).append((labels, v))
+    for name in sorted(by_name):
+        metric = _metric(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        for labels, v in sorted(by_name[name]):
+            lines.append(f"{metric}{_labels(labels)} {v:g}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def export_profile(path: Path) -> Optional[Path]:
+    """cProfile -> .prof (pstats/snakeviz) + top-30 text; sampler -> folded stacks."""
+    prof = _state.profiler
+    if prof is None:
+        return None
+    prof.disable()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(prof, _Sampler):
+        path.write_text("".join(f"{s} {n}\n" for s, n in prof.stacks.most_common()), encoding="utf-8")
+        return path
+    import io, pstats
+    prof.dump_stats(str(path))
+    buf = io.StringIO()
+    pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(30)
+    path.with_suffix(".txt").write_text(buf.getvalue(), encoding="utf-8")
+    return path
+
+def summary(top: int = 10) -> List[Tuple[str, int, float]]:
+    """(span, count, total seconds) for the slowest spans by total time."""
+    with _state.lock:
+        rows = [(n, int(h[0]), h[1]) for n, h in _state.hist.items()]
+    return sorted(rows, key=lambda r: -r[2])[:top]
+
+# ---------------- CLI helpers ----------------
+def add_cli_args(ap: Any) -> None:
+    g = ap.add_argument_group("tracing")
+    g.add_argument("--trace", default=os.getenv("PUBPULSE_TRACE") or None,
+                   help="Write a Chrome trace-event JSON of stage spans here (env PUBPULSE_TRACE).")
+    g.add_argument("--metrics", default=os.getenv("PUBPULSE_METRICS") or None,
+                   help="Write span histograms + counters in Prometheus text format here (env PUBPULSE_METRICS).")
+    g.add_argument("--profile", choices=["cprofile", "sample"], default=None,
+                   help="Also profile the run (cprofile: .prof + top-30 text; sample: folded stacks).")
+    g.add_argument("--profile-out", default="pubpulse_profile.out", help="Profiler output path.")
+
+def start_from_args(args: Any) -> None:
+    if args.trace or args.metrics or args.profile:
+        enable(args.profile)
+
+def finish_from_args(args: Any) -> None:
+    if not _state.enabled:
+        return
+    if args.trace:
+        export_json(Path(args.trace))
+    if args.metrics:
+        export_prometheus(Path(args.metrics))
+    if args.profile:
+        export_profile(Path(args.profile_out))
+    rows = summary(6)
+    if rows:
+        print("[info] Slowest spans: " + ", ".join(f"{n} {t:.2f}s/{c}" for n, c, t in rows))
+    disable()
@@ -0,0 +1,256 @@
+# transport.py
+from __future__ import annotations
+import os, threading, time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from envfile import load_env
+from serp_cache import MODES as SERP_CACHE_MODES, ReplayMiss, SerpCache
+import tracing
+
+load_env()
+
+# -----------------------------
+# Config
+# -----------------------------
+@dataclass
+class TransportConfig:
+    """
+    Pool/timeouts for the shared HTTP layer. Base URLs can point at a local
+    stand-in server (e.g. http://127.0.0.1:8080) for testing.
+    """
+    serpapi_base_url: str = field(default_factory=lambda: os.getenv("SERPAPI_BASE_URL", "https://serpapi.com"))
+    openai_base_url: Optional[str] = field(default_factory=lambda: os.getenv("OPENAI_BASE_URL") or None)
+    pool_size: int = field(default_factory=lambda: int(os.getenv("PUBPULSE_POOL_SIZE", "10")))
+    connect_timeout: float = 10.0
+    read_timeout: float = field(default_factory=lambda: float(os.getenv("PUBPULSE_HTTP_TIMEOUT", "60")))
+    openai_timeout: float = 120.0
+    openai_max_retries: int = 2
+    # raw-response store: passthrough | record | replay (see serp_cache.py)
+    serpapi_cache_mode: str = field(default_factory=lambda: os.getenv("PUBPULSE_SERPAPI_CACHE", "passthrough"))
+    serpapi_cache_dir: str = field(default_factory=lambda: os.getenv("PUBPULSE_SERPAPI_CACHE_DIR",
+                                                                     str(Path(".cache") / "serpapi")))
+
+@dataclass
+class HostMetrics:
+    requests: int = 0
+    errors: int = 0
+    bytes_in: int = 0
+    total_s: float = 0.0
+    connections: int = 0     # new TCP/TLS connections opened (SerpAPI pool only)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "total_s": round(self.total_s, 3),
+            "avg_ms": round(1000 * self.total_s / self.requests, 1) if self.requests else None,
+            "connections": self.connections,
+            "reuse_ratio": round(1 - self.connections / self.requests, 3) if self.requests and self.connections else None,
+        }
+
+# -----------------------------
+# Errors
+# -----------------------------
+def transient_status(status: Optional[int]) -> bool:
+    """HTTP statuses worth retrying: throttling and server errors."""
+    return status is not None and (status == 429 or status >= 500)
+
+def error_status(payload: Dict[str, Any]) -> Optional[int]:
+    """HTTP status of an error payload from serpapi_get (None for 2xx or recorded responses)."""
+    return payload.get("http_status") if payload.get("error") else None
+
+# -----------------------------
+# Transport
+# -----------------------------
+class Transport:
+    """
+    One keep-alive connection pool per upstream, shared by resolver,
+    phase2_fetch and phase2b_summarize (and safe to share across threads).
+    requests/openai are imported here and on first OpenAI use, not at module
+    load, so offline runs never pay for them.
+    """
+
+    def __init__(self, config: Optional[TransportConfig] = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.config = config or TransportConfig()
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, HostMetrics] = {}
+        self._openai: Any = None
+        self.serp_cache: Optional[SerpCache] = None
+        if self.config.serpapi_cache_mode != "passthrough":
+            self.serp_cache = SerpCache(Path(self.config.serpapi_cache_dir), self.config.serpapi_cache_mode)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.config.pool_size, pool_block=True)
+        self._adapter = adapter
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def _record(self, host: str, elapsed: float, nbytes: int = 0, error: bool = False) -> None:
+        with self._lock:
+            m = self._metrics.setdefault(host, HostMetrics())
+            m.requests += 1
+            m.total_s += elapsed
+            m.bytes_in += nbytes
+            m.errors += int(error)
+
+    # -- SerpAPI --
+    def serpapi_get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Drop-in for `GoogleSearch(params).get_dict()`: error responses come
+        back as a dict with an `error` key rather than raising, plus
+        `http_status` when the status was >= 400. In replay mode
+        the response comes from the SerpAPI cache and nothing is sent; a
+        request that was never recorded raises ReplayMiss.
+        """
+        cache = self.serp_cache
+        if cache is not None and cache.mode == "replay":
+            with tracing.span("serpapi.replay", engine=params.get("engine")):
+                payload = cache.get(params)
+            tracing.count("serpapi_cache", result="hit" if payload is not None else "miss")
+            if payload is None:
+                raise ReplayMiss(f"SerpAPI replay miss for {params.get('engine')} request "
+                                 f"(record it first with --serpapi-cache record)")
+            return payload
+
+        import requests
+        url = self.config.serpapi_base_url.rstrip("/") + "/search.json"
+        host = urlsplit(url).netloc
+        t0 = time.perf_counter()
+        with tracing.span("serpapi.http", engine=params.get("engine")) as sp:
+            try:
+                resp = self._session.get(url, params=params,
+                                         timeout=(self.config.connect_timeout, self.config.read_timeout))
+            except requests.RequestException:
+                self._record(host, time.perf_counter() - t0, error=True)
+                tracing.count("http_requests", host=host, status="error")
+                raise
+            sp.set(status=resp.status_code, bytes=len(resp.content))
+        self._record(host, time.perf_counter() - t0, len(resp.content), error=resp.status_code >= 400)
+        tracing.count("http_requests", host=host, status=resp.status_code)
+        tracing.count("http_bytes_in", len(resp.content), host=host)
+        try:
+            payload = resp.json()
+        except ValueError:
+            return {"error": f"HTTP {resp.status_code} (non-JSON response)", "http_status": resp.status_code}
+        if resp.status_code >= 400 and isinstance(payload, dict):
+            payload.setdefault("error", f"HTTP {resp.status_code}")
+            payload["http_status"] = resp.status_code
+        if cache is not None and resp.status_code < 500 and resp.status_code != 429:
+            # throttling/server errors are not what the request "returns"; don't pin them
+            cache.put(params, payload, status=resp.status_code)
+            tracing.count("serpapi_cache", result="write")
+        return payload
+
+    # -- OpenAI --
+    def openai_client(self, api_key: str) -> Any:
+        """Shared OpenAI client on a pooled keep-alive httpx client (built on first use)."""
+        with self._lock:
+            if self._openai is None:
+                import httpx
+                from openai import OpenAI, DefaultHttpxClient
+
+                host = urlsplit(self.config.openai_base_url or "https://api.openai.com").netloc
+
+                def _on_response(resp: Any) -> None:
+                    resp.read()
+                    elapsed = resp.elapsed.total_seconds() if resp.elapsed else 0.0
+                    self._record(host, elapsed, len(resp.content), error=resp.status_code >= 400)
+
+                http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=self.config.pool_size,
+                                        max_keepalive_connections=self.config.pool_size),
+                    timeout=httpx.Timeout(self.config.openai_timeout, connect=self.config.connect_timeout),
+                    event_hooks={"response": [_on_response]},
+                )
+                self._openai = OpenAI(api_key=api_key,
+                                      base_url=self.config.openai_base_url,
+                                      max_retries=self.config.openai_max_retries,
+                                      http_client=http_client)
+            return self._openai
+
+    def openai_async_client(self, api_key: str) -> Any:
+        """
+        New AsyncOpenAI client, owned by the caller and bound to the running
+        event loop. SDK retries are off: llm_dispatch does its own, rate-aware.
+        """
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        host = urlsplit(self.config.openai_base_url or "https://api.openai.com").netloc
+
+        async def _on_response(resp: Any) -> None:
+            await resp.aread()
+            elapsed = resp.elapsed.total_seconds() if resp.elapsed else 0.0
+            self._record(host, elapsed, len(resp.content), error=resp.status_code >= 400)
+
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=self.config.pool_size,
+                                max_keepalive_connections=self.config.pool_size),
+            timeout=httpx.Timeout(self.config.openai_timeout, connect=self.config.connect_timeout),
+            event_hooks={"response": [_on_response]},
+        )
+        return AsyncOpenAI(api_key=api_key, base_url=self.config.openai_base_url,
+                           max_retries=0, http_client=http_client)
+
+    # -- Metrics --
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        # connection counts come straight from the urllib3 pools
+        pools = self._adapter.poolmanager.pools
+        with self._lock:
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None and pool.host:
+                    host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                    self._metrics.setdefault(host, HostMetrics()).connections = pool.num_connections
+            return {h: m.as_dict() for h, m in self._metrics.items()}
+
+    def close(self) -> None:
+        self._session.close()
+        if self._openai is not None:
+            self._openai.close()
+
+# -----------------------------
+# Process-wide default
+# -----------------------------
+_default: Optional[Transport] = None
+_default_lock = threading.Lock()
+
+def get_transport() -> Transport:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Transport()
+        return _default
+
+def offline() -> bool:
+    """True when SerpAPI calls are replayed from disk (no key or network needed)."""
+    return get_transport().config.serpapi_cache_mode == "replay"
+
+def add_cli_args(ap: Any) -> None:
+    g = ap.add_argument_group("SerpAPI response cache")
+    g.add_argument("--serpapi-cache", choices=SERP_CACHE_MODES, default=None,
+                   help="record: store every raw response; replay: serve them from disk with no API calls "
+                        "(env PUBPULSE_SERPAPI_CACHE, default passthrough).")
+    g.add_argument("--serpapi-cache-dir", default=None,
+                   help="Response store directory (env PUBPULSE_SERPAPI_CACHE_DIR, default .cache/serpapi).")
+
+def cache_overrides(args: Any) -> Dict[str, Any]:
+    """configure() kwargs for the SerpAPI cache flags that were given."""
+    return {k: v for k, v in (("serpapi_cache_mode", args.serpapi_cache),
+                              ("serpapi_cache_dir", args.serpapi_cache_dir)) if v}
+
+def configure(**overrides: Any) -> Transport:
+    """Replace the process-wide transport, e.g. configure(pool_size=16, serpapi_base_url=...)."""
+    global _default
+    with _default_lock:
+        if _default is not None:
+            _default.close()
+        _default = Transport(TransportConfig(**overrides))
+        return _default
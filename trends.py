@@ -0,0 +1,162 @@
+# trends.py
+from __future__ import annotations
+import datetime as dt
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+ROLLING_DAYS = (7, 30, 90, 180, 365)
+
+# direction-of-travel thresholds (last 90 days vs the 90 days before)
+DIRECTION_MIN_REVIEWS = 10
+DIRECTION_DELTA = 0.15
+
+# ---------------- Buckets ----------------
+class _Bucket:
+    __slots__ = ("count", "rating_sum", "pos", "neu", "neg", "themes")
+
+    def __init__(self):
+        self.count = 0
+        self.rating_sum = 0.0
+        self.pos = self.neu = self.neg = 0
+        self.themes: Dict[str, List[int]] = {}   # theme -> [mentions, negative mentions]
+
+    def add(self, rating: float, bucket: str, themes: Iterable[str] = ()) -> None:
+        self.count += 1
+        self.rating_sum += rating
+        if bucket == "positive": self.pos += 1
+        elif bucket == "negative": self.neg += 1
+        else: self.neu += 1
+        for t in themes:
+            c = self.themes.setdefault(t, [0, 0])
+            c[0] += 1
+            c[1] += bucket == "negative"
+
+    def add_counts(self, count: int, rating_sum: float, pos: int, neu: int, neg: int,
+                   themes: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+        """Merge pre-aggregated counts; themes map theme -> (mentions, negative mentions)."""
+        self.count += count
+        self.rating_sum += rating_sum
+        self.pos += pos
+        self.neu += neu
+        self.neg += neg
+        for t, (m, n) in (themes or {}).items():
+            c = self.themes.setdefault(t, [0, 0])
+            c[0] += m
+            c[1] += n
+
+    def avg(self) -> Optional[float]:
+        return round(self.rating_sum / self.count, 2) if self.count else None
+
+    def as_dict(self, with_themes: bool = True) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "count": self.count,
+            "avg_rating": self.avg(),
+            "sentiment": {"positive": self.pos, "neutral": self.neu, "negative": self.neg},
+        }
+        if with_themes:
+            # zero themes are left out to keep the facts compact
+            out["themes"] = {t: {"mentions": m, "negative": n} for t, (m, n) in sorted(self.themes.items())}
+        return out
+
+# ---------------- Accumulator ----------------
+class TrendAccumulator:
+    """
+    One sweep over the reviews fills every rolling window (7/30/90/180/365/all),
+    calendar-month and ISO-week buckets, plus the prior-90-day comparison used
+    for the direction-of-travel signal. Feed it with add(); read with result().
+    """
+
+    def __init__(self,
+                 *,
+                 today: Optional[dt.date] = None,
+                 rolling_days: Tuple[int, ...] = ROLLING_DAYS,
+                 months: int = 24,
+                 weeks: int = 26):
+        today = today or dt.date.today()
+        t = today.toordinal()
+        self.today = today
+        self._cuts = [(f"last{n}", t - n) for n in rolling_days]
+        self._prior90 = (t - 180, t - 90)              # [lo, hi) for the comparison window
+        self._month_lo = _month_start(today, months - 1).toordinal()
+        self._week_lo = t - today.weekday() - 7 * (weeks - 1)
+        self.rolling = {name: _Bucket() for name, _ in self._cuts}
+        self.all = _Bucket()
+        self.prior90 = _Bucket()
+        self.undated = 0
+        self.monthly: Dict[str, _Bucket] = {}
+        self.weekly: Dict[str, _Bucket] = {}
+
+    def add(self, day: int, rating: float, bucket: str, themes: FrozenSet[str] = frozenset()) -> None:
+        """`day` is a date ordinal (0 = undated)."""
+        self.all.add(rating, bucket)
+        if not day:
+            self.undated += 1
+            return
+        for name, cut in self._cuts:
+            if day >= cut:
+                self.rolling[name].add(rating, bucket)
+        if self._prior90[0] <= day < self._prior90[1]:
+            self.prior90.add(rating, bucket)
+        d = dt.date.fromordinal(day)
+        if day >= self._month_lo:
+            self.monthly.setdefault(f"{d.year:04d}-{d.month:02d}", _Bucket()).add(rating, bucket, themes)
+        if day >= self._week_lo:
+            y, w, _ = d.isocalendar()
+            self.weekly.setdefault(f"{y:04d}-W{w:02d}", _Bucket()).add(rating, bucket, themes)
+
+    def add_day(self, day: int, count: int, rating_sum: float, pos: int, neu: int, neg: int,
+                themes: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+        """add() for a whole day of reviews at once (see aggregates.PubAggregate)."""
+        self.all.add_counts(count, rating_sum, pos, neu, neg)
+        if not day:
+            self.undated += count
+            return
+        for name, cut in self._cuts:
+            if day >= cut:
+                self.rolling[name].add_counts(count, rating_sum, pos, neu, neg)
+        if self._prior90[0] <= day < self._prior90[1]:
+            self.prior90.add_counts(count, rating_sum, pos, neu, neg)
+        d = dt.date.fromordinal(day)
+        if day >= self._month_lo:
+            self.monthly.setdefault(f"{d.year:04d}-{d.month:02d}", _Bucket()).add_counts(
+                count, rating_sum, pos, neu, neg, themes)
+        if day >= self._week_lo:
+            y, w, _ = d.isocalendar()
+            self.weekly.setdefault(f"{y:04d}-W{w:02d}", _Bucket()).add_counts(
+                count, rating_sum, pos, neu, neg, themes)
+
+    def direction(self) -> Dict[str, Any]:
+        cur, prev = self.rolling.get("last90"), self.prior90
+        out: Dict[str, Any] = {
+            "basis": "last 90 days vs the 90 days before",
+            "last90": {"count": cur.count if cur else 0, "avg_rating": cur.avg() if cur else None},
+            "prior90": {"count": prev.count, "avg_rating": prev.avg()},
+        }
+        if not cur or cur.count < DIRECTION_MIN_REVIEWS or prev.count < DIRECTION_MIN_REVIEWS:
+            out["signal"] = "insufficient_data"
+            return out
+        delta = round(cur.avg() - prev.avg(), 2)
+        out["delta_avg_rating"] = delta
+        out["volume_change_pct"] = round(100.0 * (cur.count - prev.count) / prev.count, 1)
+        out["negative_share_change_pts"] = round(100.0 * (cur.neg / cur.count - prev.neg / prev.count), 1)
+        if delta >= DIRECTION_DELTA:
+            out["signal"] = "improving"
+        elif delta <= -DIRECTION_DELTA:
+            out["signal"] = "declining"
+        else:
+            out["signal"] = "stable"
+        return out
+
+    def result(self) -> Dict[str, Any]:
+        rolling = {name: b.as_dict(with_themes=False) for name, b in self.rolling.items()}
+        rolling["all"] = self.all.as_dict(with_themes=False)
+        return {
+            "rolling": rolling,
+            "monthly": [{"period": k, **self.monthly[k].as_dict()} for k in sorted(self.monthly)],
+            "weekly": [{"period": k, **self.weekly[k].as_dict()} for k in sorted(self.weekly)],
+            "undated_reviews": self.undated,
+            "direction": self.direction(),
+        }
+
+def _month_start(today: dt.date, months_back: int) -> dt.date:
+    y, m = divmod(today.year * 12 + today.month - 1 - months_back, 12)
+    return dt.date(y, m + 1, 1)